@@ -0,0 +1,64 @@
+"""Общие функции бенчмарков: перцентили и сравнение с базовой линией."""
+import json
+import math
+import os
+
+
+def percentile(values, fraction):
+    """Перцентиль по ближайшему рангу; values должны быть отсортированы."""
+    if not values:
+        return None
+    rank = max(math.ceil(fraction * len(values)), 1)
+    return values[rank - 1]
+
+
+def latency_summary(timings):
+    """p50/p95/p99 и среднее в миллисекундах."""
+    timings = sorted(timings)
+    return {
+        'p50': percentile(timings, 0.50),
+        'p95': percentile(timings, 0.95),
+        'p99': percentile(timings, 0.99),
+        'mean': sum(timings) / len(timings) if timings else None,
+    }
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_baseline(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(data, file, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temporary, path)
+
+
+def regressions(current, baseline, tolerance, slack_ms):
+    """
+    Описания регрессий current относительно baseline: p95 выросла больше
+    чем на tolerance (и на slack_ms, чтобы не ловить шум быстрых
+    маршрутов), выросло число запросов или изменился код ответа.
+    """
+    problems = []
+    for name, result in sorted(current.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        limit = max(base['p95'] * (1 + tolerance), base['p95'] + slack_ms)
+        if result['p95'] > limit:
+            problems.append(f'{name}: p95 {result["p95"]:.1f} мс, '
+                            f'было {base["p95"]:.1f} мс')
+        if result['queries'] > base['queries']:
+            problems.append(f'{name}: запросов {result["queries"]}, '
+                            f'было {base["queries"]}')
+        if result['status'] != base['status']:
+            problems.append(f'{name}: код {result["status"]}, '
+                            f'было {base["status"]}')
+    return problems
@@ -0,0 +1,240 @@
+"""
+Двухуровневый кэш: ограниченный LRU в памяти процесса перед общим
+бэкендом (L2) с защитой от одновременного пересчёта (stampede).
+
+Промах по ключу из SINGLE_FLIGHT достаётся одному процессу: он берёт
+в L2 блокировку и пересчитывает значение, остальные до LOCK_WAIT
+секунд ждут, пока оно появится. Кроме того, значение может быть
+объявлено промахом заранее, с вероятностью, растущей к концу срока
+жизни (probabilistic early recomputation, XFetch), поэтому популярный
+фрагмент пересчитывается до того, как истечёт у всех сразу.
+"""
+import math
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import metrics
+
+# L1 общий для всех потоков процесса: экземпляры бэкенда у Django
+# свои в каждом потоке.
+_stores = {}
+_locks = {}
+
+LOCK_PREFIX = 'lock:'
+# Отличает промах от закэшированного None
+MISSING = object()
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.l2_alias = options.get('L2', 'shared')
+        self.l1_max_entries = options.get('L1_MAX_ENTRIES', 1000)
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.l1_bypass = tuple(options.get('L1_BYPASS', ('generation:',)))
+        # Блокировка нужна только ключам, за промахом которых гарантированно
+        # следует запись; по умолчанию это фрагменты тега {% cache %}.
+        self.single_flight_prefixes = tuple(
+            options.get('SINGLE_FLIGHT', ('template.cache.',)))
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 30)
+        self.lock_wait = options.get('LOCK_WAIT', 2.0)
+        self.beta = options.get('EARLY_RECOMPUTE_BETA', 1.0)
+        self.evictions = 0
+        self._store = _stores.setdefault(location, OrderedDict())
+        self._lock = _locks.setdefault(location, threading.Lock())
+        self._miss_started = {}
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def bypass(self, key):
+        """Ключи, которые живут только в L2 как есть (счётчики)."""
+        return key.startswith(self.l1_bypass)
+
+    # L1
+
+    def l1_get(self, key):
+        with self._lock:
+            item = self._store.get(key)
+            if item is None:
+                return None
+            expires, pickled = item
+            if expires < time.monotonic():
+                del self._store[key]
+                return None
+            self._store.move_to_end(key)
+        return pickle.loads(pickled)
+
+    def l1_set(self, key, envelope):
+        value, expires_at, delta = envelope
+        timeout = self.l1_timeout
+        if expires_at is not None:
+            timeout = min(timeout, expires_at - time.time())
+        if timeout <= 0:
+            return
+        pickled = pickle.dumps(envelope, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._store[key] = (time.monotonic() + timeout, pickled)
+            self._store.move_to_end(key)
+            while len(self._store) > self.l1_max_entries:
+                evicted, _ = self._store.popitem(last=False)
+                self.evictions += 1
+                metrics.cache_eviction(evicted.split(':', 2)[-1])
+
+    def l1_delete(self, key):
+        with self._lock:
+            self._store.pop(key, None)
+
+    # Конверт значения в L2: (значение, момент истечения, время пересчёта)
+
+    def envelope(self, key, value, timeout):
+        now = time.time()
+        delta = now - self._miss_started.pop(key, now)
+        expires_at = None if timeout is None else now + timeout
+        return value, expires_at, delta
+
+    def early_expired(self, envelope):
+        _, expires_at, delta = envelope
+        if expires_at is None or not delta:
+            return False
+        jitter = -delta * self.beta * math.log(random.random() or 1e-12)
+        return time.time() + jitter >= expires_at
+
+    def lookup(self, key, version):
+        """Конверт из L1 или L2, None при промахе."""
+        full_key = self.make_key(key, version)
+        envelope = self.l1_get(full_key)
+        if envelope is None:
+            envelope = self.l2.get(key, version=version)
+            if envelope is not None:
+                self.l1_set(full_key, envelope)
+        return envelope
+
+    def acquire(self, key, version):
+        return self.l2.add(LOCK_PREFIX + key, 1, self.lock_timeout,
+                           version=version)
+
+    def release(self, key, version):
+        self.l2.delete(LOCK_PREFIX + key, version=version)
+
+    def single_flight(self, key):
+        return key.startswith(self.single_flight_prefixes)
+
+    def miss(self, key, version):
+        # Промахи без последующей записи (sorl и т. п.) не копятся.
+        if len(self._miss_started) >= self.l1_max_entries:
+            self._miss_started.clear()
+        self._miss_started[key] = time.time()
+
+    # API кэша Django
+
+    def get(self, key, default=None, version=None):
+        value = self.lookup_value(key, MISSING, version)
+        metrics.cache_lookups([key], () if value is MISSING else (key,))
+        return default if value is MISSING else value
+
+    def lookup_value(self, key, default, version):
+        if self.bypass(key):
+            return self.l2.get(key, default, version=version)
+        envelope = self.lookup(key, version)
+        single_flight = self.single_flight(key)
+        if envelope is not None:
+            if not self.early_expired(envelope):
+                return envelope[0]
+            # Ранний пересчёт достаётся только взявшему блокировку.
+            if single_flight and not self.acquire(key, version):
+                return envelope[0]
+            self.miss(key, version)
+            return default
+        if not single_flight or self.acquire(key, version):
+            self.miss(key, version)
+            return default
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            envelope = self.l2.get(key, version=version)
+            if envelope is not None:
+                self.l1_set(self.make_key(key, version), envelope)
+                return envelope[0]
+        self.miss(key, version)
+        return default
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            if self.bypass(key):
+                missing.append(key)
+                continue
+            envelope = self.l1_get(self.make_key(key, version))
+            if envelope is not None:
+                found[key] = envelope[0]
+            else:
+                missing.append(key)
+        if missing:
+            for key, envelope in self.l2.get_many(
+                    missing, version=version).items():
+                if self.bypass(key):
+                    found[key] = envelope
+                    continue
+                self.l1_set(self.make_key(key, version), envelope)
+                found[key] = envelope[0]
+        for key in keys:
+            if key not in found and not self.bypass(key):
+                self.miss(key, version)
+        metrics.cache_lookups(keys, found)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.bypass(key):
+            return self.l2.set(key, value, timeout, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        timeout = None if timeout is None else timeout - time.time()
+        envelope = self.envelope(key, value, timeout)
+        self.l2.set(key, envelope, timeout, version=version)
+        self.l1_set(self.make_key(key, version), envelope)
+        if self.single_flight(key):
+            self.release(key, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        for key, value in data.items():
+            self.set(key, value, timeout, version=version)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.bypass(key):
+            return self.l2.add(key, value, timeout, version=version)
+        timeout = self.get_backend_timeout(timeout)
+        timeout = None if timeout is None else timeout - time.time()
+        envelope = self.envelope(key, value, timeout)
+        added = self.l2.add(key, envelope, timeout, version=version)
+        if added:
+            self.l1_set(self.make_key(key, version), envelope)
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        if self.bypass(key):
+            return self.l2.incr(key, delta, version=version)
+        return super().incr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self.l1_delete(self.make_key(key, version))
+        self.l2.delete(key, version=version)
+
+    def has_key(self, key, version=None):
+        if self.bypass(key):
+            return self.l2.has_key(key, version=version)
+        return self.lookup(key, version) is not None
+
+    def clear(self):
+        with self._lock:
+            self._store.clear()
+        self.l2.clear()
@@ -0,0 +1,169 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from core.benchmarks import (latency_summary, load_baseline, regressions,
+                             save_baseline)
+from core.queries import QueryRecorder
+from posts.models import Comment, Follow, Group, Post, User, UserStats
+
+NAMESPACES = ('posts', 'users', 'about')
+# GET этих маршрутов меняет данные или сессию клиента
+SKIPPED = {'posts:profile_follow', 'posts:profile_unfollow', 'users:logout'}
+# Строка запроса маршрута: ключ в samples
+QUERY_SAMPLES = {'posts:search': 'q'}
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'views.json')
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число запросов и размер ответа всех '
+            'маршрутов posts, users и about для гостя и вошедшего '
+            'пользователя и сравнивает с базовой линией')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--cold', action='store_true',
+                            help='очищать кэш перед каждым запросом')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument('--save', action='store_true',
+                            help='записать результаты как базовую линию')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='допустимый рост p95 (доля)')
+        parser.add_argument('--slack', type=float, default=2.0,
+                            help='допустимый рост p95 в мс для быстрых '
+                                 'маршрутов')
+        parser.add_argument('--restore',
+                            help='сначала восстановить базу из снимка '
+                                 'seed_load')
+        parser.add_argument('routes', nargs='*',
+                            help='только эти маршруты (posts:index, ...)')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            call_command('seed_load', restore=options['restore'],
+                         stdout=self.stdout)
+        self.options = options
+        samples = self.samples()
+        clients = {'anon': Client()}
+        if samples['reader'] is not None:
+            clients['auth'] = Client()
+            clients['auth'].force_login(samples['reader'])
+        results = {}
+        # Без debug toolbar и записи connection.queries, как в продакшене.
+        with override_settings(DEBUG=False):
+            for route in self.routes(options['routes']):
+                url = self.url(route, samples)
+                if url is None:
+                    self.stdout.write(f'{route}: нет данных для параметров, '
+                                      f'пропущен')
+                    continue
+                for client_name, client in clients.items():
+                    name = f'{route} {client_name}'
+                    results[name] = self.measure(client, url)
+                    self.report(name, results[name])
+        self.compare(results, samples['dataset'])
+
+    def samples(self):
+        """Самые тяжёлые объекты базы для параметров маршрутов."""
+        post = Post.objects.order_by('-comment_count', '-pk').first()
+        group = Group.objects.annotate(
+            total=Count('posts')).order_by('-total').first()
+        author = UserStats.objects.select_related('user').order_by(
+            '-followers_count').first()
+        reader = UserStats.objects.select_related('user').order_by(
+            '-follows_count').first()
+        return {
+            'post_id': post.pk if post else None,
+            # Частое слово - тяжёлый для поиска запрос.
+            'q': post.text.split()[0] if post else None,
+            'slug': group.slug if group else None,
+            'username': author.user.username if author else None,
+            'reader': reader.user if reader else None,
+            'dataset': {model.__name__: model.objects.count()
+                        for model in (User, Post, Comment, Follow)},
+        }
+
+    def routes(self, wanted):
+        resolver = get_resolver()
+        for namespace in NAMESPACES:
+            _, sub_resolver = resolver.namespace_dict[namespace]
+            for pattern in sub_resolver.url_patterns:
+                route = f'{namespace}:{pattern.name}'
+                if route in SKIPPED or (wanted and route not in wanted):
+                    continue
+                yield route
+
+    def url(self, route, samples):
+        namespace, name = route.split(':')
+        _, sub_resolver = get_resolver().namespace_dict[namespace]
+        pattern = next(pattern for pattern in sub_resolver.url_patterns
+                       if pattern.name == name)
+        kwargs = {key: samples.get(key)
+                  for key in pattern.pattern.converters}
+        query = QUERY_SAMPLES.get(route)
+        if None in kwargs.values() or (query and samples[query] is None):
+            return None
+        url = reverse(route, kwargs=kwargs)
+        return f'{url}?{urlencode({query: samples[query]})}' if query else url
+
+    def measure(self, client, url):
+        options = self.options
+        for _ in range(options['warmup']):
+            client.get(url)
+        timings, queries, size, status = [], 0, 0, None
+        for _ in range(options['repeat']):
+            if options['cold']:
+                cache.clear()
+            recorder = QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries = max(queries, recorder.count)
+            size = len(response.content)
+            status = response.status_code
+        return {**latency_summary(timings), 'queries': queries,
+                'bytes': size, 'status': status}
+
+    def report(self, name, result):
+        self.stdout.write(
+            f'{name:<32} p50 {result["p50"]:7.1f}  p95 {result["p95"]:7.1f}'
+            f'  p99 {result["p99"]:7.1f} мс  запросов {result["queries"]:3}'
+            f'  {result["bytes"]:8} байт  {result["status"]}')
+
+    def compare(self, results, dataset):
+        options = self.options
+        baseline = load_baseline(options['baseline'])
+        if options['save'] or baseline is None:
+            # Замер части маршрутов обновляет только их.
+            routes = (baseline or {}).get('routes', {})
+            save_baseline(options['baseline'], {
+                'created': timezone.now().isoformat(),
+                'dataset': dataset,
+                'cold': options['cold'],
+                'routes': {**routes, **results},
+            })
+            self.stdout.write(self.style.SUCCESS(
+                f'Базовая линия записана: {options["baseline"]}'))
+            return
+        if baseline.get('dataset') != dataset:
+            self.stdout.write(self.style.WARNING(
+                f'База отличается от базовой линии: {dataset}, '
+                f'было {baseline.get("dataset")}'))
+        problems = regressions(results, baseline['routes'],
+                               options['tolerance'], options['slack'])
+        if problems:
+            raise CommandError('Регрессии:\n' + '\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS(
+            f'Регрессий нет (допуск p95 {options["tolerance"]:.0%})'))
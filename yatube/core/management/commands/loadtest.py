@@ -0,0 +1,277 @@
+import io
+import json
+import os
+import random
+import signal
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test import override_settings
+from PIL import Image
+
+from core import metrics
+from core.benchmarks import latency_summary
+from posts.management.commands.seed_load import PASSWORD
+from posts.models import Group, Post, UserStats
+
+# Доли сценариев в смеси по умолчанию
+MIX = {
+    'index': 40,
+    'group': 10,
+    'profile': 10,
+    'post_detail': 10,
+    'follow_index': 15,
+    'add_comment': 10,
+    'post_create': 5,
+}
+# Границы корзин гистограммы задержек, мс
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Без строки лога на каждый запрос: она мерялась бы вместе с ним."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def stop(*args):
+    # os._exit не вызывает atexit: снимок метрик сбрасывается явно.
+    metrics.registry.flush(force=True)
+    os._exit(0)
+
+
+def serve(server, debug):
+    """Тело процесса-сервера: принимает соединения с общего сокета."""
+    signal.signal(signal.SIGTERM, stop)
+    with override_settings(DEBUG=debug):
+        server.serve_forever()
+
+
+def start_servers(processes, debug):
+    """Pre-fork: сокет слушает родитель, запросы принимают дочерние."""
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+    server.set_app(get_wsgi_application())
+    # Дочерним процессам не нужны соединения родителя.
+    connections.close_all()
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve(server, debug)
+            finally:
+                os._exit(0)
+        children.append(pid)
+    host, port = server.server_address
+    server.socket.close()
+    return f'http://{host}:{port}', children
+
+
+def stop_servers(children):
+    for pid in children:
+        os.kill(pid, signal.SIGTERM)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def jpeg(rng):
+    """Маленькая картинка уникального цвета: каждая загрузка - новый файл."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), tuple(rng.randrange(256) for _ in range(3))
+              ).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class LoadClient:
+    """Один пользователь: анонимная и вошедшая сессии, свой генератор."""
+
+    def __init__(self, base, username, samples, mix, seed):
+        self.base = base
+        self.username = username
+        self.samples = samples
+        self.rng = random.Random(seed)
+        self.scenarios, self.weights = zip(*mix.items())
+        self.anonymous = requests.Session()
+        self.session = requests.Session()
+        self.results = []
+
+    def login(self):
+        url = f'{self.base}/auth/login/'
+        self.session.get(url)
+        response = self.session.post(url, allow_redirects=False, data={
+            'username': self.username,
+            'password': PASSWORD,
+            'csrfmiddlewaretoken': self.session.cookies['csrftoken'],
+        })
+        if response.status_code != 302:
+            raise CommandError(f'{self.username} не вошёл: '
+                               f'{response.status_code}')
+
+    def post(self, path, **kwargs):
+        return self.session.post(
+            self.base + path, allow_redirects=False,
+            headers={'X-CSRFToken': self.session.cookies['csrftoken']},
+            **kwargs)
+
+    def request(self, scenario):
+        choice = self.rng.choice
+        if scenario == 'index':
+            return self.anonymous.get(f'{self.base}/?page='
+                                      f'{self.rng.randint(1, 5)}')
+        if scenario == 'group':
+            return self.anonymous.get(
+                f'{self.base}/group/{choice(self.samples["slugs"])}/')
+        if scenario == 'profile':
+            return self.anonymous.get(
+                f'{self.base}/profile/{choice(self.samples["authors"])}/')
+        if scenario == 'post_detail':
+            return self.session.get(
+                f'{self.base}/posts/{choice(self.samples["posts"])}/')
+        if scenario == 'follow_index':
+            return self.session.get(f'{self.base}/follow/')
+        if scenario == 'add_comment':
+            return self.post(
+                f'/posts/{choice(self.samples["posts"])}/comment/',
+                data={'text': f'Нагрузочный комментарий {self.rng.random()}'})
+        if scenario == 'post_create':
+            return self.post('/create/', data={
+                'text': f'Нагрузочный пост {self.rng.random()}',
+            }, files={'image': ('load.jpg', jpeg(self.rng), 'image/jpeg')})
+        raise ValueError(scenario)
+
+    def run(self, deadline):
+        while time.monotonic() < deadline:
+            scenario = self.rng.choices(self.scenarios, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                status = self.request(scenario).status_code
+            except requests.RequestException as error:
+                status = type(error).__name__
+            self.results.append(
+                (scenario, status, (time.perf_counter() - started) * 1000))
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест: поднимает приложение в многопроцессном '
+            'многопоточном WSGI-сервере и гоняет смесь запросов от '
+            'многих клиентов (нужна база seed_load)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2,
+                            help='процессов сервера (в каждом - поток на '
+                                 'запрос)')
+        parser.add_argument('--clients', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=30,
+                            help='секунд нагрузки')
+        parser.add_argument('--mix', default='',
+                            help='доли сценариев: index=40,add_comment=10')
+        parser.add_argument('--url',
+                            help='нагружать уже запущенный сервер')
+        parser.add_argument('--debug', action='store_true',
+                            help='оставить DEBUG (и debug toolbar)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', help='записать отчёт в файл')
+
+    def handle(self, *args, **options):
+        mix = dict(MIX)
+        for item in filter(None, options['mix'].split(',')):
+            name, _, weight = item.partition('=')
+            if name not in MIX:
+                raise CommandError(f'Нет сценария {name}')
+            mix[name] = float(weight)
+        mix = {name: weight for name, weight in mix.items() if weight > 0}
+        samples = self.samples(options['clients'])
+        children = []
+        base = options['url']
+        if base is None:
+            base, children = start_servers(options['processes'],
+                                           options['debug'])
+        try:
+            clients = [
+                LoadClient(base, username, samples, mix,
+                           options['seed'] * 1000 + index)
+                for index, username in enumerate(samples['readers'])
+            ]
+            for client in clients:
+                client.login()
+            deadline = time.monotonic() + options['duration']
+            threads = [threading.Thread(target=client.run, args=(deadline,))
+                       for client in clients]
+            started = time.monotonic()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - started
+        finally:
+            stop_servers(children)
+        results = [row for client in clients for row in client.results]
+        report = self.report(results, elapsed)
+        if options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+    def samples(self, clients):
+        readers = list(UserStats.objects.filter(
+            user__username__startswith='seed').order_by(
+            '-follows_count').values_list('user__username', flat=True)[
+            :clients])
+        if len(readers) < clients:
+            raise CommandError('Недостаточно пользователей seed_load: '
+                               'сначала выполните manage.py seed_load')
+        # Свежие посты: их и читают, и комментируют.
+        posts = list(Post.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:1000])
+        return {
+            'readers': readers,
+            'posts': posts,
+            'slugs': list(Group.objects.values_list('slug', flat=True)[:100]),
+            'authors': list(UserStats.objects.order_by(
+                '-followers_count').values_list('user__username',
+                                                flat=True)[:100]),
+        }
+
+    def report(self, results, elapsed):
+        by_scenario = defaultdict(list)
+        for scenario, status, latency in results:
+            by_scenario[scenario].append((status, latency))
+        report = {'elapsed': elapsed, 'requests': len(results),
+                  'rps': len(results) / elapsed, 'scenarios': {}}
+        self.stdout.write(f'{len(results)} запросов за {elapsed:.1f} с, '
+                          f'{report["rps"]:.1f} запросов/с')
+        for scenario, rows in sorted(by_scenario.items()):
+            latencies = [latency for _, latency in rows]
+            errors = [status for status, _ in rows
+                      if not isinstance(status, int) or status >= 400]
+            histogram = [0] * (len(BUCKETS) + 1)
+            for latency in latencies:
+                histogram[sum(latency > bound for bound in BUCKETS)] += 1
+            summary = latency_summary(latencies)
+            report['scenarios'][scenario] = {
+                **summary,
+                'requests': len(rows),
+                'rps': len(rows) / elapsed,
+                'error_rate': len(errors) / len(rows),
+                'errors': {str(status): errors.count(status)
+                           for status in set(errors)},
+                'histogram': dict(zip(
+                    [f'<={bound}' for bound in BUCKETS] + [f'>{BUCKETS[-1]}'],
+                    histogram)),
+            }
+            self.stdout.write(
+                f'{scenario:<13} {len(rows) / elapsed:7.1f}/с  p50 '
+                f'{summary["p50"]:7.1f}  p95 {summary["p95"]:7.1f}  p99 '
+                f'{summary["p99"]:7.1f} мс  ошибок '
+                f'{len(errors) / len(rows):.1%}')
+            self.stdout.write('    ' + '  '.join(
+                f'{bucket}:{count}' for bucket, count in
+                report['scenarios'][scenario]['histogram'].items()))
+        return report
@@ -0,0 +1,112 @@
+import json
+import os
+import pstats
+import sysconfig
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+from core.benchmarks import latency_summary
+
+SORT_FIELDS = {'tottime': 2, 'cumtime': 3}
+SQL_WIDTH = 120
+
+
+def location(filename, line, function):
+    """Короткое место функции: путь от проекта, пакета или stdlib."""
+    if 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[-1]
+    else:
+        for root in (settings.BASE_DIR, sysconfig.get_paths()['stdlib']):
+            if filename.startswith(root + os.sep):
+                filename = os.path.relpath(filename, root)
+                break
+    if filename == '~':
+        return function
+    return f'{filename}:{line}({function})'
+
+
+def totals(rows, key):
+    """Число и суммарное время по ключу: {key: [count, ms]}."""
+    result = defaultdict(lambda: [0, 0.0])
+    for row in rows:
+        result[row[key]][0] += 1
+        result[row[key]][1] += row['ms']
+    return sorted(result.items(), key=lambda item: -item[1][1])
+
+
+class Command(BaseCommand):
+    help = ('Сводит сохранённые ProfilingMiddleware профили: самые '
+            'дорогие функции, SQL-запросы и шаблоны')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILING_DIR)
+        parser.add_argument('--view',
+                            help='только профили этого маршрута '
+                                 '(posts:profile, ...)')
+        parser.add_argument('--last', type=int,
+                            help='только последние N профилей')
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--sort', choices=sorted(SORT_FIELDS),
+                            default='tottime')
+        parser.add_argument('--token', action='store_true',
+                            help='напечатать значение заголовка X-Profile '
+                                 'и выйти')
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(profiling.make_token())
+            return
+        profiles = []
+        for path in profiling.profile_paths(options['dir']):
+            with open(path + '.json') as file:
+                meta = json.load(file)
+            if options['view'] and meta.get('view') != options['view']:
+                continue
+            profiles.append((path, meta))
+        if options['last']:
+            profiles = profiles[-options['last']:]
+        if not profiles:
+            raise CommandError(f'Нет профилей в {options["dir"]}')
+        self.limit = options['limit']
+        self.summary([meta for _, meta in profiles])
+        self.functions([path + '.prof' for path, _ in profiles],
+                       SORT_FIELDS[options['sort']], len(profiles))
+        self.sql([meta for _, meta in profiles], len(profiles))
+        self.templates([meta for _, meta in profiles], len(profiles))
+
+    def summary(self, metas):
+        durations = latency_summary([meta['duration_ms'] for meta in metas])
+        views = Counter(meta.get('view') for meta in metas)
+        self.stdout.write(
+            f'Профилей: {len(metas)}, p50 {durations["p50"]:.1f} мс, '
+            f'p95 {durations["p95"]:.1f} мс')
+        self.stdout.write('  ' + ', '.join(
+            f'{view}: {count}' for view, count in views.most_common()))
+
+    def functions(self, files, field, count):
+        stats = pstats.Stats(*files)
+        rows = sorted(stats.stats.items(), key=lambda item: -item[1][field])
+        self.stdout.write('\nФункции (мс на профиль: собственное / '
+                          'с вызванными, вызовов):')
+        for key, (_, calls, tottime, cumtime, _) in rows[:self.limit]:
+            self.stdout.write(
+                f'{tottime * 1000 / count:9.2f} {cumtime * 1000 / count:9.2f}'
+                f' {calls / count:8.1f}  {location(*key)}')
+
+    def sql(self, metas, count):
+        rows = [query for meta in metas for query in meta['sql']]
+        self.stdout.write('\nSQL (мс на профиль, выполнений на профиль):')
+        for sql, (calls, ms) in totals(rows, 'sql')[:self.limit]:
+            self.stdout.write(f'{ms / count:9.2f} {calls / count:8.1f}  '
+                              f'{sql[:SQL_WIDTH]}')
+
+    def templates(self, metas, count):
+        rows = [template for meta in metas for template in meta['templates']]
+        self.stdout.write('\nШаблоны (мс на профиль с вложенными, '
+                          'отрисовок на профиль):')
+        for name, (calls, ms) in totals(rows, 'name')[:self.limit]:
+            self.stdout.write(f'{ms / count:9.2f} {calls / count:8.1f}  '
+                              f'{name}')
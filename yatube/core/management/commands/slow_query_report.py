@@ -0,0 +1,74 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import latency_summary
+from core.slow_queries import read_log
+
+SQL_WIDTH = 300
+
+
+def most_common(counter):
+    """Самое частое значение и сколько ещё других."""
+    value, _ = counter.most_common(1)[0]
+    others = len(counter) - 1
+    return f'{value} (и ещё {others})' if others else value
+
+
+class Command(BaseCommand):
+    help = ('Сводит журнал медленных SQL по отпечаткам запросов и '
+            'сортирует по суммарному времени')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=settings.SLOW_QUERY_LOG)
+        parser.add_argument('--view',
+                            help='только запросы этого маршрута')
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--plans', action='store_true',
+                            help='показать план самого медленного запуска')
+
+    def handle(self, *args, **options):
+        groups = defaultdict(list)
+        for entry in read_log(options['log']):
+            if options['view'] and entry['view'] != options['view']:
+                continue
+            groups[entry['fingerprint']].append(entry)
+        if not groups:
+            raise CommandError(f'Нет записей в {options["log"]}')
+        ranked = sorted(groups.items(),
+                        key=lambda item: -sum(e['ms'] for e in item[1]))
+        total = sum(entry['ms'] for entries in groups.values()
+                    for entry in entries)
+        self.stdout.write(f'Запросов: {sum(map(len, groups.values()))}, '
+                          f'отпечатков: {len(groups)}, всего '
+                          f'{total / 1000:.1f} с')
+        for fingerprint, entries in ranked[:options['limit']]:
+            self.report(fingerprint, entries, total, options['plans'])
+
+    def report(self, fingerprint, entries, total, plans):
+        timings = [entry['ms'] for entry in entries]
+        summary = latency_summary(timings)
+        slowest = max(entries, key=lambda entry: entry['ms'])
+        self.stdout.write(
+            f'\n{fingerprint}  {sum(timings):.0f} мс '
+            f'({sum(timings) / total:.0%}), {len(entries)} раз, '
+            f'среднее {summary["mean"]:.1f}, p95 {summary["p95"]:.1f}, '
+            f'макс {slowest["ms"]:.1f} мс')
+        self.stdout.write(f'  {slowest["sql"][:SQL_WIDTH]}')
+        self.stdout.write(f'  параметры: {slowest["params"] or "-"}')
+        self.stdout.write('  маршруты: ' + ', '.join(
+            f'{view}: {count}' for view, count in
+            Counter(entry['view'] for entry in entries).most_common(3)))
+        code = Counter(' <- '.join(entry['code']) for entry in entries
+                       if entry['code'])
+        if code:
+            self.stdout.write(f'  код: {most_common(code)}')
+        templates = Counter(entry['template'] for entry in entries
+                            if entry['template'])
+        if templates:
+            self.stdout.write(f'  шаблон: {most_common(templates)}')
+        if plans and slowest['plan']:
+            self.stdout.write('  план:')
+            for line in slowest['plan']:
+                self.stdout.write(f'    {line}')
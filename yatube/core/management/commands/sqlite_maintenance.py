@@ -0,0 +1,129 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+TASKS = ('checkpoint', 'optimize', 'analyze', 'incremental_vacuum')
+INCREMENTAL = 2
+
+
+def due_tasks(tasks, last_run, now, periods):
+    """Задачи, период которых истёк с последнего запуска."""
+    return [task for task in tasks
+            if now - last_run.get(task, float('-inf')) >= periods[task]]
+
+
+def megabytes(path):
+    return os.path.getsize(path) / 2**20 if os.path.exists(path) else 0.0
+
+
+class Command(BaseCommand):
+    help = ('Обслуживание базы SQLite: контрольная точка WAL, PRAGMA '
+            'optimize, ANALYZE и инкрементальный VACUUM; разово (cron) '
+            'или по расписанию SQLITE_MAINTENANCE (--loop)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tasks', nargs='*',
+                            help=f'по умолчанию все: {", ".join(TASKS)}')
+        parser.add_argument('--loop', action='store_true',
+                            help='не завершаться: запускать задачи по '
+                                 'расписанию SQLITE_MAINTENANCE')
+        parser.add_argument('--analysis-limit', type=int, default=1000,
+                            help='строк индекса на ANALYZE (0 - все)')
+        parser.add_argument('--vacuum-pages', type=int, default=10000,
+                            help='сколько свободных страниц вернуть за '
+                                 'раз (0 - все)')
+        parser.add_argument('--enable-incremental-vacuum',
+                            action='store_true',
+                            help='включить auto_vacuum=INCREMENTAL '
+                                 '(полный VACUUM, база блокируется)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда только для SQLite')
+        self.options = options
+        self.path = settings.DATABASES[connection.alias]['NAME']
+        tasks = options['tasks'] or list(TASKS)
+        unknown = set(tasks) - set(TASKS)
+        if unknown:
+            raise CommandError(f'Нет задач: {", ".join(sorted(unknown))}')
+        if options['enable_incremental_vacuum']:
+            self.timed('enable_incremental_vacuum')
+        if not options['loop']:
+            self.run(tasks)
+            return
+        periods = settings.SQLITE_MAINTENANCE
+        last_run = {}
+        while True:
+            now = time.monotonic()
+            due = due_tasks(tasks, last_run, now, periods)
+            if due:
+                self.run(due)
+                for task in due:
+                    last_run[task] = now
+            time.sleep(max(1, min(
+                last_run[task] + periods[task] for task in tasks
+            ) - time.monotonic()))
+
+    def pragma(self, statement):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {statement}')
+            return cursor.fetchall()
+
+    def sizes(self):
+        pages, free = (self.pragma('page_count')[0][0],
+                       self.pragma('freelist_count')[0][0])
+        return (f'база {megabytes(self.path):.1f} МБ, WAL '
+                f'{megabytes(self.path + "-wal"):.1f} МБ, свободных '
+                f'страниц {free} из {pages}')
+
+    def run(self, tasks):
+        self.stdout.write(f'{time.strftime("%Y-%m-%d %H:%M:%S")} '
+                          f'{self.sizes()}')
+        for task in tasks:
+            self.timed(task)
+        self.stdout.write(f'  после: {self.sizes()}')
+
+    def timed(self, task):
+        started = time.monotonic()
+        result = getattr(self, task)()
+        elapsed = (time.monotonic() - started) * 1000
+        self.stdout.write(f'  {task}: {elapsed:.0f} мс'
+                          f'{", " + result if result else ""}')
+
+    def checkpoint(self):
+        # TRUNCATE: WAL переносится в базу и обнуляется, если ему не
+        # мешают читатели.
+        busy, log, done = self.pragma('wal_checkpoint(TRUNCATE)')[0]
+        if log < 0:
+            return 'база не в режиме WAL'
+        return (f'перенесено {done} из {log} страниц'
+                + (', мешают читатели' if busy else ''))
+
+    def optimize(self):
+        self.pragma('optimize')
+
+    def analyze(self):
+        self.pragma(f'analysis_limit = {self.options["analysis_limit"]}')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def incremental_vacuum(self):
+        if self.pragma('auto_vacuum')[0][0] != INCREMENTAL:
+            return ('пропущен: auto_vacuum не INCREMENTAL '
+                    '(--enable-incremental-vacuum)')
+        before = self.pragma('freelist_count')[0][0]
+        # execute() модуля sqlite3 делает один шаг запроса без строк, то
+        # есть освобождает одну страницу; executescript - до конца.
+        connection.ensure_connection()
+        connection.connection.executescript(
+            f'PRAGMA incremental_vacuum({self.options["vacuum_pages"]});')
+        return (f'освобождено страниц: '
+                f'{before - self.pragma("freelist_count")[0][0]}')
+
+    def enable_incremental_vacuum(self):
+        self.pragma(f'auto_vacuum = {INCREMENTAL}')
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM')
@@ -0,0 +1,317 @@
+"""
+Метрики приложения в текстовом формате Prometheus.
+
+Значения копятся в памяти процесса. При заданном METRICS_DIR процесс
+не реже раза в METRICS_FLUSH_INTERVAL секунд пишет свой снимок в
+отдельный файл каталога, а /metrics суммирует файлы всех процессов:
+в какой бы воркер ни попал сбор, счётчики одни и те же. Снимки
+завершившихся процессов при сборе складываются в base.json, чтобы
+суммы не уменьшались, а файлы не копились.
+"""
+import atexit
+import fcntl
+import functools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+SIZE_BUCKETS = tuple(kb * 1024 for kb in (10, 100, 500, 1024, 2048, 5120))
+
+# Имя: (тип, описание, границы корзин гистограммы)
+FAMILIES = {
+    'yatube_http_requests_total': (
+        'counter', 'Запросы по маршруту и классу кода ответа', None),
+    'yatube_http_request_duration_seconds': (
+        'histogram', 'Время ответа по маршруту', LATENCY_BUCKETS),
+    'yatube_db_queries_total': (
+        'counter', 'SQL-запросы по маршруту', None),
+    'yatube_db_query_duration_seconds_total': (
+        'counter', 'Время SQL-запросов по маршруту', None),
+    'yatube_template_render_duration_seconds': (
+        'histogram', 'Время отрисовки шаблонов за запрос', LATENCY_BUCKETS),
+    'yatube_upload_size_bytes': (
+        'histogram', 'Размер загруженных файлов', SIZE_BUCKETS),
+    'yatube_cache_requests_total': (
+        'counter', 'Чтения кэша по префиксу ключа и результату', None),
+    'yatube_cache_evictions_total': (
+        'counter', 'Вытеснения из L1 кэша по префиксу ключа', None),
+    'yatube_feed_requests_total': (
+        'counter', 'Запросы ленты подписок по способу сборки '
+                   '(push, hybrid, legacy)', None),
+}
+
+BASE = 'base.json'
+# Снимок процесса: <pid>-<uuid>.json, пока пишется - с .tmp
+SNAPSHOT = re.compile(r'(\d+)-[0-9a-f]{32}\.json(\.tmp)?$')
+
+_local = threading.local()
+
+
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Registry:
+    """Значения серий процесса: (имя серии, метки) -> число."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # После fork блокировки могли остаться захваченными чужим потоком.
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.path = None
+        self.flushed = 0.0
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels_key(labels))
+        with self.lock:
+            self.values[key] += value
+
+    def observe(self, name, labels, value):
+        buckets = FAMILIES[name][2]
+        labels = labels_key(labels)
+        with self.lock:
+            for bound in buckets:
+                if value <= bound:
+                    self.values[(f'{name}_bucket', labels_key(
+                        {**dict(labels), 'le': str(bound)}))] += 1
+            self.values[(f'{name}_bucket', labels_key(
+                {**dict(labels), 'le': '+Inf'}))] += 1
+            self.values[(f'{name}_sum', labels)] += value
+            self.values[(f'{name}_count', labels)] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def flush(self, force=False):
+        """Снимок процесса в METRICS_DIR, если пора (или force)."""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed < settings.METRICS_FLUSH_INTERVAL:
+            return
+        # Пишет один поток; остальные не ждут.
+        if not self.flush_lock.acquire(blocking=False):
+            return
+        try:
+            self.flushed = now
+            if self.path is None:
+                os.makedirs(directory, exist_ok=True)
+                self.path = os.path.join(
+                    directory, f'{os.getpid()}-{uuid.uuid4().hex}.json')
+            rows = [[name, dict(labels), value]
+                    for (name, labels), value in self.snapshot().items()]
+            temporary = self.path + '.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(rows, file)
+            os.replace(temporary, self.path)
+        finally:
+            self.flush_lock.release()
+
+
+registry = Registry()
+# Дочерний процесс начинает с нуля: значения родителя в файле родителя.
+os.register_at_fork(after_in_child=registry.reset)
+atexit.register(registry.flush, force=True)
+
+
+def snapshot_pid(name):
+    """PID процесса по имени снимка; None для base.json и чужих файлов."""
+    match = SNAPSHOT.match(name)
+    return int(match.group(1)) if match else None
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_rows(path):
+    """Строки снимка; None, если файла уже нет."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        return []
+
+
+def add_rows(values, rows):
+    for series, labels, value in rows:
+        values[(series, labels_key(labels))] += value
+
+
+def merge_dead(directory):
+    """Снимки (и недописанные .tmp) завершившихся процессов - в base.json."""
+    dead = [name for name in os.listdir(directory)
+            if SNAPSHOT.match(name) and not is_alive(snapshot_pid(name))]
+    if not dead:
+        return
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        # Два сборщика не должны сложить один снимок дважды.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        base = os.path.join(directory, BASE)
+        values = defaultdict(float)
+        add_rows(values, read_rows(base) or [])
+        merged = []
+        for name in dead:
+            path = os.path.join(directory, name)
+            rows = read_rows(path) if name.endswith('.json') else []
+            if rows is None:
+                continue
+            add_rows(values, rows)
+            merged.append(path)
+        temporary = base + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump([[name, dict(labels), value]
+                       for (name, labels), value in values.items()], file)
+        os.replace(temporary, base)
+        for path in merged:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def collect():
+    """Значения всех процессов (METRICS_DIR) или только этого."""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return registry.snapshot()
+    registry.flush(force=True)
+    merge_dead(directory)
+    values = defaultdict(float)
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            add_rows(values, read_rows(os.path.join(directory, name)) or [])
+    return values
+
+
+def escape(value):
+    return (value.replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def exposition(values=None):
+    """Текст для Prometheus."""
+    if values is None:
+        values = collect()
+    by_family = defaultdict(list)
+    for (series, labels), value in values.items():
+        family = series
+        for suffix in ('_bucket', '_sum', '_count'):
+            if series.endswith(suffix) and series[:-len(suffix)] in FAMILIES:
+                family = series[:-len(suffix)]
+        by_family[family].append((series, labels, value))
+    lines = []
+    for family, (kind, help_text, _) in FAMILIES.items():
+        lines.append(f'# HELP {family} {help_text}')
+        lines.append(f'# TYPE {family} {kind}')
+        for series, labels, value in sorted(by_family[family]):
+            text = ','.join(f'{name}="{escape(label)}"'
+                            for name, label in labels)
+            value = int(value) if float(value).is_integer() else value
+            lines.append(f'{series}{{{text}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# Кэш
+
+def cache_prefix(key):
+    for prefix, label in settings.METRICS_CACHE_PREFIXES:
+        if key.startswith(prefix):
+            return label
+    return 'other'
+
+
+def cache_lookups(keys, found):
+    for key in keys:
+        registry.inc('yatube_cache_requests_total', {
+            'prefix': cache_prefix(key),
+            'result': 'hit' if key in found else 'miss',
+        })
+
+
+def cache_eviction(key):
+    registry.inc('yatube_cache_evictions_total',
+                 {'prefix': cache_prefix(key)})
+
+
+# Шаблоны
+
+class TemplateTimer:
+    """Время внешних отрисовок шаблонов в потоке запроса."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.depth = 0
+
+    def __enter__(self):
+        _local.timer = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.timer = None
+
+
+def timed_render(render):
+    @functools.wraps(render)
+    def wrapper(self, context=None, request=None):
+        timer = getattr(_local, 'timer', None)
+        if timer is None:
+            return render(self, context, request)
+        # render_to_string внутри шаблона (фрагменты постов) уже
+        # учтён во внешней отрисовке.
+        timer.depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            timer.depth -= 1
+            if not timer.depth:
+                timer.seconds += time.perf_counter() - started
+
+    wrapper.timed = True
+    return wrapper
+
+
+def patch_templates():
+    from django.template.backends.django import Template
+    if not getattr(Template.render, 'timed', False):
+        Template.render = timed_render(Template.render)
+
+
+def observe_request(view, status, duration, recorder, template_seconds,
+                    uploads):
+    labels = {'view': view}
+    registry.inc('yatube_http_requests_total',
+                 {**labels, 'code': f'{status // 100}xx'})
+    registry.observe('yatube_http_request_duration_seconds', labels,
+                     duration)
+    registry.inc('yatube_db_queries_total', labels, recorder.count)
+    registry.inc('yatube_db_query_duration_seconds_total', labels,
+                 recorder.duration)
+    if template_seconds:
+        registry.observe('yatube_template_render_duration_seconds', labels,
+                         template_seconds)
+    for size in uploads:
+        registry.observe('yatube_upload_size_bytes', labels, size)
@@ -0,0 +1,139 @@
+import logging
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from . import metrics, profiling
+from .queries import QueryRecorder, view_stats
+from .slow_queries import SlowQueryLog
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает запросы к БД и их время для каждого представления.
+
+    Превышение бюджета из QUERY_BUDGETS пишется в лог, а при
+    QUERY_BUDGET_STRICT (тесты бюджетов) приводит к исключению.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is None:
+            return response
+        view_stats[match.view_name].add(recorder)
+        budget = settings.QUERY_BUDGETS.get(match.view_name)
+        if budget is not None and recorder.count > budget:
+            message = (f'{match.view_name}: {recorder.count} запросов '
+                       f'при бюджете {budget} ({request.path})')
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Профилирует отдельные запросы: с подписанным заголовком X-Profile
+    (manage.py profile_hotspots --token) или случайную долю
+    PROFILING_SAMPLE_RATE. Профили пишутся в PROFILING_DIR, там остаются
+    последние PROFILING_KEEP.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def trigger(self, request):
+        token = request.META.get(profiling.HEADER)
+        if token is not None and profiling.token_valid(token):
+            return 'header'
+        rate = settings.PROFILING_SAMPLE_RATE
+        if rate and random.random() < rate:
+            return 'sample'
+        return None
+
+    def __call__(self, request):
+        trigger = self.trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+        with profiling.RequestProfile() as profile:
+            response = self.get_response(request)
+        match = request.resolver_match
+        try:
+            path = profile.save(
+                settings.PROFILING_DIR, settings.PROFILING_KEEP,
+                view=match.view_name if match else None,
+                method=request.method,
+                path=request.get_full_path(),
+                status=response.status_code,
+                trigger=trigger,
+            )
+        except OSError:
+            # Профиль не должен ломать сам запрос.
+            logger.exception('Не удалось сохранить профиль запроса')
+        else:
+            response['X-Profile-Id'] = os.path.basename(path)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Метрики запроса для /metrics (core.metrics): время ответа, SQL,
+    отрисовка шаблонов и размеры загруженных файлов по маршрутам.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        metrics.patch_templates()
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with metrics.TemplateTimer() as templates, \
+                connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        uploads = []
+        # Файлы уже разобраны: POST прочитал CsrfViewMiddleware.
+        if request.method == 'POST' and \
+                request.content_type == 'multipart/form-data':
+            uploads = [file.size for file in request.FILES.values()]
+        metrics.observe_request(
+            match.view_name if match else 'unresolved',
+            response.status_code, duration, recorder, templates.seconds,
+            uploads)
+        metrics.registry.flush()
+        return response
+
+
+class SlowQueryMiddleware:
+    """
+    Пишет SQL дольше SLOW_QUERY_THRESHOLD_MS в журнал медленных запросов
+    (core.slow_queries); при пороге None не подключается.
+    """
+
+    def __init__(self, get_response):
+        if settings.SLOW_QUERY_THRESHOLD_MS is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        log = SlowQueryLog(request, settings.SLOW_QUERY_THRESHOLD_MS)
+        with connection.execute_wrapper(log):
+            return self.get_response(request)
@@ -0,0 +1,139 @@
+"""Профили отдельных запросов: cProfile, SQL и шаблоны."""
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+from django.template.base import Template
+
+HEADER = 'HTTP_X_PROFILE'
+TOKEN_SALT = 'core.profiling'
+
+_local = threading.local()
+_patch_lock = threading.Lock()
+
+
+def make_token():
+    """Значение заголовка X-Profile; действует PROFILING_TOKEN_MAX_AGE."""
+    return signing.dumps('profile', salt=TOKEN_SALT)
+
+
+def token_valid(token):
+    try:
+        return signing.loads(token, salt=TOKEN_SALT,
+                             max_age=settings.PROFILING_TOKEN_MAX_AGE
+                             ) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+def timed_render(render):
+    """Template.render, который пишет время в профиль текущего потока."""
+
+    @functools.wraps(render)
+    def wrapper(self, context):
+        profile = getattr(_local, 'profile', None)
+        if profile is None:
+            return render(self, context)
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            name = getattr(self.origin, 'template_name', None)
+            profile.templates.append(
+                (name or self.origin.name,
+                 (time.perf_counter() - started) * 1000))
+
+    wrapper.timed = True
+    return wrapper
+
+
+def patch_templates():
+    """Обёртка ставится при первом профиле, а не для всех процессов."""
+    with _patch_lock:
+        if not getattr(Template.render, 'timed', False):
+            Template.render = timed_render(Template.render)
+
+
+class SQLLog:
+    """execute_wrapper, который запоминает запросы и их время."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - started) * 1000))
+
+
+class RequestProfile:
+    """Контекст, в котором запрос профилируется целиком."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.sql = SQLLog()
+        self.templates = []
+        self.duration = 0.0
+
+    def __enter__(self):
+        patch_templates()
+        self._sql = connection.execute_wrapper(self.sql)
+        self._sql.__enter__()
+        _local.profile = self
+        self.started = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.duration = (time.perf_counter() - self.started) * 1000
+        _local.profile = None
+        self._sql.__exit__(*exc_info)
+
+    def save(self, directory, keep, **meta):
+        """Пишет .prof (pstats) и .json с SQL и шаблонами, чистит старые."""
+        os.makedirs(directory, exist_ok=True)
+        view = meta.get('view') or 'unresolved'
+        # Имя начинается со времени: сортировка по имени - по времени.
+        name = (f'{time.strftime("%Y%m%d-%H%M%S")}-'
+                f'{time.time_ns() % 10**9:09d}-{os.getpid()}-'
+                f'{threading.get_ident()}-{view.replace(":", ".")}')
+        path = os.path.join(directory, name)
+        self.profiler.dump_stats(path + '.prof')
+        with open(path + '.json', 'w') as file:
+            json.dump({
+                **meta,
+                'duration_ms': self.duration,
+                'sql': [{'sql': sql, 'ms': ms}
+                        for sql, ms in self.sql.queries],
+                'templates': [{'name': template, 'ms': ms}
+                              for template, ms in self.templates],
+            }, file, ensure_ascii=False)
+        rotate(directory, keep)
+        return path
+
+
+def profile_paths(directory):
+    """Пути сохранённых профилей без расширения, от старых к новым."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name[:-len('.json')])
+                  for name in os.listdir(directory) if name.endswith('.json'))
+
+
+def rotate(directory, keep):
+    paths = profile_paths(directory)
+    for path in paths[:max(len(paths) - keep, 0)]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(path + suffix)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,37 @@
+"""Учёт SQL-запросов по представлениям."""
+import time
+from collections import defaultdict
+
+
+class QueryRecorder:
+    """execute_wrapper, который считает запросы и время в БД."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.monotonic() - start
+
+
+class ViewStats:
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.duration = 0.0
+        self.max_queries = 0
+
+    def add(self, recorder):
+        self.requests += 1
+        self.queries += recorder.count
+        self.duration += recorder.duration
+        self.max_queries = max(self.max_queries, recorder.count)
+
+
+# Накопленная статистика этого процесса по имени представления
+view_stats = defaultdict(ViewStats)
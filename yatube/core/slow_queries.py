@@ -0,0 +1,196 @@
+"""
+Журнал медленных SQL-запросов.
+
+Запрос дольше SLOW_QUERY_THRESHOLD_MS пишется строкой JSON в
+SLOW_QUERY_LOG: нормализованный текст и его отпечаток, типы параметров,
+представление, строка шаблона и место в коде, откуда пришёл запрос, и
+план (EXPLAIN QUERY PLAN в SQLite, EXPLAIN в PostgreSQL).
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import DatabaseError
+
+CORE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Сколько мест в коде проекта запоминать, от ближнего к запросу
+CALL_SITE_DEPTH = 3
+SQL_LIMIT = 4000
+
+logger = logging.getLogger('core.slow_queries')
+logger.propagate = False
+_handler_lock = threading.Lock()
+
+NORMALIZE = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    # Длина списка IN не меняет запрос.
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def normalize(sql):
+    """Текст запроса без литералов и длин списков."""
+    for pattern, replacement in NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(normalized):
+    return hashlib.md5(normalized.encode()).hexdigest()[:12]
+
+
+def param_shapes(params, many):
+    """Типы параметров с повторами: 'int*3, str'; для many - число строк."""
+    if many:
+        params = list(params or ())
+        return (f'{len(params)} x ({param_shapes(params[0], False)})'
+                if params else '0 x ()')
+    if isinstance(params, dict):
+        params = params.values()
+    shapes = []
+    for value in params or ():
+        name = type(value).__name__
+        if shapes and shapes[-1][0] == name:
+            shapes[-1][1] += 1
+        else:
+            shapes.append([name, 1])
+    return ', '.join(name if count == 1 else f'{name}*{count}'
+                     for name, count in shapes)
+
+
+def call_site():
+    """Строка шаблона и места в коде проекта, из которых пришёл запрос."""
+    template = None
+    code = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        if (template is None and frame.f_code.co_name == 'render_annotated'
+                and getattr(node, 'token', None) is not None):
+            origin = getattr(node, 'origin', None)
+            name = getattr(origin, 'template_name', None) or getattr(
+                origin, 'name', '?')
+            template = f'{name}:{node.token.lineno}'
+        filename = frame.f_code.co_filename
+        if (len(code) < CALL_SITE_DEPTH
+                and filename.startswith(settings.BASE_DIR + os.sep)
+                and not filename.startswith(CORE_DIR + os.sep)):
+            code.append(f'{os.path.relpath(filename, settings.BASE_DIR)}:'
+                        f'{frame.f_lineno} {frame.f_code.co_name}')
+        frame = frame.f_back
+    return template, code
+
+
+def explain(connection, sql, params):
+    """План SELECT-запроса или None."""
+    if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return None
+    prefix = ('EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite'
+              else 'EXPLAIN ')
+    try:
+        # Курсор бэкенда под CursorWrapper: EXPLAIN не проходит через
+        # execute_wrapper и не попадает в журнал сам.
+        with connection.cursor() as wrapper:
+            cursor = wrapper.cursor
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as error:
+        return [f'EXPLAIN не удался: {error}']
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail): отступ по глубине дерева.
+        depth = {0: -1}
+        lines = []
+        for node_id, parent, _, detail in rows:
+            depth[node_id] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node_id] + detail)
+        return lines
+    return [row[0] for row in rows]
+
+
+def log_handler():
+    """Файловый обработчик журнала для текущего SLOW_QUERY_LOG."""
+    path = os.path.abspath(settings.SLOW_QUERY_LOG)
+    with _handler_lock:
+        for handler in list(logger.handlers):
+            if handler.baseFilename == path:
+                return
+            logger.removeHandler(handler)
+            handler.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(
+            path, encoding='utf-8',
+            maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+            backupCount=settings.SLOW_QUERY_LOG_BACKUPS)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+class SlowQueryLog:
+    """execute_wrapper запроса к сайту: пишет в журнал медленные SQL."""
+
+    def __init__(self, request, threshold_ms):
+        self.request = request
+        self.threshold_ms = threshold_ms
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = execute(sql, params, many, context)
+            failed = False
+            return result
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            if ms >= self.threshold_ms:
+                self.log(sql, params, many, context['connection'], ms,
+                         failed)
+
+    def log(self, sql, params, many, connection, ms, failed):
+        normalized = normalize(sql)
+        template, code = call_site()
+        match = self.request.resolver_match
+        log_handler()
+        logger.info(json.dumps({
+            'time': time.time(),
+            'ms': round(ms, 3),
+            'fingerprint': fingerprint(normalized),
+            'sql': normalized[:SQL_LIMIT],
+            'params': param_shapes(params, many),
+            'view': match.view_name if match else None,
+            'path': self.request.path,
+            'template': template,
+            'code': code,
+            # После ошибки PostgreSQL не выполнит и EXPLAIN.
+            'plan': (None if failed or many
+                     else explain(connection, sql, params)),
+            'failed': failed,
+        }, ensure_ascii=False))
+
+
+def log_paths(path):
+    """Журнал и его ротированные копии, от старых к новым."""
+    backups = [f'{path}.{number}' for number in range(
+        settings.SLOW_QUERY_LOG_BACKUPS, 0, -1)]
+    return [candidate for candidate in backups + [path]
+            if os.path.exists(candidate)]
+
+
+def read_log(path):
+    for candidate in log_paths(path):
+        with open(candidate, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
@@ -0,0 +1,22 @@
+"""
+Бэкенд SQLite для production-нагрузки.
+
+Каждое новое соединение получает PRAGMA из SQLITE_PRAGMAS. Транзакции
+(transaction.atomic) начинаются с BEGIN IMMEDIATE: отложенная
+транзакция, которая сначала читала, а потом пишет, не может дождаться
+чужой записи (busy_timeout тут не помогает) и сразу падает с
+«database is locked».
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,69 @@
+"""
+Хранилище с адресацией по содержимому.
+
+Имя файла - sha256 его содержимого: <каталог upload_to>/ab/abcd...<ext>.
+Одинаковые загрузки превращаются в один файл на диске; хэш считается
+на лету, пока загрузка копируется во временный файл рядом с итоговым.
+Удалять такой файл можно только когда на него не осталось ссылок
+(см. posts.media).
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# mkstemp создаёт файл с правами 0600; обычное сохранение Django даёт
+# 0666 с учётом umask (umask читается один раз: его смена не атомарна).
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def blob_name(name, digest):
+    """Имя файла с содержимым digest в каталоге исходного имени."""
+    directory, filename = posixpath.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    return posixpath.join(directory, digest[:2], digest + extension)
+
+
+def file_digest(file, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя всё равно определяется содержимым.
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        descriptor, temporary = tempfile.mkstemp(dir=directory,
+                                                 prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    output.write(chunk)
+            name = blob_name(name, digest.hexdigest())
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(temporary, 0o666 & ~UMASK
+                     if self.file_permissions_mode is None
+                     else self.file_permissions_mode)
+            # Заменяется и уже существующий файл: его могут как раз
+            # освобождать (posts.media.release), а свежее время изменения
+            # не даёт удалить его, пока пост не попал в базу.
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
@@ -0,0 +1,409 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from io import StringIO
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core import metrics
+from core.benchmarks import latency_summary, regressions
+from core.cache import TwoTierCache
+from core.management.commands.loadtest import Command as LoadTestCommand
+from core.management.commands.sqlite_maintenance import due_tasks
+from core.profiling import make_token, profile_paths
+from core.slow_queries import normalize, param_shapes, read_log
+from posts.models import Group, Post, User
+
+L2_DIR = tempfile.mkdtemp()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'l2': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': L2_DIR,
+    },
+})
+class TwoTierCacheTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(L2_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        caches['l2'].clear()
+        # Разные LOCATION - разные процессы со своим L1 и общим L2.
+        self.first = self.backend('first')
+        self.second = self.backend('second')
+        self.first.clear()
+        self.second.clear()
+
+    def backend(self, location, **options):
+        options = {'L2': 'l2', 'L1_MAX_ENTRIES': 3, 'LOCK_WAIT': 1,
+                   **options}
+        return TwoTierCache(location, {'OPTIONS': options})
+
+    def test_l2_is_shared(self):
+        self.first.set('key', 'value', 60)
+        self.assertEqual(self.second.get('key'), 'value')
+        self.second.delete('key')
+        self.assertIsNone(caches['l2'].get('key'))
+
+    def test_l1_serves_hits_and_is_bounded(self):
+        self.first.set('key', 'value', 60)
+        caches['l2'].clear()
+        self.assertEqual(self.first.get('key'), 'value')
+        for i in range(3):
+            self.first.set(f'other{i}', i, 60)
+        self.assertEqual(self.first.evictions, 1)
+        self.assertIsNone(self.first.get('key'))
+
+    def test_counters_bypass_l1(self):
+        self.first.add('generation:posts', 1, None)
+        self.assertEqual(self.first.get('generation:posts'), 1)
+        self.second.incr('generation:posts')
+        self.assertEqual(self.first.get('generation:posts'), 2)
+
+    def test_single_flight_waits_for_value(self):
+        key = 'template.cache.index_page.abc'
+        self.assertIsNone(self.first.get(key))
+
+        def rebuild():
+            time.sleep(0.2)
+            self.first.set(key, 'fragment', 60)
+
+        thread = threading.Thread(target=rebuild)
+        thread.start()
+        self.assertEqual(self.second.get(key), 'fragment')
+        thread.join()
+
+    def test_early_recompute_goes_to_one_caller(self):
+        key = 'template.cache.index_page.abc'
+        # Значение ещё живо, но пересчитывалось дольше, чем ему осталось.
+        caches['l2'].set(key, ('fragment', time.time() + 1, 100), 60)
+        self.assertIsNone(self.first.get(key))
+        self.assertEqual(self.second.get(key), 'fragment')
+        self.first.set(key, 'new', 60)
+        self.assertEqual(self.backend('third').get(key), 'new')
+
+
+class BenchViewsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.create(text='котики', author=author, group=group)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.baseline = os.path.join(self.directory, 'views.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def bench(self, *args):
+        out = StringIO()
+        call_command('bench_views', '--repeat=2', '--warmup=0',
+                     f'--baseline={self.baseline}', *args, stdout=out)
+        return out.getvalue()
+
+    def test_summary_and_regressions(self):
+        summary = latency_summary([float(ms) for ms in range(100, 0, -1)])
+        self.assertEqual((summary['p50'], summary['p95'], summary['p99']),
+                         (50.0, 95.0, 99.0))
+        base = {'r': {'p95': 10.0, 'queries': 3, 'status': 200}}
+        same = {'r': {'p95': 11.0, 'queries': 3, 'status': 200}}
+        self.assertEqual(regressions(same, base, 0.25, 2.0), [])
+        slower = {'r': {'p95': 20.0, 'queries': 4, 'status': 200}}
+        self.assertEqual(len(regressions(slower, base, 0.25, 2.0)), 2)
+
+    def test_baseline_is_saved_and_checked(self):
+        output = self.bench()
+        self.assertIn('posts:post_detail auth', output)
+        self.assertNotIn('users:logout', output)
+        with open(self.baseline) as file:
+            baseline = json.load(file)
+        self.assertEqual(baseline['routes']['posts:index anon']['status'],
+                         200)
+        self.assertIn('Регрессий нет',
+                      self.bench('posts:index', '--slack=1000'))
+        baseline['routes']['posts:index anon']['queries'] = 0
+        with open(self.baseline, 'w') as file:
+            json.dump(baseline, file)
+        with self.assertRaisesMessage(CommandError, 'posts:index anon'):
+            self.bench('posts:index', '--slack=1000')
+
+
+class LoadTestTests(TestCase):
+    def test_report_counts_errors_and_buckets(self):
+        out = StringIO()
+        report = LoadTestCommand(stdout=out).report([
+            ('index', 200, 3.0),
+            ('index', 200, 40.0),
+            ('add_comment', 302, 90.0),
+            ('add_comment', 500, 7000.0),
+            ('add_comment', 'ConnectionError', 1.0),
+        ], elapsed=2.0)
+        self.assertEqual(report['rps'], 2.5)
+        comments = report['scenarios']['add_comment']
+        self.assertAlmostEqual(comments['error_rate'], 2 / 3)
+        self.assertEqual(comments['errors'],
+                         {'500': 1, 'ConnectionError': 1})
+        self.assertEqual(comments['histogram']['<=5'], 1)
+        self.assertEqual(comments['histogram']['>5000'], 1)
+        self.assertEqual(report['scenarios']['index']['error_rate'], 0)
+        self.assertIn('index', out.getvalue())
+
+    def test_needs_seeded_users_and_known_scenarios(self):
+        with self.assertRaisesMessage(CommandError, 'Нет сценария'):
+            call_command('loadtest', mix='unknown=1')
+        with self.assertRaisesMessage(CommandError, 'seed_load'):
+            call_command('loadtest', clients=1)
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        Post.objects.create(text='Пост', author=author, group=Group.objects.
+                            create(title='Группа', slug='group'))
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        overrides = override_settings(PROFILING_DIR=self.directory,
+                                      PROFILING_KEEP=3)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def saved(self):
+        return profile_paths(self.directory)
+
+    def test_off_without_header_and_with_bad_token(self):
+        self.client.get('/')
+        self.client.get('/', HTTP_X_PROFILE='forged')
+        self.assertEqual(self.saved(), [])
+
+    def test_signed_header_writes_profile(self):
+        response = self.client.get('/', HTTP_X_PROFILE=make_token())
+        [path] = self.saved()
+        self.assertEqual(os.path.basename(path), response['X-Profile-Id'])
+        self.assertTrue(os.path.exists(path + '.prof'))
+        with open(path + '.json') as file:
+            profile = json.load(file)
+        self.assertEqual((profile['view'], profile['trigger']),
+                         ('posts:index', 'header'))
+        self.assertTrue(profile['sql'])
+        self.assertIn('posts/index.html',
+                      [template['name'] for template in profile['templates']])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampling_and_rotation(self):
+        for _ in range(5):
+            self.client.get('/')
+        self.assertEqual(len(self.saved()), 3)
+        out = StringIO()
+        call_command('profile_hotspots', view='posts:index', stdout=out)
+        self.assertIn('Профилей: 3', out.getvalue())
+        self.assertIn('posts/index.html', out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'Нет профилей'):
+            call_command('profile_hotspots', view='posts:search')
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.create(text='Пост', author=cls.user, group=cls.group)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        caches['default'].clear()
+        metrics.registry.reset()
+
+    def scrape(self):
+        response = self.client.get('/metrics',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_requests_queries_templates_and_cache(self):
+        self.client.get('/')
+        self.client.get('/')
+        text = self.scrape()
+        for line in (
+            'yatube_http_requests_total{code="2xx",view="posts:index"} 2',
+            'yatube_http_request_duration_seconds_bucket'
+            '{le="+Inf",view="posts:index"} 2',
+            'yatube_template_render_duration_seconds_count'
+            '{view="posts:index"} 2',
+            'yatube_cache_requests_total{prefix="index_page",result="hit"} 1',
+            'yatube_cache_requests_total{prefix="index_page",result="miss"} 1',
+        ):
+            self.assertIn(line, text)
+        self.assertIn('yatube_db_queries_total{view="posts:index"}', text)
+
+    def test_upload_sizes(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('posts:create'), {
+            'text': 'С картинкой',
+            'image': SimpleUploadedFile('small.gif', SMALL_GIF,
+                                        content_type='image/gif'),
+        })
+        self.assertIn('yatube_upload_size_bytes_sum'
+                      f'{{view="posts:create"}} {len(SMALL_GIF)}',
+                      self.scrape())
+
+    def test_processes_are_summed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        other = metrics.Registry()
+        with override_settings(METRICS_DIR=directory):
+            other.inc('yatube_http_requests_total',
+                      {'view': 'posts:index', 'code': '2xx'}, 5)
+            other.flush(force=True)
+            self.client.get('/')
+            text = self.scrape()
+        self.assertIn(
+            'yatube_http_requests_total{code="2xx",view="posts:index"} 6',
+            text)
+
+    def test_dead_processes_are_merged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        process = subprocess.Popen(['true'])
+        process.wait()
+        snapshot = os.path.join(
+            directory, f'{process.pid}-{uuid.uuid4().hex}.json')
+        with open(snapshot, 'w') as file:
+            json.dump([['yatube_http_requests_total',
+                        {'view': 'posts:index', 'code': '2xx'}, 5]], file)
+        open(snapshot + '.tmp', 'w').close()
+        line = 'yatube_http_requests_total{code="2xx",view="posts:index"} 5'
+        with override_settings(METRICS_DIR=directory):
+            for _ in range(2):
+                self.assertIn(line, self.scrape())
+        self.assertEqual(len(glob.glob(os.path.join(directory, '*.json*'))),
+                         2)
+        self.assertTrue(os.path.exists(os.path.join(directory,
+                                                    metrics.BASE)))
+
+    def test_requires_token_or_staff(self):
+        for headers in ({}, {'HTTP_AUTHORIZATION': 'Bearer wrong'}):
+            response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1',
+                                       **headers)
+            self.assertEqual(response.status_code, 404)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+class SlowQueryLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username='author')
+        group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.create(text='Пост', author=author, group=group)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.directory = tempfile.mkdtemp()
+        self.log = os.path.join(self.directory, 'slow.log')
+        overrides = override_settings(SLOW_QUERY_THRESHOLD_MS=0,
+                                      SLOW_QUERY_LOG=self.log)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_normalized_fingerprint(self):
+        short = normalize("SELECT * FROM t WHERE id IN (%s, %s) "
+                          "AND name = 'x' LIMIT 10")
+        self.assertEqual(short, 'SELECT * FROM t WHERE id IN (...) '
+                                'AND name = ? LIMIT ?')
+        self.assertEqual(short, normalize(
+            'SELECT * FROM t WHERE id IN (%s,%s,%s) AND name = %s LIMIT 20'))
+        self.assertEqual(param_shapes([1, 2, 'a'], False), 'int*2, str')
+
+    def test_request_queries_are_logged_and_reported(self):
+        self.client.get('/')
+        entries = list(read_log(self.log))
+        self.assertTrue(entries)
+        self.assertEqual({entry['view'] for entry in entries},
+                         {'posts:index'})
+        feed = [entry for entry in entries
+                if (entry['template'] or '').startswith('posts/index.html:')]
+        self.assertTrue(feed)
+        self.assertTrue(feed[0]['plan'])
+        self.assertTrue(feed[0]['code'][0].startswith('posts/'))
+        out = StringIO()
+        call_command('slow_query_report', plans=True, stdout=out)
+        self.assertIn(feed[0]['fingerprint'], out.getvalue())
+        self.assertIn('posts/index.html:', out.getvalue())
+
+
+class SQLiteTuningTests(TransactionTestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connection_pragmas(self):
+        self.assertEqual(self.pragma('busy_timeout'),
+                         settings.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(self.pragma('cache_size'),
+                         settings.SQLITE_PRAGMAS['cache_size'])
+
+    def test_transactions_take_write_lock_at_start(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Post.objects.count()
+        self.assertEqual(queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+    def test_maintenance(self):
+        out = StringIO()
+        call_command('sqlite_maintenance', stdout=out)
+        for task in ('checkpoint', 'optimize', 'analyze',
+                     'incremental_vacuum'):
+            self.assertIn(f'  {task}: ', out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'Нет задач: vacuum'):
+            call_command('sqlite_maintenance', 'vacuum')
+        periods = {'checkpoint': 10, 'analyze': 100}
+        self.assertEqual(due_tasks(['checkpoint', 'analyze'], {
+            'checkpoint': 0, 'analyze': 0}, 50, periods), ['checkpoint'])
+        self.assertEqual(due_tasks(['analyze'], {}, 0, periods), ['analyze'])
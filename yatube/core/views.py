@@ -1,4 +1,9 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+
+from .metrics import CONTENT_TYPE, exposition
 
 
 def page_not_found(request, exception):
@@ -15,3 +20,13 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def metrics(request):
+    """Метрики всех процессов в формате Prometheus."""
+    token = settings.METRICS_TOKEN
+    authorized = token and constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+    if not (authorized or request.user.is_staff):
+        raise Http404
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE)
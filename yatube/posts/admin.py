@@ -1,9 +1,102 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import (AutocompleteSelect,
+                                          ForeignKeyRawIdWidget)
+from django.urls import NoReverseMatch, reverse
+from django.utils.text import Truncator
 
+from . import search
 from .models import Post, Group, Comment
+from .utils import EstimatedCountPaginator
 
 
-class PostAdmin(admin.ModelAdmin):
+def preloaded_value(widget, value):
+    """Объект, уже загруженный для строки списка, если это он."""
+    obj = widget.preloaded
+    if obj is not None and str(obj.pk) == str(value):
+        return obj
+    return None
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """Автодополнение, которое не запрашивает выбранный объект заново."""
+
+    preloaded = None
+
+    def optgroups(self, name, value, attr=None):
+        obj = preloaded_value(self, value[0]) if len(value) == 1 else None
+        if obj is None:
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name, obj.pk, self.choices.field.label_from_instance(obj), True,
+            len(options)))
+        return [(None, options, 0)]
+
+
+class PreloadedRawIdWidget(ForeignKeyRawIdWidget):
+    """Поле id со ссылкой на объект, уже загруженный для строки."""
+
+    preloaded = None
+
+    def label_and_url_for_value(self, value):
+        obj = preloaded_value(self, value)
+        if obj is None:
+            return super().label_and_url_for_value(value)
+        opts = obj._meta
+        try:
+            url = reverse(f'{self.admin_site.name}:{opts.app_label}_'
+                          f'{opts.model_name}_change', args=(obj.pk,))
+        except NoReverseMatch:
+            url = ''
+        return Truncator(obj).words(14), url
+
+
+class PreloadedRelatedForm(forms.ModelForm):
+    """
+    Форма строки списка: виджеты внешних ключей берут объекты из
+    list_select_related, а не делают по запросу на строку.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for name, field in self.fields.items():
+            widget = getattr(field.widget, 'widget', field.widget)
+            if not hasattr(widget, 'preloaded'):
+                continue
+            model_field = self.instance._meta.get_field(name)
+            if model_field.is_cached(self.instance):
+                widget.preloaded = getattr(self.instance, name)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Список для больших таблиц: без COUNT(*) по всей таблице и без
+    <select> со всеми связанными объектами в каждой строке.
+    """
+
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        db = kwargs.get('using')
+        if 'widget' not in kwargs:
+            if db_field.name in self.get_autocomplete_fields(request):
+                kwargs['widget'] = PreloadedAutocompleteSelect(
+                    db_field.remote_field, self.admin_site, using=db)
+            elif db_field.name in self.raw_id_fields:
+                kwargs['widget'] = PreloadedRawIdWidget(
+                    db_field.remote_field, self.admin_site, using=db)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_changelist_form(self, request, **kwargs):
+        kwargs.setdefault('form', PreloadedRelatedForm)
+        return super().get_changelist_form(request, **kwargs)
+
+
+class PostAdmin(LargeTableAdmin):
     # Перечисляем поля, которые должны отображаться в админке
     list_display = (
         'pk',
@@ -13,10 +106,24 @@ class PostAdmin(admin.ModelAdmin):
         'group',
     )
     list_editable = ('group',)
+    # Автор и группа строк списка - одним JOIN, без запроса на строку.
+    list_select_related = ('author', 'group')
+    # Вместо <select> со всеми группами и пользователями в каждой строке.
+    autocomplete_fields = ('group',)
+    raw_id_fields = ('author',)
     search_fields = ('text',)
+    # Фильтр по дате не строит список значений, а навигация
+    # по датам идёт по индексу pub_date.
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по тексту идёт через полнотекстовый индекс, а не LIKE.
+        if not search_term or not search.supported():
+            return super().get_search_results(request, queryset, search_term)
+        return search.matching(queryset, search_term), False
+
 
 admin.site.register(Post, PostAdmin)
 
@@ -32,15 +139,19 @@ class GroupAdmin(admin.ModelAdmin):
 admin.site.register(Group, GroupAdmin)
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(LargeTableAdmin):
     # Перечисляем поля, которые должны отображаться в админке
     list_display = (
         'text',
         'author',
     )
     list_editable = ('author',)
-    search_fields = ('text',)
-    list_filter = ('author',)
+    list_select_related = ('author',)
+    raw_id_fields = ('author', 'post')
+    # Фильтр по автору выводил бы всех пользователей; автор ищется
+    # точным совпадением имени по уникальному индексу.
+    search_fields = ('text', '=author__username')
+    date_hierarchy = 'created'
     empty_value_display = '-пусто-'
 
 
@@ -0,0 +1,118 @@
+"""
+Гибридная лента подписок.
+
+Посты обычных авторов раскладываются по лентам при публикации (push),
+посты популярных авторов (UserStats.pull_feed, см.
+timeline.update_pull_authors) читаются в момент запроса (pull) на
+глубину FEED_MERGE_DEPTH и сливаются с материализованной лентой k-way
+merge по (pub_date, id).
+"""
+import heapq
+import logging
+from collections import namedtuple
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import Q
+
+from core.metrics import registry
+
+from .models import Follow, Post
+from .timeline import pull_authors, timeline_posts
+from .utils import KeysetPaginator, get_page_context
+
+logger = logging.getLogger(__name__)
+
+FeedItem = namedtuple('FeedItem', 'pub_date post_id post')
+
+
+class FeedPaginator(KeysetPaginator):
+    """Курсорная пагинация по слиянию нескольких источников."""
+
+    def __init__(self, sources, per_page, probe=True):
+        super().__init__(None, per_page, keys=('pub_date', 'post_id'),
+                         probe=probe, resolve=feed_posts)
+        self.sources = sources
+
+    def fetch_rows(self, position, reverse, limit):
+        streams = []
+        for queryset, keys, to_item in self.sources:
+            source = KeysetPaginator(queryset, limit, keys=keys)
+            streams.append([
+                (source.row_key(row), to_item(row))
+                for row in source.fetch_rows(position, reverse, limit)
+            ])
+        rows = []
+        previous = None
+        merged = heapq.merge(*streams, key=itemgetter(0),
+                             reverse=not reverse)
+        for key, item in merged:
+            # Пост мог остаться в ленте после перехода автора в pull.
+            if key == previous:
+                continue
+            previous = key
+            rows.append(item)
+            if len(rows) == limit:
+                break
+        return rows
+
+
+def entry_item(entry):
+    return FeedItem(entry.pub_date, entry.post_id, None)
+
+
+def post_item(post):
+    return FeedItem(post.pub_date, post.pk, post)
+
+
+def feed_posts(items):
+    loaded = timeline_posts([item for item in items if item.post is None])
+    posts = {post.pk: post for post in loaded}
+    posts.update((item.post_id, item.post) for item in items if item.post)
+    return [posts[item.post_id] for item in items if item.post_id in posts]
+
+
+def follow_page(request):
+    """Страница ленты подписок текущего пользователя."""
+    user = request.user
+    entries = user.timeline.all()
+    pull = pull_authors()
+    pull_ids = list(Follow.objects.filter(
+        user=user, author_id__in=list(pull)
+    ).values_list('author_id', flat=True)) if pull else []
+    if not pull_ids:
+        path = 'push'
+        page_obj = get_page_context(entries, request,
+                                    keys=('pub_date', 'post_id'),
+                                    resolve=timeline_posts)
+    elif 'page' in request.GET:
+        # Старые ссылки ?page=N обслуживаются прямым соединением таблиц.
+        path = 'legacy'
+        page_obj = get_page_context(
+            Post.objects.filter(author__following__user=user)
+            .select_related('author', 'group'),
+            request,
+        )
+    else:
+        path = 'hybrid'
+        # Все pull-авторы читаются одним потоком: сливаются два источника.
+        recent = Q(author_id__in=[author_id for author_id in pull_ids
+                                  if pull[author_id] is None])
+        for author_id in pull_ids:
+            if pull[author_id] is not None:
+                recent |= Q(author_id=author_id,
+                            pub_date__gte=pull[author_id])
+        sources = [
+            (entries, ('pub_date', 'post_id'), entry_item),
+            (Post.objects.filter(recent).select_related('author', 'group'),
+             ('pub_date', 'pk'), post_item),
+        ]
+        page_obj = get_page_context(
+            entries, request,
+            keyset=FeedPaginator(sources, settings.PAGINATOR_CONST,
+                                 probe=settings.PAGINATOR_KEYSET_PROBE),
+        )
+    registry.inc('yatube_feed_requests_total', {'path': path})
+    logger.debug('follow feed for user %s: %s, %s pull authors',
+                 user.pk, path, len(pull_ids))
+    return page_obj
@@ -17,6 +17,21 @@ class PostForm(forms.ModelForm):
             'group': 'Выберите группу поста (опционально)'
         }
 
+    def save(self, commit=True):
+        if 'image' in self.changed_data:
+            image = self.cleaned_data['image']
+            # ImageField формы уже прочитал заголовок загруженного файла.
+            pil_image = getattr(image, 'image', None)
+            if pil_image is not None:
+                self.instance.image_width, self.instance.image_height = (
+                    pil_image.size)
+                self.instance.image_size = image.size
+            else:
+                self.instance.image_width = None
+                self.instance.image_height = None
+                self.instance.image_size = None
+        return super().save(commit)
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,74 @@
+"""
+Кэш HTML-фрагментов постов.
+
+Один и тот же post_item.html нужен в нескольких лентах, поэтому
+фрагмент кэшируется по id поста и версии его содержимого: вся страница
+читается одним get_many, отрисовываются только промахи.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import thumbnails
+
+TEMPLATE = 'posts/includes/post_item.html'
+VARIANT = 'post_item'
+# Поднимать при изменении разметки post_item.html
+REVISION = 3
+KEY = 'post_item:{revision}:{pk}:{version}:{variant}'
+
+
+def content_version(post):
+    """Хэш всего, что попадает в фрагмент поста."""
+    author = post.author
+    group = post.group
+    parts = (
+        post.text, post.pub_date.isoformat(), post.image.name or '',
+        post.image_width, post.comment_count,
+        author.username, author.get_full_name(),
+        group.slug if group else '', group.title if group else '',
+    )
+    return hashlib.md5(
+        '\x00'.join(map(str, parts)).encode()).hexdigest()[:16]
+
+
+def fragment_key(post, without_group=False):
+    return KEY.format(revision=REVISION, pk=post.pk,
+                      version=content_version(post),
+                      variant=int(bool(without_group)))
+
+
+def render_post_items(posts, without_group=False):
+    """HTML постов страницы: кэш одним get_many, промахи - set_many."""
+    posts = list(posts)
+    keys = [fragment_key(post, without_group) for post in posts]
+    fragments = cache.get_many(keys)
+    missed = [(key, post) for key, post in zip(keys, posts)
+              if key not in fragments]
+    # Миниатюры всех промахов - одним обращением к KV-хранилищу sorl.
+    pictures = thumbnails.pictures(
+        {(post.image.name, post.image_width)
+         for _, post in missed if post.image},
+        VARIANT,
+    )
+    rendered = {
+        key: render_to_string(TEMPLATE, {
+            'post': post,
+            'without_group': without_group,
+            'pictures': pictures,
+        })
+        for key, post in missed
+    }
+    # Фрагмент с неполным набором миниатюр не кэшируем: остальные
+    # достроятся после ответа, и следующий показ соберёт полный srcset.
+    partial = {key for key, post in missed if post.image and (
+        pictures.get(post.image.name) or {}).get('partial')}
+    cacheable = {key: html for key, html in rendered.items()
+                 if key not in partial}
+    if cacheable:
+        cache.set_many(cacheable, settings.POST_FRAGMENT_TTL)
+    fragments.update(rendered)
+    return [mark_safe(fragments[key]) for key in keys]
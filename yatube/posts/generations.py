@@ -0,0 +1,45 @@
+"""
+Поколения кэша фрагментов.
+
+Ключ фрагмента включает номера поколений его областей ('posts',
+'group:<id>', 'author:<id>', ...). Сигналы моделей увеличивают номер
+при изменении данных, и старые фрагменты просто перестают читаться.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import connection, transaction
+
+KEY = 'generation:{}'
+
+
+def initial():
+    # После вытеснения счётчик не должен повторить старое значение.
+    return int(time.time() * 1000)
+
+
+def generations(*scopes):
+    """Текущие номера поколений в виде строки для ключа кэша."""
+    keys = [KEY.format(scope) for scope in scopes]
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, initial(), None)
+            values[key] = cache.get(key)
+    return '.'.join(str(values[key]) for key in keys)
+
+
+def bump(*scopes):
+    for scope in scopes:
+        key = KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, initial(), None)
+
+
+def invalidate(*scopes):
+    """Сдвигает поколения сейчас и ещё раз после коммита транзакции."""
+    bump(*scopes)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: bump(*scopes))
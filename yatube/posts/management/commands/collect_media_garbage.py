@@ -0,0 +1,155 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sorl.thumbnail import default
+
+from posts import media
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки, на которые не ссылается ни один пост, '
+            'их миниатюры и записи KV-хранилища sorl')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только посчитать мусор')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--checkpoint',
+                            help='файл контрольной точки для продолжения '
+                                 'прерванного прохода')
+        parser.add_argument('--min-age', type=int,
+                            default=settings.MEDIA_MIN_AGE,
+                            help='не трогать файлы моложе стольких секунд '
+                                 '(загрузки, ещё не попавшие в базу)')
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.checkpoint_path = options['checkpoint']
+        self.upload_to = Post.image.field.upload_to.strip('/')
+        self.max_mtime = time.time() - options['min_age']
+        self.started = time.monotonic()
+        self.state = self.load_checkpoint()
+        if self.state['phase'] == 'kvstore':
+            self.collect_kvstore()
+            self.state.update(phase='files', key='')
+            self.save_checkpoint()
+        self.collect_files()
+        stats = self.state['stats']
+        elapsed = time.monotonic() - self.started
+        action = 'найдено' if self.dry_run else 'удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Просмотрено записей KV: {stats["keys"]}, файлов: '
+            f'{stats["files"]}; {action} картинок: {stats["sources"]}, '
+            f'файлов: {stats["orphans"]} ({stats["bytes"]} байт); '
+            f'{elapsed:.1f} с, {stats["files"] / max(elapsed, 1e-6):.0f} '
+            f'файлов/с'))
+        if self.checkpoint_path and not self.dry_run:
+            os.remove(self.checkpoint_path)
+
+    def load_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as file:
+                return json.load(file)
+        return {
+            'phase': 'kvstore', 'key': '', 'path': '',
+            'stats': dict.fromkeys(
+                ('keys', 'sources', 'files', 'orphans', 'bytes'), 0),
+        }
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path or self.dry_run:
+            return
+        temporary = self.checkpoint_path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(self.state, file)
+        os.replace(temporary, self.checkpoint_path)
+
+    def progress(self):
+        stats = self.state['stats']
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            f'{self.state["phase"]}: записей {stats["keys"]}, файлов '
+            f'{stats["files"]}, мусора {stats["orphans"]}, '
+            f'{(stats["keys"] + stats["files"]) / max(elapsed, 1e-6):.0f}/с')
+
+    def collect_kvstore(self):
+        """Исходные картинки из KV sorl, которых нет ни у одного поста."""
+        stats = self.state['stats']
+        for batch in media.kvstore_images(self.state['key'],
+                                          self.batch_size):
+            sources = [image for _, image in batch
+                       if media.is_source(image.name, self.upload_to)]
+            live = media.live_images([image.name for image in sources])
+            for image in sources:
+                if image.name in live or self.is_fresh(image.name):
+                    continue
+                stats['sources'] += 1
+                if not self.dry_run:
+                    # Запись, миниатюры и их записи; сам файл - если есть.
+                    default.kvstore.delete(image)
+                    image.delete()
+            stats['keys'] += len(batch)
+            self.state['key'] = batch[-1][0]
+            self.save_checkpoint()
+            if self.verbosity > 1:
+                self.progress()
+
+    def is_fresh(self, name):
+        """
+        Файл моложе --min-age: такую же картинку могли только что
+        загрузить, а её пост ещё не виден.
+        """
+        try:
+            mtime = os.stat(os.path.join(settings.MEDIA_ROOT, name)).st_mtime
+        except FileNotFoundError:
+            return False
+        return mtime > self.max_mtime
+
+    def collect_files(self):
+        """Файлы картинок и миниатюр, на которые ничто не ссылается."""
+        root = settings.MEDIA_ROOT
+        batch = []
+        for path, entry in media.walk(root, self.state['path']):
+            batch.append((path, entry))
+            if len(batch) >= self.batch_size:
+                self.collect_batch(root, batch)
+                batch = []
+        if batch:
+            self.collect_batch(root, batch)
+
+    def collect_batch(self, root, batch):
+        stats = self.state['stats']
+        names = [path for path, _ in batch]
+        live = media.live_images(
+            [name for name in names if media.is_source(name, self.upload_to)])
+        live |= media.known_thumbnails(
+            [name for name in names if media.is_thumbnail(name)])
+        for path, entry in batch:
+            if path in live:
+                continue
+            if not (media.is_source(path, self.upload_to)
+                    or media.is_thumbnail(path)):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > self.max_mtime:
+                continue
+            stats['orphans'] += 1
+            stats['bytes'] += stat.st_size
+            if self.verbosity > 2:
+                self.stdout.write(path)
+            if not self.dry_run:
+                try:
+                    os.remove(os.path.join(root, path))
+                except FileNotFoundError:
+                    pass
+        stats['files'] += len(batch)
+        self.state['path'] = batch[-1][0]
+        self.save_checkpoint()
+        if self.verbosity > 1:
+            self.progress()
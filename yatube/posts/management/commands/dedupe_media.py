@@ -0,0 +1,75 @@
+import os
+import re
+import shutil
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from sorl import thumbnail
+
+from core.storage import blob_name, file_digest
+from posts.models import Post
+
+BLOB = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов в хранилище с адресацией по '
+            'содержимому, склеивая одинаковые файлы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только посчитать дубликаты')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        storage = Post.image.field.storage
+        upload_to = Post.image.field.upload_to.strip('/')
+        root = storage.path(upload_to)
+        self.dry_run = options['dry_run']
+        self.moved = self.duplicates = self.saved = 0
+        self.seen = set()
+        batch = []
+        for directory, _, files in os.walk(root):
+            for filename in sorted(files):
+                path = os.path.join(directory, filename)
+                relative = os.path.relpath(path, root).replace(os.sep, '/')
+                if BLOB.match(relative) or filename.startswith('.'):
+                    continue
+                with open(path, 'rb') as file:
+                    digest = file_digest(file)
+                name = f'{upload_to}/{relative}'
+                batch.append((name, blob_name(name, digest)))
+                if len(batch) >= options['batch_size']:
+                    self.migrate(storage, batch)
+                    batch = []
+        self.migrate(storage, batch)
+        prefix = 'найдено' if self.dry_run else 'перенесено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix} файлов: {self.moved}, дубликатов: {self.duplicates}, '
+            f'освобождено байт: {self.saved}'))
+
+    def migrate(self, storage, batch):
+        # Сначала появляется файл под новым именем, затем переключаются
+        # строки постов и только после коммита удаляются старые файлы.
+        for old, new in batch:
+            source, target = storage.path(old), storage.path(new)
+            if new in self.seen or os.path.exists(target):
+                self.duplicates += 1
+                self.saved += os.path.getsize(source)
+            elif not self.dry_run:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+            self.seen.add(new)
+            self.moved += 1
+        if self.dry_run or not batch:
+            return
+        with transaction.atomic():
+            for old, new in batch:
+                Post.objects.filter(image=old).update(image=new)
+        for old, _ in batch:
+            # Миниатюры старого имени больше не нужны, новые построятся.
+            thumbnail.delete(old, delete_file=False)
+            storage.delete(old)
@@ -0,0 +1,61 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from posts.models import Post
+from posts.thumbnails import process_image
+
+
+class Command(BaseCommand):
+    help = ('Строит миниатюры загруженных картинок и заполняет их размеры '
+            'в пуле процессов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='число процессов (по умолчанию по ядрам)')
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('--missing-only', action='store_true',
+                            help='только посты без сохранённых размеров')
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+        if options['missing_only']:
+            posts = posts.filter(image_width__isnull=True)
+        names = sorted(set(posts.values_list('image', flat=True)))
+        # Дочерние процессы не должны унаследовать открытые соединения.
+        connections.close_all()
+        started = time.monotonic()
+        done = failed = 0
+        pool = ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('fork'),
+        )
+        with pool:
+            results = pool.map(process_image, names,
+                               chunksize=max(1, options['chunk_size'] // 10))
+            batch = []
+            for result in results:
+                name, dimensions, error = result
+                if error:
+                    failed += 1
+                    self.stderr.write(f'{name}: {error}')
+                    continue
+                done += 1
+                batch.append((name, dimensions))
+                if len(batch) >= options['chunk_size']:
+                    self.save(batch)
+                    batch = []
+            self.save(batch)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {done}, ошибок: {failed}, '
+            f'{elapsed:.1f} с'))
+
+    @transaction.atomic
+    def save(self, batch):
+        for name, (width, height, size) in batch:
+            Post.objects.filter(image=name).update(
+                image_width=width, image_height=height, image_size=size)
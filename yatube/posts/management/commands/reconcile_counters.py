@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from posts import stats
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Сверяет денормализованные счётчики с данными и чинит расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только показать расхождения')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fix = not options['dry_run']
+        checked = drifted = missing = 0
+        for user_ids in stats.user_id_chunks(options['chunk_size']):
+            changed, created = stats.reconcile(user_ids, fix=fix)
+            checked += len(user_ids)
+            drifted += len(changed)
+            missing += len(created)
+            for row in changed:
+                self.stdout.write(f'user {row.user_id}: счётчики расходятся')
+        action = 'исправлено' if fix else 'найдено'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено пользователей: {checked}, {action} расхождений: '
+            f'{drifted}, отсутствующих строк: {missing}'))
+        checked = drifted = 0
+        for post_ids in stats.id_chunks(Post, options['chunk_size']):
+            changed = stats.reconcile_posts(post_ids, fix=fix)
+            checked += len(post_ids)
+            drifted += len(changed)
+            for post in changed:
+                self.stdout.write(f'post {post.pk}: счётчики комментариев '
+                                  f'расходятся')
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено постов: {checked}, {action} расхождений: {drifted}'))
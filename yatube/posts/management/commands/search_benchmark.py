@@ -0,0 +1,110 @@
+import itertools
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search, stats
+from posts.models import Post, User
+
+AUTHOR = 'search-benchmark'
+WORDS = (
+    'котики собаки погода город работа отпуск море горы книга фильм '
+    'музыка концерт поезд самолёт кофе чай утро вечер дождь солнце '
+    'снег лето зима весна осень друзья семья праздник дорога парк'
+).split()
+SYLLABLES = ('ка', 'ло', 'ми', 'ра', 'ту', 'не', 'со', 'ви', 'жа', 'пу',
+             'ре', 'ды', 'ко', 'ля', 'ши', 'бо')
+VOCABULARY_SIZE = 20000
+# Частоты слов в текстах - закон Ципфа: слово с номером r встречается
+# пропорционально 1 / r, поэтому в словаре есть и частые, и редкие слова.
+ZIPF_WEIGHTS = list(itertools.accumulate(
+    1 / rank for rank in range(1, VOCABULARY_SIZE + 1)))
+# Номера слов в словаре для запросов по умолчанию: от самого частого
+# до редкого, плюс запрос из двух слов
+DEFAULT_QUERIES = ((0,), (100,), (5000,), (10, 50))
+
+
+def vocabulary():
+    """Детерминированный словарь: осмысленные слова, затем синтетические."""
+    rng = random.Random(0)
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < VOCABULARY_SIZE:
+        word = ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает задержку полнотекстового поиска с LIKE-сканом; '
+            'с --populate дозаполняет базу синтетическими постами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--populate', type=int, default=0,
+                            help='довести число постов до N (например, '
+                                 '1000000)')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('queries', nargs='*',
+                            help='запросы (по умолчанию слова разной '
+                                 'частоты из словаря синтетических постов)')
+
+    def handle(self, *args, **options):
+        if options['populate']:
+            self.populate(options['populate'])
+        total = Post.objects.count()
+        self.stdout.write(f'Постов в базе: {total}')
+        limit = settings.PAGINATOR_CONST
+        words = vocabulary()
+        queries = options['queries'] or [
+            ' '.join(words[rank] for rank in ranks)
+            for ranks in DEFAULT_QUERIES
+        ]
+        for query in queries:
+            paginator = search.SearchPaginator(query, limit)
+            fts = self.measure(options['repeat'], paginator.get_page)
+            like = Post.objects.all()
+            for word in search.terms(query):
+                like = like.filter(text__icontains=word)
+            like = like.order_by('-pub_date')
+            scan = self.measure(options['repeat'],
+                                lambda: list(like.all()[:limit]))
+            self.stdout.write(
+                f'{query!r}: FTS p50 {fts[0]:.1f} мс, p95 {fts[1]:.1f} мс; '
+                f'LIKE p50 {scan[0]:.1f} мс, p95 {scan[1]:.1f} мс')
+
+    def measure(self, repeat, function):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return (statistics.median(timings),
+                timings[min(len(timings) - 1, int(len(timings) * 0.95))])
+
+    def populate(self, target, batch_size=10000):
+        author, _ = User.objects.get_or_create(username=AUTHOR)
+        missing = target - Post.objects.count()
+        rng = random.Random(target)
+        words = vocabulary()
+        started = time.perf_counter()
+        while missing > 0:
+            size = min(batch_size, missing)
+            with transaction.atomic():
+                Post.objects.bulk_create([
+                    Post(text=' '.join(rng.choices(
+                        words, cum_weights=ZIPF_WEIGHTS,
+                        k=rng.randint(5, 40))), author=author)
+                    for _ in range(size)
+                ])
+            missing -= size
+        # bulk_create не вызывает сигналы.
+        stats.recount(author.pk)
+        self.stdout.write(
+            f'Заполнено за {time.perf_counter() - started:.1f} с')
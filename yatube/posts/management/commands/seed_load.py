@@ -0,0 +1,310 @@
+import functools
+import os
+import random
+import shutil
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from faker import Faker
+
+from posts import stats, timeline
+from posts.models import Comment, Follow, Group, Post, User
+
+# Пароль всех сгенерированных пользователей (для входа в бенчмарках)
+PASSWORD = 'seed-password'
+# Показатели степенных распределений: кто пишет посты, какие посты
+# комментируют и на кого подписываются
+AUTHORS_EXPONENT = 1.1
+COMMENTS_EXPONENT = 1.2
+FOLLOWERS_EXPONENT = 1.0
+GROUP_SHARE = 0.6
+# Для перестановки «номер по популярности -> id»: взаимно просто почти
+# с любым числом строк, поэтому популярные id разбросаны по таблице
+SCATTER = 2654435761
+
+
+@functools.lru_cache(maxsize=None)
+def zipf_weights(size, exponent):
+    """Накопленные веса закона Ципфа для rng.choices(cum_weights=...)."""
+    weights, total = [], 0.0
+    for rank in range(1, size + 1):
+        total += rank ** -exponent
+        weights.append(total)
+    return weights
+
+
+def zipf_ids(rng, base, size, exponent, k):
+    """k id из [base, base + size) со степенным распределением."""
+    if size <= 0:
+        return []
+    weights = zipf_weights(size, exponent)
+    return [base + (rank * SCATTER) % size
+            for rank in rng.choices(range(size), cum_weights=weights, k=k)]
+
+
+def pub_date(plan, post_id):
+    """Дата поста - функция его id: посты идут по времени, как в жизни."""
+    position = (post_id - plan['posts'][0]) / max(plan['posts'][1], 1)
+    jitter = random.Random(post_id).random() / max(plan['posts'][1], 1)
+    return plan['start'] + plan['span'] * min(position + jitter, 1)
+
+
+def generate(task):
+    """Строки одной порции; зависят только от seed, вида и номера порции."""
+    kind, index, first, count, plan = task
+    rng = random.Random(f'{plan["seed"]}:{kind}:{index}')
+    fake = Faker('ru_RU')
+    fake.seed_instance(f'{plan["seed"]}:{kind}:{index}')
+    users_base, users = plan['users']
+    if kind == 'groups':
+        return [(pk, f'{fake.word().capitalize()} {fake.word()}',
+                 f'seed-group-{pk}', fake.sentence())
+                for pk in range(first, first + count)]
+    if kind == 'users':
+        return [(pk, f'seed{pk}', fake.first_name(), fake.last_name(),
+                 f'seed{pk}@example.com',
+                 plan['start'] + plan['span'] * rng.random())
+                for pk in range(first, first + count)]
+    if kind == 'posts':
+        groups_base, groups = plan['groups']
+        authors = zipf_ids(rng, users_base, users, AUTHORS_EXPONENT, count)
+        return [(pk, fake.paragraph(nb_sentences=rng.randint(1, 8)), author,
+                 groups_base + rng.randrange(groups)
+                 if groups and rng.random() < GROUP_SHARE else None,
+                 pub_date(plan, pk))
+                for pk, author in zip(range(first, first + count), authors)]
+    if kind == 'comments':
+        posts_base, posts = plan['posts']
+        end = plan['start'] + plan['span']
+        targets = zipf_ids(rng, posts_base, posts, COMMENTS_EXPONENT, count)
+        rows = []
+        for pk, post_id in zip(range(first, first + count), targets):
+            published = pub_date(plan, post_id)
+            rows.append((pk, post_id, users_base + rng.randrange(users),
+                         fake.sentence(),
+                         published + (end - published) * rng.random() ** 4))
+        return rows
+    if kind == 'follows':
+        rows = []
+        for user_id in range(first, first + count):
+            wanted = min(users - 1,
+                         int(rng.expovariate(1 / plan['follows_per_user'])))
+            authors = set()
+            while len(authors) < wanted:
+                authors.update(
+                    author for author in zipf_ids(
+                        rng, users_base, users, FOLLOWERS_EXPONENT,
+                        wanted - len(authors))
+                    if author != user_id)
+            rows.extend((user_id, author) for author in sorted(authors))
+        return rows
+    raise ValueError(kind)
+
+
+def ordered_results(executor, tasks, window):
+    """Результаты по порядку задач; в работе не больше window порций."""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(generate, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def create_with_dates(model, objects, field, dates):
+    """
+    bulk_create, затем настоящие даты: auto_now_add при вставке ставит
+    текущее время, а менять флаг на общем поле модели нельзя.
+    """
+    model.objects.bulk_create(objects)
+    for obj, value in zip(objects, dates):
+        setattr(obj, field, value)
+    model.objects.bulk_update(objects, [field])
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, группами, '
+            'постами, комментариями и подписками для бенчмарков; '
+            'сохраняет и восстанавливает снимок SQLite')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=300000)
+        parser.add_argument('--follows-per-user', type=float, default=20,
+                            help='среднее число подписок пользователя')
+        parser.add_argument('--days', type=int, default=730,
+                            help='за сколько дней до сейчас размазать даты')
+        parser.add_argument('--seed', default='0')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='процессов генерации (0 - в этом процессе)')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--snapshot',
+                            help='сохранить готовую базу в этот файл')
+        parser.add_argument('--restore',
+                            help='не генерировать, а восстановить базу '
+                                 'из снимка')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['restore']:
+            self.restore(options['restore'])
+            return
+        started = time.monotonic()
+        self.chunk_size = options['chunk_size']
+        end = timezone.now()
+        span = timedelta(days=options['days'])
+        self.plan = {
+            'seed': options['seed'],
+            'start': end - span,
+            'span': span,
+            'follows_per_user': options['follows_per_user'],
+        }
+        for kind, model, total in (
+                ('groups', Group, options['groups']),
+                ('users', User, options['users']),
+                ('posts', Post, options['posts']),
+                ('comments', Comment, options['comments'])):
+            base = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+            self.plan[kind] = (base, total)
+        # Подписки генерируются по читателям, а не по строкам.
+        self.plan['follows'] = self.plan['users']
+        # Дочерним процессам не нужны соединения родителя.
+        connections.close_all()
+        self.workers = options['workers']
+        executor = (ProcessPoolExecutor(self.workers) if self.workers
+                    else None)
+        try:
+            for kind in ('groups', 'users', 'posts', 'comments',
+                         'follows'):
+                self.load(kind, executor)
+        finally:
+            if executor:
+                executor.shutdown()
+        self.reset_sequences()
+        self.derive()
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'База заполнена за {time.monotonic() - started:.1f} с'))
+        if options['snapshot']:
+            self.snapshot(options['snapshot'])
+
+    def tasks(self, kind):
+        first, total = self.plan[kind]
+        for index, start in enumerate(range(0, total, self.chunk_size)):
+            yield (kind, index, first + start,
+                   min(self.chunk_size, total - start), self.plan)
+
+    def load(self, kind, executor):
+        started = time.monotonic()
+        tasks = self.tasks(kind)
+        # Вставка медленнее генерации: очередь готовых порций ограничена.
+        results = (ordered_results(executor, tasks, 2 * self.workers)
+                   if executor else map(generate, tasks))
+        insert = getattr(self, f'insert_{kind}')
+        rows = 0
+        for batch in results:
+            with transaction.atomic():
+                insert(batch)
+            rows += len(batch)
+            if self.verbosity > 1:
+                self.stdout.write(f'{kind}: {rows}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'{kind}: {rows} строк за {elapsed:.1f} с '
+                          f'({rows / max(elapsed, 1e-6):.0f}/с)')
+
+    def insert_groups(self, batch):
+        Group.objects.bulk_create([
+            Group(pk=pk, title=title, slug=slug, description=description)
+            for pk, title, slug, description in batch
+        ])
+
+    def insert_users(self, batch):
+        if not hasattr(self, 'password'):
+            self.password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(pk=pk, username=username, first_name=first_name,
+                 last_name=last_name, email=email, date_joined=joined,
+                 password=self.password)
+            for pk, username, first_name, last_name, email, joined in batch
+        ])
+
+    def insert_posts(self, batch):
+        create_with_dates(Post, [
+            Post(pk=pk, text=text, author_id=author_id, group_id=group_id)
+            for pk, text, author_id, group_id, _ in batch
+        ], 'pub_date', [row[-1] for row in batch])
+
+    def insert_comments(self, batch):
+        create_with_dates(Comment, [
+            Comment(pk=pk, post_id=post_id, author_id=author_id, text=text)
+            for pk, post_id, author_id, text, _ in batch
+        ], 'created', [row[-1] for row in batch])
+
+    def insert_follows(self, batch):
+        Follow.objects.bulk_create([
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in batch
+        ], ignore_conflicts=True)
+
+    def reset_sequences(self):
+        """
+        Строки вставлены с явными pk: последовательности PostgreSQL
+        сдвигаются за них (SQLite и так берёт следующий id из таблицы).
+        """
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [Group, User, Post, Comment, Follow])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def derive(self):
+        """Денормализованные данные, которые bulk_create не обновил."""
+        started = time.monotonic()
+        for user_ids in stats.user_id_chunks(self.chunk_size):
+            stats.reconcile(user_ids)
+        for post_ids in stats.id_chunks(Post, self.chunk_size):
+            stats.reconcile_posts(post_ids)
+        timeline.rebuild()
+        self.stdout.write(f'Счётчики и ленты за '
+                          f'{time.monotonic() - started:.1f} с')
+
+    def database_path(self):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Снимки поддерживаются только для SQLite')
+        return settings.DATABASES[connection.alias]['NAME']
+
+    def snapshot(self, path):
+        self.database_path()
+        if os.path.exists(path):
+            os.remove(path)
+        # Компактная копия базы без остановки соединения.
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM INTO %s', [path])
+        self.stdout.write(self.style.SUCCESS(
+            f'Снимок: {path} ({os.path.getsize(path) // 2**20} МБ)'))
+
+    def restore(self, path):
+        database = self.database_path()
+        if not os.path.exists(path):
+            raise CommandError(f'Нет снимка {path}')
+        connections.close_all()
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
+        shutil.copyfile(path, database)
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'База восстановлена из {path}'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = ('Переводит популярных авторов в pull-режим ленты и обратно '
+            '(запускать периодически, например из cron)')
+
+    def handle(self, *args, **options):
+        promoted, demoted = timeline.update_pull_authors()
+        self.stdout.write(self.style.SUCCESS(
+            f'В pull: {len(promoted)}, обратно в push: {len(demoted)}'))
@@ -0,0 +1,132 @@
+"""
+Ссылки на файлы картинок постов.
+
+Картинки лежат в хранилище с адресацией по содержимому (core.storage),
+поэтому один файл может принадлежать нескольким постам. Счётчиком ссылок
+служат сами строки Post: файл удаляется, когда на него не ссылается ни
+один пост и он старше MEDIA_MIN_AGE. Всё, что пропустили сигналы,
+находит collect_media_garbage.
+"""
+import os
+import time
+import uuid
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from sorl import thumbnail
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from .models import Post
+
+IMAGE_KEY_PREFIX = add_prefix('')
+
+
+def references(name):
+    return Post.objects.filter(image=name).count()
+
+
+def release(name):
+    """Удаляет файл и его миниатюры, если он больше никому не нужен."""
+    if not name or Post.objects.filter(image=name).exists():
+        return False
+    storage = Post.image.field.storage
+    try:
+        path = storage.path(name)
+    except SuspiciousFileOperation:
+        # Путь вне MEDIA_ROOT хранилищу не принадлежит.
+        return False
+    # Файл сначала уходит под временное имя. Загрузка того же содержимого
+    # после этого кладёт на место новый файл; свежий же забранный файл
+    # значит, что такая загрузка только что была и её пост может быть ещё
+    # не виден. Тогда файл возвращается: содержимое у них одно.
+    claimed = os.path.join(os.path.dirname(path),
+                           f'.release-{uuid.uuid4().hex}')
+    try:
+        os.rename(path, claimed)
+    except FileNotFoundError:
+        claimed = None
+    else:
+        if time.time() - os.stat(claimed).st_mtime < settings.MEDIA_MIN_AGE:
+            os.replace(claimed, path)
+            return False
+    # Вместе с записью KV-хранилища sorl уходят и миниатюры; миниатюры
+    # строятся по имени, то есть от хранилища по умолчанию.
+    thumbnail.delete(name, delete_file=False)
+    if claimed:
+        os.remove(claimed)
+    return True
+
+
+def release_on_commit(name):
+    if name:
+        transaction.on_commit(lambda: release(name))
+
+
+def live_images(names):
+    """Имена из names, на которые ссылается хотя бы один пост."""
+    return set(Post.objects.filter(image__in=names).values_list(
+        'image', flat=True).distinct())
+
+
+def known_thumbnails(names):
+    """Имена миниатюр, у которых есть запись в KV-хранилище sorl."""
+    keys = {add_prefix(ImageFile(name, default.storage).key): name
+            for name in names}
+    found = KVStore.objects.filter(key__in=keys).values_list(
+        'key', flat=True)
+    return {keys[key] for key in found}
+
+
+def kvstore_images(after='', batch_size=1000):
+    """
+    Записи картинок из KV-хранилища sorl порциями по возрастанию ключа:
+    списки пар (ключ, ImageFile).
+    """
+    while True:
+        rows = list(KVStore.objects.filter(
+            key__startswith=IMAGE_KEY_PREFIX, key__gt=after
+        ).order_by('key').values_list('key', 'value')[:batch_size])
+        if not rows:
+            return
+        yield [(key, ImageFile(deserialize(value)['name']))
+               for key, value in rows]
+        after = rows[-1][0]
+
+
+def is_source(name, upload_to):
+    return name.startswith(upload_to + '/')
+
+
+def is_thumbnail(name):
+    return name.startswith(thumbnail_settings.THUMBNAIL_PREFIX)
+
+
+def walk(root, after=''):
+    """
+    Файлы под root как пары (относительный путь, DirEntry) в порядке
+    возрастания пути, начиная после after. Каталоги, целиком лежащие
+    до контрольной точки, не читаются.
+    """
+    after = tuple(after.split('/')) if after else ()
+
+    def visit(directory, parts):
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=attrgetter('name'))
+        for entry in entries:
+            path = parts + (entry.name,)
+            if entry.is_dir(follow_symlinks=False):
+                if path < after[:len(path)]:
+                    continue
+                yield from visit(entry.path, path)
+            elif path > after:
+                yield '/'.join(path), entry
+
+    if os.path.isdir(root):
+        yield from visit(root, ())
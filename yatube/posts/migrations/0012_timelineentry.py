@@ -0,0 +1,69 @@
+# Generated by Django 2.2.16 on 2026-10-18 16:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Тот же INSERT ... SELECT, что timeline.REBUILD_SQL, но по таблицам этой
+# миграции: дубли подписок до 0014 схлопываются DISTINCT, лента читателя
+# обрезается до TIMELINE_DEPTH оконной функцией.
+FILL_SQL = (
+    'INSERT INTO {table} (user_id, post_id, author_id, pub_date)'
+    ' SELECT user_id, post_id, author_id, pub_date FROM ('
+    '  SELECT f.user_id, p.id AS post_id, p.author_id, p.pub_date,'
+    '  ROW_NUMBER() OVER ('
+    '   PARTITION BY f.user_id ORDER BY p.pub_date DESC, p.id DESC'
+    '  ) AS position'
+    '  FROM (SELECT DISTINCT user_id, author_id FROM {follows}) f'
+    '  JOIN {posts} p ON p.id IN ('
+    '   SELECT id FROM {posts} WHERE author_id = f.author_id'
+    '   ORDER BY pub_date DESC, id DESC LIMIT %s)'
+    ' ) ranked WHERE position <= %s'
+)
+
+
+def fill_timelines(apps, schema_editor):
+    schema_editor.execute(
+        FILL_SQL.format(
+            table=apps.get_model('posts', 'TimelineEntry')._meta.db_table,
+            follows=apps.get_model('posts', 'Follow')._meta.db_table,
+            posts=apps.get_model('posts', 'Post')._meta.db_table,
+        ),
+        [settings.TIMELINE_DEPTH, settings.TIMELINE_DEPTH],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0011_auto_20220304_2314'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='дата публикации поста')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='автор поста')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='posts.Post', verbose_name='пост')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='читатель')),
+            ],
+            options={
+                'verbose_name': 'запись ленты',
+                'verbose_name_plural': 'записи ленты',
+                'ordering': ('-pub_date', '-post'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='timeline_unique'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 2.2.16 on 2026-10-18 16:47
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    counters = {
+        'posts_count': (Post, 'author_id'),
+        'comments_count': (Comment, 'author_id'),
+        'follows_count': (Follow, 'user_id'),
+        'followers_count': (Follow, 'author_id'),
+    }
+    stats = {user_id: UserStats(user_id=user_id)
+             for user_id in User.objects.values_list('pk', flat=True)}
+    for field, (model, user_field) in counters.items():
+        rows = model.objects.order_by().values(user_field).annotate(
+            total=Count('pk'))
+        for row in rows:
+            setattr(stats[row[user_field]], field, row['total'])
+    UserStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0012_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='пользователь')),
+                ('posts_count', models.PositiveIntegerField(default=0, verbose_name='постов')),
+                ('comments_count', models.PositiveIntegerField(default=0, verbose_name='комментариев')),
+                ('follows_count', models.PositiveIntegerField(default=0, verbose_name='подписок')),
+                ('followers_count', models.PositiveIntegerField(db_index=True, default=0, verbose_name='подписчиков')),
+            ],
+            options={
+                'verbose_name': 'статистика пользователя',
+                'verbose_name_plural': 'статистика пользователей',
+            },
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
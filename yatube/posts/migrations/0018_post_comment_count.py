@@ -0,0 +1,74 @@
+# Generated by Django 2.2.16 on 2026-10-18 17:19
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+
+# AddField/RemoveField пересоздают posts_post в SQLite и теряют триггеры
+# FTS5 из 0017; миграция возвращает их сама.
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert AFTER INSERT ON"
+    " posts_post BEGIN"
+    " INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete AFTER DELETE ON"
+    " posts_post BEGIN"
+    " INSERT INTO posts_post_fts(posts_post_fts, rowid, text)"
+    " VALUES ('delete', old.id, old.text);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_update AFTER UPDATE OF text"
+    " ON posts_post BEGIN"
+    " INSERT INTO posts_post_fts(posts_post_fts, rowid, text)"
+    " VALUES ('delete', old.id, old.text);"
+    " INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);"
+    " END",
+]
+
+
+def restore_search_triggers(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        tables = connection.introspection.table_names(cursor)
+    if 'posts_post_fts' in tables:
+        for statement in SQLITE_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+def fill_comment_counts(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    comments = Comment.objects.filter(post=OuterRef('pk')).order_by(
+        ).values('post')
+    Post.objects.filter(pk__in=Comment.objects.values('post')).update(
+        comment_count=Subquery(
+            comments.annotate(total=Count('pk')).values('total')),
+        last_comment_at=Subquery(
+            comments.annotate(last=Max('created')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0017_post_search'),
+    ]
+
+    operations = [
+        # При откате RemoveField выполняется после этой операции.
+        migrations.RunPython(migrations.RunPython.noop,
+                             restore_search_triggers),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='число комментариев'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='последний комментарий'),
+        ),
+        migrations.RunPython(fill_comment_counts, migrations.RunPython.noop),
+        migrations.RunPython(restore_search_triggers,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pull_authors(apps, schema_editor):
+    # До этой миграции pull-авторами были все, кто выше порога.
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.filter(
+        followers_count__gte=settings.FEED_PULL_THRESHOLD
+    ).update(pull_feed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_post_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='pull_feed',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='посты читаются при запросе ленты'),
+        ),
+        migrations.RunPython(mark_pull_authors, migrations.RunPython.noop),
+    ]
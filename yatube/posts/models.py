@@ -2,6 +2,8 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.db.models import UniqueConstraint
 
+from core.storage import ContentAddressedStorage
+
 User = get_user_model()
 
 
@@ -39,9 +41,28 @@ class Post(models.Model):
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True,
         null=True
     )
+    # Заполняются PostForm и pregenerate_thumbnails, чтобы шаблоны знали
+    # размеры картинки, не открывая файл
+    image_width = models.PositiveIntegerField('ширина картинки',
+                                              null=True, blank=True,
+                                              editable=False)
+    image_height = models.PositiveIntegerField('высота картинки',
+                                               null=True, blank=True,
+                                               editable=False)
+    image_size = models.PositiveIntegerField('размер картинки, байт',
+                                             null=True, blank=True,
+                                             editable=False)
+    # Поддерживаются сигналами комментариев (posts.stats), чтобы ленты
+    # показывали число комментариев без COUNT по каждому посту
+    comment_count = models.PositiveIntegerField('число комментариев',
+                                                default=0, editable=False)
+    last_comment_at = models.DateTimeField('последний комментарий',
+                                           null=True, blank=True,
+                                           editable=False)
 
     class Meta:
         ordering = (
@@ -49,6 +70,12 @@ class Post(models.Model):
         )
         verbose_name = "пост"
         verbose_name_plural = "посты"
+        indexes = [
+            models.Index(fields=['group', 'pub_date'],
+                         name='post_group_pub_date_idx'),
+            models.Index(fields=['author', 'pub_date'],
+                         name='post_author_pub_date_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -79,6 +106,10 @@ class Comment(models.Model):
         ordering = ['-created']
         verbose_name = "комментарий"
         verbose_name_plural = "комментарии"
+        indexes = [
+            models.Index(fields=['post', 'created'],
+                         name='comment_post_created_idx'),
+        ]
 
     def __str__(self):
         return self.text[:30]
@@ -95,4 +126,55 @@ class Follow(models.Model):
     class Meta:
         verbose_name = "подписка"
         verbose_name_plural = "подписки"
-        UniqueConstraint(fields=['author', 'user'], name='follow_unique')
+        constraints = [
+            UniqueConstraint(fields=['user', 'author'], name='follow_unique'),
+        ]
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок читателя."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             verbose_name='читатель',
+                             related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             verbose_name='пост',
+                             related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               verbose_name='автор поста',
+                               related_name='+')
+    pub_date = models.DateTimeField('дата публикации поста')
+
+    class Meta:
+        ordering = ('-pub_date', '-post')
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'записи ленты'
+        constraints = [
+            UniqueConstraint(fields=['user', 'post'], name='timeline_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+        ]
+
+
+class UserStats(models.Model):
+    """Счётчики профиля, поддерживаемые при записи (см. posts.stats)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True,
+                                verbose_name='пользователь',
+                                related_name='stats')
+    posts_count = models.PositiveIntegerField('постов', default=0)
+    comments_count = models.PositiveIntegerField('комментариев', default=0)
+    follows_count = models.PositiveIntegerField('подписок', default=0)
+    followers_count = models.PositiveIntegerField('подписчиков', default=0,
+                                                  db_index=True)
+    # Переключается командой update_pull_authors (см. posts.feeds).
+    pull_feed = models.BooleanField('посты читаются при запросе ленты',
+                                    default=False, db_index=True)
+
+    class Meta:
+        verbose_name = 'статистика пользователя'
+        verbose_name_plural = 'статистика пользователей'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.posts_count}'
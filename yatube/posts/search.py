@@ -0,0 +1,147 @@
+"""
+Полнотекстовый поиск по постам.
+
+На SQLite индекс - виртуальная таблица FTS5 posts_post_fts с внешним
+содержимым (posts_post), на PostgreSQL - сгенерированный столбец
+search_vector с GIN-индексом; оба поддерживаются триггерами базы
+(миграция 0017). Выдача упорядочена по релевантности и листается
+курсором по (rank, id); ранжируются не больше SEARCH_MAX_CANDIDATES
+самых свежих совпадений.
+"""
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+from .utils import CURSOR_PARAM, KeysetPaginator
+
+MAX_TERMS = 8
+
+SearchHit = namedtuple('SearchHit', 'rank pk')
+
+# Подзапрос hits: (rank, id) для SEARCH_MAX_CANDIDATES последних
+# совпадений, чем больше rank, тем релевантнее.
+HITS_SQL = {
+    'sqlite': (
+        'SELECT -bm25(posts_post_fts) AS rank, rowid AS id'
+        ' FROM posts_post_fts WHERE posts_post_fts MATCH %s'
+        ' ORDER BY rowid DESC LIMIT %s'
+    ),
+    'postgresql': (
+        'SELECT ts_rank(search_vector, query)::float8 AS rank, id'
+        " FROM posts_post, plainto_tsquery('russian', %s) query"
+        ' WHERE search_vector @@ query ORDER BY id DESC LIMIT %s'
+    ),
+}
+IDS_SQL = {
+    'sqlite': 'SELECT rowid FROM posts_post_fts WHERE posts_post_fts MATCH %s',
+    'postgresql': (
+        'SELECT id FROM posts_post'
+        " WHERE search_vector @@ plainto_tsquery('russian', %s)"
+    ),
+}
+# Триггеры синхронизации FTS5 из миграции 0017. SQLite удаляет их, когда
+# миграция пересоздаёт posts_post (AddField с default и т.п.); такая
+# миграция восстанавливает их сама (0018), а проверка после каждого
+# migrate (signals.py) лишь страхует от пропущенных.
+SQLITE_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert AFTER INSERT ON"
+    " posts_post BEGIN"
+    " INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete AFTER DELETE ON"
+    " posts_post BEGIN"
+    " INSERT INTO posts_post_fts(posts_post_fts, rowid, text)"
+    " VALUES ('delete', old.id, old.text);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS posts_post_fts_update AFTER UPDATE OF text"
+    " ON posts_post BEGIN"
+    " INSERT INTO posts_post_fts(posts_post_fts, rowid, text)"
+    " VALUES ('delete', old.id, old.text);"
+    " INSERT INTO posts_post_fts(rowid, text) VALUES (new.id, new.text);"
+    " END",
+]
+
+
+def ensure_triggers(using):
+    """Восстанавливает триггеры FTS5, если индекс есть, а их нет."""
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return
+    with db.cursor() as cursor:
+        if 'posts_post_fts' not in db.introspection.table_names(cursor):
+            return
+        for statement in SQLITE_TRIGGERS:
+            cursor.execute(statement)
+
+
+def supported():
+    return connection.vendor in HITS_SQL
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def match_parameter(query):
+    """
+    Параметр поиска для текущей базы; None, если искать нечего.
+    Для FTS5 слова экранируются и ищутся по префиксу: стемминга
+    у unicode61 нет, а «котик» должен находить «котики».
+    """
+    words = terms(query)
+    if not words:
+        return None
+    if connection.vendor == 'sqlite':
+        return ' '.join(f'"{word}"*' for word in words)
+    return ' '.join(words)
+
+
+def search_posts(hits):
+    """Посты для страницы выдачи в порядке релевантности."""
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [hit.pk for hit in hits])
+    return [posts[hit.pk] for hit in hits if hit.pk in posts]
+
+
+class SearchPaginator(KeysetPaginator):
+    """Курсорная пагинация выдачи поиска по ключу (rank, id)."""
+
+    def __init__(self, query, per_page, probe=True):
+        super().__init__(None, per_page, keys=('rank', 'pk'), probe=probe,
+                         resolve=search_posts)
+        self.parameter = match_parameter(query)
+
+    def fetch_rows(self, position, reverse, limit):
+        if self.parameter is None:
+            return []
+        sql = f'SELECT rank, id FROM ({HITS_SQL[connection.vendor]}) hits'
+        params = [self.parameter, settings.SEARCH_MAX_CANDIDATES]
+        direction, compare = ('ASC', '>') if reverse else ('DESC', '<')
+        if position is not None:
+            sql += (f' WHERE rank {compare} %s'
+                    f' OR (rank = %s AND id {compare} %s)')
+            params += [position[0], position[0], position[1]]
+        sql += f' ORDER BY rank {direction}, id {direction} LIMIT %s'
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [SearchHit(*row) for row in cursor.fetchall()]
+
+
+def search_page(request, query):
+    paginator = SearchPaginator(query, settings.PAGINATOR_CONST,
+                                probe=settings.PAGINATOR_KEYSET_PROBE)
+    return paginator.get_page(request.GET.get(CURSOR_PARAM))
+
+
+def matching(queryset, query):
+    """Посты queryset, найденные индексом (для поиска в админке)."""
+    parameter = match_parameter(query)
+    if parameter is None:
+        return queryset.none()
+    return queryset.filter(
+        pk__in=RawSQL(IDS_SQL[connection.vendor], (parameter,)))
@@ -0,0 +1,206 @@
+import threading
+
+from django.core.signals import request_finished
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import media, search, stats, thumbnails, timeline
+from .generations import invalidate
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, 'posts_count', 1)
+        timeline.fan_out(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, using, **kwargs):
+    stats.bump(instance.author_id, 'posts_count', -1)
+    deleting_posts(using).pop(instance.pk, None)
+
+
+# Посты, удаляемые в этом потоке: их каскадно удаляемым комментариям
+# незачем обновлять счётчики поста. Отметка действует, пока ждёт своего
+# часа её обработчик on_commit: откат транзакции (или точки сохранения)
+# снимает обработчик, а с ним и отметку.
+deleting = threading.local()
+
+
+def deleting_posts(using):
+    """{pk поста: обработчик on_commit} для соединения using."""
+    if not hasattr(deleting, 'posts'):
+        deleting.posts = {}
+    posts = deleting.posts.setdefault(using, {})
+    pending = {func for _, func in
+               transaction.get_connection(using).run_on_commit}
+    for pk, release in list(posts.items()):
+        if release not in pending:
+            del posts[pk]
+    return posts
+
+
+def comment_post(comment):
+    """Пост комментария (для областей кэша) без лишнего запроса."""
+    if Comment.post.is_cached(comment):
+        return comment.post
+    return Post.objects.only('author_id', 'group_id').filter(
+        pk=comment.post_id).first()
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.author_id, 'comments_count', 1)
+        stats.comment_added(instance.post_id, instance.created)
+        invalidate(*comment_scopes(comment_post(instance)))
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, using, **kwargs):
+    posts = deleting_posts(using)
+
+    def release():
+        posts.pop(instance.pk, None)
+
+    # Удаление всегда идёт в транзакции, так что обработчик ждёт коммита.
+    posts[instance.pk] = release
+    transaction.on_commit(release, using=using)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, using, **kwargs):
+    stats.bump(instance.author_id, 'comments_count', -1)
+    if instance.post_id in deleting_posts(using):
+        return
+    stats.comment_removed(instance.post_id)
+    post = comment_post(instance)
+    if post is not None:
+        invalidate(*comment_scopes(post))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.bump(instance.user_id, 'follows_count', 1)
+        stats.bump(instance.author_id, 'followers_count', 1)
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    stats.bump(instance.user_id, 'follows_count', -1)
+    stats.bump(instance.author_id, 'followers_count', -1)
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+def post_scopes(post):
+    scopes = {'posts'}
+    for author_id in (post.author_id, getattr(post, '_saved_author_id', None)):
+        if author_id:
+            scopes.add(f'author:{author_id}')
+    for group_id in (post.group_id, getattr(post, '_saved_group_id', None)):
+        if group_id:
+            scopes.add(f'group:{group_id}')
+    return scopes
+
+
+def comment_scopes(post):
+    # Общее поколение 'posts' сбросило бы кэш всех страниц сайта; главной
+    # со счётчиками комментариев всех постов хватает своего 'comments'.
+    return post_scopes(post) - {'posts'} | {'comments'}
+
+
+@receiver(pre_save, sender=Post)
+def remember_saved(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        (instance._saved_group_id, instance._saved_image,
+         instance._saved_author_id) = Post.objects.filter(
+            pk=instance.pk).values_list(
+            'group_id', 'image', 'author_id').first() or (None, None, None)
+
+
+@receiver(pre_save, sender=Comment)
+def remember_comment_author(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._saved_author_id = Comment.objects.filter(
+            pk=instance.pk).values_list('author_id', flat=True).first()
+
+
+def previous_author(instance):
+    """Прежний автор, если сохранение его сменило (например, в админке)."""
+    saved = getattr(instance, '_saved_author_id', None)
+    if saved and saved != instance.author_id:
+        return saved
+    return None
+
+
+@receiver(post_save, sender=Post)
+def post_author_changed(sender, instance, created, raw=False, **kwargs):
+    old = previous_author(instance)
+    if old and not created and not raw:
+        stats.bump(old, 'posts_count', -1)
+        stats.bump(instance.author_id, 'posts_count', 1)
+        timeline.reassign(instance)
+
+
+@receiver(post_save, sender=Comment)
+def comment_author_changed(sender, instance, created, raw=False, **kwargs):
+    old = previous_author(instance)
+    if old and not created and not raw:
+        stats.bump(old, 'comments_count', -1)
+        stats.bump(instance.author_id, 'comments_count', 1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    invalidate(*post_scopes(instance))
+
+
+@receiver(post_save, sender=Post)
+def image_replaced(sender, instance, raw=False, **kwargs):
+    saved = getattr(instance, '_saved_image', None)
+    if saved and saved != instance.image.name and not raw:
+        media.release_on_commit(saved)
+
+
+@receiver(post_delete, sender=Post)
+def image_deleted(sender, instance, **kwargs):
+    media.release_on_commit(instance.image.name)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    invalidate('posts', 'groups', f'group:{instance.pk}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Вход пользователя сохраняет только last_login.
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    invalidate('posts', 'users', f'author:{instance.pk}')
+
+
+@receiver(request_finished)
+def thumbnails_after_response(sender, **kwargs):
+    thumbnails.flush()
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.label == 'posts':
+        search.ensure_triggers(using)
@@ -0,0 +1,128 @@
+"""Денормализованные счётчики профиля и комментариев поста."""
+from django.db.models import (Count, DateTimeField, F, Max, OuterRef,
+                              Subquery, Value)
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Follow, Post, User, UserStats
+
+# Поле счётчика -> (модель, поле модели с пользователем)
+COUNTERS = {
+    'posts_count': (Post, 'author_id'),
+    'comments_count': (Comment, 'author_id'),
+    'follows_count': (Follow, 'user_id'),
+    'followers_count': (Follow, 'author_id'),
+}
+
+
+def bump(user_id, field, delta):
+    """Атомарно сдвигает счётчик; отсутствующую строку не создаёт."""
+    UserStats.objects.filter(user_id=user_id).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+def actual_counts(user_ids):
+    """Настоящие значения счётчиков для набора пользователей."""
+    counts = {user_id: dict.fromkeys(COUNTERS, 0) for user_id in user_ids}
+    for field, (model, user_field) in COUNTERS.items():
+        rows = model.objects.filter(
+            **{f'{user_field}__in': user_ids}
+        ).order_by().values(user_field).annotate(total=Count('pk'))
+        for row in rows:
+            counts[row[user_field]][field] = row['total']
+    return counts
+
+
+def recount(user_id):
+    stats, _ = UserStats.objects.update_or_create(
+        user_id=user_id, defaults=actual_counts([user_id])[user_id])
+    return stats
+
+
+def get_stats(user):
+    """Счётчики пользователя; недостающая строка пересчитывается."""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        return recount(user.pk)
+
+
+def reconcile(user_ids, fix=True):
+    """Находит (и при fix исправляет) расхождения счётчиков."""
+    actual = actual_counts(user_ids)
+    stored = UserStats.objects.in_bulk(user_ids)
+    drifted, missing = [], []
+    for user_id, counts in actual.items():
+        stats = stored.get(user_id)
+        if stats is None:
+            missing.append(UserStats(user_id=user_id, **counts))
+            continue
+        if any(getattr(stats, field) != value
+               for field, value in counts.items()):
+            for field, value in counts.items():
+                setattr(stats, field, value)
+            drifted.append(stats)
+    if fix:
+        UserStats.objects.bulk_update(drifted, list(COUNTERS))
+        UserStats.objects.bulk_create(missing, ignore_conflicts=True)
+    return drifted, missing
+
+
+def id_chunks(model, size):
+    """Идентификаторы всех строк модели порциями по возрастанию."""
+    last = 0
+    while True:
+        ids = list(model.objects.filter(pk__gt=last).order_by(
+            'pk').values_list('pk', flat=True)[:size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def user_id_chunks(size):
+    return id_chunks(User, size)
+
+
+def comment_added(post_id, created):
+    """Атомарно учитывает новый комментарий поста."""
+    created = Value(created, output_field=DateTimeField())
+    Post.objects.filter(pk=post_id).update(
+        comment_count=F('comment_count') + 1,
+        last_comment_at=Greatest(Coalesce('last_comment_at', created),
+                                 created),
+    )
+
+
+def comment_removed(post_id):
+    """Атомарно учитывает удаление; время берётся у оставшихся."""
+    Post.objects.filter(pk=post_id).update(
+        comment_count=Greatest(F('comment_count') - 1, 0),
+        last_comment_at=Subquery(Comment.objects.filter(
+            post=OuterRef('pk')).order_by('-created').values('created')[:1]),
+    )
+
+
+def actual_post_counts(post_ids):
+    """Настоящие (comment_count, last_comment_at) для набора постов."""
+    counts = dict.fromkeys(post_ids, (0, None))
+    rows = Comment.objects.filter(post_id__in=post_ids).order_by().values(
+        'post_id').annotate(total=Count('pk'), last=Max('created'))
+    for row in rows:
+        counts[row['post_id']] = (row['total'], row['last'])
+    return counts
+
+
+def reconcile_posts(post_ids, fix=True):
+    """Находит (и при fix исправляет) расхождения счётчиков постов."""
+    actual = actual_post_counts(post_ids)
+    drifted = []
+    for post in Post.objects.filter(pk__in=post_ids).only(
+            'comment_count', 'last_comment_at'):
+        count, last = actual[post.pk]
+        if (post.comment_count, post.last_comment_at) != (count, last):
+            post.comment_count, post.last_comment_at = count, last
+            drifted.append(post)
+    if fix:
+        Post.objects.bulk_update(drifted,
+                                 ['comment_count', 'last_comment_at'])
+    return drifted
@@ -0,0 +1,18 @@
+from django import template
+
+from ..fragments import render_post_items
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_fragments(page_obj, without_group=False):
+    return render_post_items(page_obj, without_group)
+
+
+@register.simple_tag
+def page_window(page_obj, around=3):
+    """Номера страниц рядом с текущей, а не все страницы ленты."""
+    last = page_obj.paginator.num_pages
+    return range(max(page_obj.number - around, 1),
+                 min(page_obj.number + around, last) + 1)
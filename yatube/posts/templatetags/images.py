@@ -0,0 +1,25 @@
+from django import template
+
+from .. import thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('posts/includes/picture.html', takes_context=True)
+def picture(context, post, variant, css_class=''):
+    """
+    Адаптивная картинка поста: <picture> с srcset в нескольких форматах.
+    Контексты, заранее собранные пачкой (thumbnails.pictures), берутся
+    из переменной pictures.
+    """
+    if not post.image:
+        return {}
+    resolved = context.get('pictures') or {}
+    if post.image.name in resolved:
+        picture = resolved[post.image.name]
+    else:
+        picture = thumbnails.picture(post.image.name, variant,
+                                     post.image_width)
+    if picture is None:
+        return {}
+    return {**picture, 'css_class': css_class}
@@ -0,0 +1,84 @@
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts.models import Comment, Group, Post, User
+from posts.utils import EstimatedCountPaginator
+
+POSTS_ADMIN = reverse('admin:posts_post_changelist')
+COMMENTS_ADMIN = reverse('admin:posts_comment_changelist')
+POSTS_COUNT = 5
+
+
+class LargeTableAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='d')
+        cls.posts = Post.objects.bulk_create([
+            Post(text=f'Пост {i}', author=cls.author, group=cls.group)
+            for i in range(POSTS_COUNT)
+        ])
+        post = Post.objects.first()
+        Comment.objects.bulk_create([
+            Comment(post=post, author=cls.author, text=f'Комментарий {i}')
+            for i in range(POSTS_COUNT)
+        ])
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.admin)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_count_is_estimated_for_large_tables(self):
+        Post.objects.filter(text='Пост 0').delete()
+        paginator = EstimatedCountPaginator(Post.objects.all(), 10)
+        # Оценка по наибольшему ключу не замечает удалённых строк.
+        estimate = Post.objects.order_by('-pk').first().pk
+        self.assertEqual(paginator.count, estimate)
+        # Отфильтрованное число упёрлось в предел - страницы за ним
+        # считаются по оценке всей таблицы.
+        filtered = EstimatedCountPaginator(
+            Post.objects.filter(author=self.author), 1)
+        self.assertEqual(filtered.count, estimate)
+        self.assertEqual(len(filtered.page(POSTS_COUNT - 1).object_list), 1)
+        few = EstimatedCountPaginator(
+            Post.objects.filter(text='Пост 1'), 10)
+        self.assertEqual(few.count, 1)
+
+    def test_exact_count_below_limit(self):
+        paginator = EstimatedCountPaginator(Post.objects.all(), 10)
+        self.assertEqual(paginator.count, POSTS_COUNT)
+
+    def queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(context)
+
+    def test_queries_do_not_grow_with_rows(self):
+        before = [self.queries(url) for url in (POSTS_ADMIN, COMMENTS_ADMIN)]
+        other = User.objects.create_user(username='other')
+        post = Post.objects.create(text='Ещё пост', author=other,
+                                   group=Group.objects.create(
+                                       title='Другая', slug='other'))
+        Comment.objects.create(post=post, author=other, text='Ещё')
+        after = [self.queries(url) for url in (POSTS_ADMIN, COMMENTS_ADMIN)]
+        self.assertEqual(after, before)
+
+    def test_changelists_do_not_list_every_related_object(self):
+        response = self.client.get(POSTS_ADMIN)
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(response, f'<option value="{self.group.pk}"'
+                                         f'>{self.group.title}</option>')
+        response = self.client.get(COMMENTS_ADMIN)
+        self.assertContains(response, 'vForeignKeyRawIdAdminField')
+        self.assertNotContains(response, f'<option value="{self.author.pk}"')
+
+    def test_comment_search_by_exact_username(self):
+        response = self.client.get(COMMENTS_ADMIN, {'q': 'author'})
+        self.assertEqual(response.context['cl'].result_count, POSTS_COUNT)
+        response = self.client.get(COMMENTS_ADMIN, {'q': 'autho'})
+        self.assertEqual(response.context['cl'].result_count, 0)
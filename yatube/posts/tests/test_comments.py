@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Group, Post, User
+
+EXTRA = 3
+
+
+class CommentPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(
+            text='Пост', author=cls.user,
+            group=Group.objects.create(title='Группа', slug='group'))
+        total = settings.COMMENTS_PER_PAGE + EXTRA
+        for i in range(total):
+            Comment.objects.create(
+                post=cls.post,
+                author=User.objects.create_user(username=f'user{i}'),
+                text=f'Комментарий {i}')
+        cls.newest = f'Комментарий {total - 1}'
+        cls.oldest = 'Комментарий 0'
+        cls.detail = reverse('posts:post_detail', args=[cls.post.pk])
+        cls.more = reverse('posts:comments', args=[cls.post.pk])
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_post_detail_shows_newest_comments(self):
+        response = self.client.get(self.detail)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), settings.COMMENTS_PER_PAGE)
+        self.assertEqual(comments[0].text, self.newest)
+        self.assertNotContains(response, f'{self.oldest}<')
+        self.assertContains(response, 'data-more-comments')
+
+    def test_more_comments_fragment(self):
+        cursor = self.client.get(self.detail).context['comments'].next_cursor
+        # Авторы порции приходят тем же запросом, что и комментарии.
+        with self.assertNumQueries(3):
+            response = self.client.get(self.more, {'cursor': cursor})
+        self.assertEqual(len(response.context['comments']), EXTRA)
+        self.assertContains(response, self.oldest)
+        self.assertNotContains(response, self.newest)
+        self.assertNotContains(response, 'data-more-comments')
+
+    def test_more_comments_json(self):
+        cursor = self.client.get(self.detail).context['comments'].next_cursor
+        data = self.client.get(self.more, {
+            'cursor': cursor, 'format': 'json',
+        }).json()
+        self.assertEqual([comment['text'] for comment in data['comments']][-1],
+                         self.oldest)
+        self.assertEqual(data['comments'][-1]['author'], 'user0')
+        self.assertIsNone(data['next_cursor'])
+
+    def test_missing_post_is_404(self):
+        missing = reverse('posts:comments', args=[self.post.pk + 1])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+        self.assertEqual(
+            self.client.get(missing, {'format': 'json'}).status_code, 404)
+        other = Post.objects.create(text='Без комментариев', author=self.user)
+        self.assertEqual(
+            self.client.get(reverse('posts:comments', args=[other.pk]))
+            .status_code, 200)
+
+    def test_guest_gets_no_comments(self):
+        guest = Client()
+        self.assertIsNone(guest.get(self.detail).context['comments'])
+        self.assertEqual(guest.get(self.more).status_code, 302)
@@ -1,3 +1,4 @@
+import hashlib
 import shutil
 import tempfile
 
@@ -33,6 +34,11 @@ GIF = (
 LOGIN_CREATE_POST = f'{LOGIN_URL}?next={NEW_POST}'
 
 
+def blob(content, extension):
+    digest = hashlib.sha256(content).hexdigest()
+    return f'{settings.POST_PATH}/{digest[:2]}/{digest}{extension}'
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class FormsTests(TestCase):
 
@@ -118,10 +124,7 @@ class FormsTests(TestCase):
         self.assertEqual(post.text, data['text'])
         self.assertEqual(data['group'], post.group.id)
         self.assertEqual(post.author, self.user)
-        self.assertEqual(
-            post.image.name,
-            f'{settings.POST_PATH}/{UPLOADED.name}'
-        )
+        self.assertEqual(post.image.name, blob(SMALL_GIF, '.gif'))
         self.assertRedirects(response, self.PROFILE_URL)
 
     def test_new_post_show_correct_context(self):
@@ -158,8 +161,7 @@ class FormsTests(TestCase):
         post = response.context['post']
         self.assertEqual(post.text, form_data['text'])
         self.assertEqual(form_data['group'], post.group.id)
-        self.assertEqual(post.image.name,
-                         f'{settings.POST_PATH}/{UPLOADED.name}')
+        self.assertEqual(post.image.name, blob(GIF, '.gif'))
         self.assertEqual(post.author, self.post.author)
         self.assertRedirects(response, self.POST_URL)
 
@@ -0,0 +1,46 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from posts import fragments
+from posts.models import Group, Post, User
+
+
+class PostFragmentsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='author')
+        cls.group = Group.objects.create(title='Заголовок группы', slug='s',
+                                         description='d')
+        Post.objects.bulk_create([
+            Post(text=str(i), author=cls.user, group=cls.group)
+            for i in range(3)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def posts(self):
+        return list(Post.objects.select_related('author', 'group'))
+
+    def test_only_misses_are_rendered(self):
+        spy = mock.patch.object(fragments, 'render_to_string',
+                                wraps=fragments.render_to_string)
+        with spy as render:
+            first = fragments.render_post_items(self.posts())
+            self.assertEqual(render.call_count, 3)
+            Post.objects.filter(text='0').update(text='изменён')
+            second = fragments.render_post_items(self.posts())
+            self.assertEqual(render.call_count, 4)
+        changed = [html for html in second if 'изменён' in html]
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(len(set(first) & set(second)), 2)
+
+    def test_variants_are_cached_separately(self):
+        post = self.posts()[0]
+        with_group, = fragments.render_post_items([post])
+        without_group, = fragments.render_post_items([post], True)
+        self.assertIn(self.group.title, with_group)
+        self.assertNotIn(self.group.title, without_group)
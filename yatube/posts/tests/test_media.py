@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from sorl.thumbnail import get_thumbnail
+
+from core import storage
+from posts import media
+from posts.models import Post, User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.storage = Post.image.field.storage
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create(self, filename, content=GIF):
+        post = Post(text=filename, author=self.user)
+        post.image.save(filename, ContentFile(content))
+        return post
+
+    def age(self, name):
+        old = time.time() - settings.MEDIA_MIN_AGE - 1
+        os.utime(self.storage.path(name), (old, old))
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.create('small.gif')
+        second = self.create('SMALL_copy.GIF')
+        other = self.create('other.gif', GIF + b'\x00')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertRegex(first.image.name, r'^posts/[0-9a-f]{2}/[0-9a-f]{64}'
+                                           r'\.gif$')
+        self.assertEqual(media.references(first.image.name), 2)
+        directory = os.path.dirname(self.storage.path(first.image.name))
+        self.assertEqual(os.listdir(directory),
+                         [os.path.basename(first.image.name)])
+
+    def test_uploads_are_readable(self):
+        post = self.create('small.gif')
+        mode = os.stat(self.storage.path(post.image.name)).st_mode & 0o777
+        self.assertEqual(mode, 0o666 & ~storage.UMASK)
+        with override_settings(FILE_UPLOAD_PERMISSIONS=0o640):
+            other = self.create('other.gif', GIF + b'\x00')
+            mode = os.stat(self.storage.path(other.image.name)).st_mode
+        self.assertEqual(mode & 0o777, 0o640)
+
+    def test_release_keeps_referenced_files(self):
+        first = self.create('small.gif')
+        second = self.create('small.gif')
+        name = first.image.name
+        self.age(name)
+        first.delete()
+        self.assertFalse(media.release(name))
+        self.assertTrue(self.storage.exists(name))
+        second.delete()
+        self.assertTrue(media.release(name))
+        self.assertFalse(self.storage.exists(name))
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(name))),
+                         [])
+
+    def test_release_keeps_fresh_files(self):
+        post = self.create('small.gif')
+        name = post.image.name
+        post.delete()
+        self.assertFalse(media.release(name))
+        self.assertTrue(self.storage.exists(name))
+
+    def release_during_upload(self, upload_first):
+        """release, в который вклинивается загрузка того же файла."""
+        post = self.create('small.gif')
+        name = post.image.name
+        self.age(name)
+        post.delete()
+        rename = os.rename
+        uploads = []
+
+        def racing_rename(source, destination):
+            if not upload_first:
+                rename(source, destination)
+            uploads.append(self.create('copy.gif'))
+            if upload_first:
+                rename(source, destination)
+
+        with mock.patch.object(media.os, 'rename', racing_rename):
+            media.release(name)
+        upload, = uploads
+        self.assertEqual(upload.image.name, name)
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), GIF)
+
+    def test_upload_before_release_claims_file(self):
+        self.release_during_upload(upload_first=True)
+
+    def test_upload_after_release_claims_file(self):
+        self.release_during_upload(upload_first=False)
+
+    def test_dedupe_media(self):
+        os.makedirs(self.storage.path('posts'))
+        for filename in ('small.gif', 'small_0Ja3tii.gif'):
+            with open(self.storage.path(f'posts/{filename}'), 'wb') as file:
+                file.write(GIF)
+            Post.objects.create(text=filename, author=self.user,
+                                image=f'posts/{filename}')
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        names = set(Post.objects.filter(
+            author=self.user).values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name, = names
+        self.assertTrue(self.storage.exists(name))
+        self.assertFalse(self.storage.exists('posts/small.gif'))
+        self.assertFalse(self.storage.exists('posts/small_0Ja3tii.gif'))
+        self.assertIn('дубликатов: 1', out.getvalue())
+
+    def test_release_ignores_foreign_paths(self):
+        self.assertFalse(media.release('/tmp/outside.jpg'))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CollectMediaGarbageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.storage = Post.image.field.storage
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        cache.clear()
+        self.live = self.storage.save('posts/live.gif', ContentFile(GIF))
+        Post.objects.create(text='живой', author=self.user, image=self.live)
+        self.dead = self.storage.save('posts/dead.gif',
+                                      ContentFile(GIF + b'\x00'))
+        self.live_thumb = get_thumbnail(self.live, '10x10').name
+        self.dead_thumb = get_thumbnail(self.dead, '10x10').name
+        self.stray = default_storage.save('cache/00/00/stray.jpg',
+                                          ContentFile(b'x'))
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_media_garbage', '--min-age=0', *args,
+                     stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_deletes_nothing(self):
+        output = self.collect('--dry-run')
+        for name in (self.live, self.dead, self.live_thumb,
+                     self.dead_thumb, self.stray):
+            self.assertTrue(default_storage.exists(name), name)
+        self.assertIn('найдено картинок: 1', output)
+
+    def test_orphans_are_deleted(self):
+        self.collect('--batch-size=2')
+        for name in (self.live, self.live_thumb):
+            self.assertTrue(default_storage.exists(name), name)
+        for name in (self.dead, self.dead_thumb, self.stray):
+            self.assertFalse(default_storage.exists(name), name)
+        self.assertIsNotNone(get_thumbnail(self.live, '10x10').name)
+
+    def test_fresh_images_are_kept(self):
+        out = StringIO()
+        call_command('collect_media_garbage', stdout=out)
+        self.assertIn('удалено картинок: 0', out.getvalue())
+        for name in (self.dead, self.dead_thumb):
+            self.assertTrue(default_storage.exists(name), name)
+
+    def test_resumes_from_checkpoint(self):
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'gc.json')
+        with open(checkpoint, 'w') as file:
+            json.dump({'phase': 'files', 'key': '', 'path': 'posts',
+                       'stats': dict.fromkeys(('keys', 'sources', 'files',
+                                               'orphans', 'bytes'), 0)},
+                      file)
+        self.collect(f'--checkpoint={checkpoint}')
+        # Миниатюры в cache/ лежат до контрольной точки.
+        self.assertTrue(default_storage.exists(self.stray))
+        self.assertFalse(default_storage.exists(self.dead))
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_walk_skips_up_to_checkpoint(self):
+        paths = [path for path, _ in media.walk(TEMP_MEDIA_ROOT)]
+        self.assertEqual(paths, sorted(paths))
+        after = [path for path, _ in media.walk(TEMP_MEDIA_ROOT, paths[1])]
+        self.assertEqual(after, paths[2:])
@@ -0,0 +1,77 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from core.queries import view_stats
+from posts.generations import bump
+from posts.models import Comment, Follow, Group, Post, User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    """Страницы укладываются в бюджеты запросов из QUERY_BUDGETS."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='reader')
+        cls.author = User.objects.create(username='author')
+        cls.group = Group.objects.create(title='t', slug='s', description='d')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for i in range(settings.PAGINATOR_CONST):
+            post = Post.objects.create(
+                text=str(i),
+                author=(cls.author, cls.user)[i % 2],
+                group=cls.group,
+                image=SimpleUploadedFile(f'{i}.gif', SMALL_GIF,
+                                         content_type='image/gif'),
+            )
+            Comment.objects.create(post=post, author=cls.user, text='c')
+            Comment.objects.create(post=post, author=cls.author, text='c')
+        cls.post = post
+        cls.urls = {
+            'posts:index': reverse('posts:index'),
+            'posts:group': reverse('posts:group', args=[cls.group.slug]),
+            'posts:profile': reverse('posts:profile',
+                                     args=[cls.author.username]),
+            'posts:post_detail': reverse('posts:post_detail',
+                                         args=[cls.post.pk]),
+            'posts:follow_index': reverse('posts:follow_index'),
+            'posts:comments': reverse('posts:comments', args=[cls.post.pk]),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_views_within_budget(self):
+        self.client.force_login(self.user)
+        for view_name, url in self.urls.items():
+            with self.subTest(view=view_name):
+                cache.clear()
+                # Первый запрос создаёт миниатюры, бюджет - для повторных.
+                with self.settings(QUERY_BUDGET_STRICT=False):
+                    self.client.get(url)
+                view_stats.clear()
+                bump('posts', 'users', 'groups')
+                self.assertEqual(self.client.get(url).status_code, 200)
+                stats = view_stats[view_name]
+                self.assertEqual(stats.requests, 1)
+                self.assertLessEqual(stats.max_queries,
+                                     settings.QUERY_BUDGETS[view_name])
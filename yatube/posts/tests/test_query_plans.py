@@ -0,0 +1,83 @@
+from unittest import skipUnless
+
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts.utils import KeysetPaginator
+
+PER_PAGE = 11
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN из SQLite')
+class QueryPlanTests(TestCase):
+    """Горячие запросы лент не должны сканировать таблицы и сортировать."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='reader')
+        cls.author = User.objects.create(username='author')
+        cls.group = Group.objects.create(title='t', slug='s', description='d')
+        cls.post = Post.objects.create(text='t', author=cls.author,
+                                       group=cls.group)
+        Comment.objects.create(post=cls.post, author=cls.user, text='c')
+        Follow.objects.create(user=cls.user, author=cls.author)
+
+    def plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queryset):
+        for detail in self.plan(queryset):
+            self.assertNotIn('TEMP B-TREE', detail, queryset.query)
+            if detail.startswith('SCAN'):
+                self.assertIn('INDEX', detail, queryset.query)
+
+    def feed_queries(self, queryset, keys=('pub_date', 'pk'), row=None):
+        paginator = KeysetPaginator(queryset, PER_PAGE, keys=keys)
+        position = paginator.row_key(row or self.post)
+        yield paginator.order(queryset)[:PER_PAGE]
+        for reverse in (False, True):
+            yield paginator.order(
+                paginator.filter_after(queryset, position, reverse),
+                reverse,
+            )[:PER_PAGE]
+
+    def test_post_feeds(self):
+        feeds = [
+            Post.objects.all(),
+            self.group.posts.all(),
+            self.author.posts.all(),
+            Post.objects.select_related('author', 'group'),
+        ]
+        for feed in feeds:
+            for queryset in self.feed_queries(feed):
+                with self.subTest(query=str(queryset.query)):
+                    self.assertIndexed(queryset)
+
+    def test_follow_timeline(self):
+        entries = self.user.timeline.all()
+        for queryset in self.feed_queries(entries, ('pub_date', 'post_id'),
+                                          entries.first()):
+            with self.subTest(query=str(queryset.query)):
+                self.assertIndexed(queryset)
+
+    def test_comments(self):
+        comment = self.post.comments.first()
+        for queryset in self.feed_queries(self.post.comments.all(),
+                                          ('created', 'pk'), comment):
+            with self.subTest(query=str(queryset.query)):
+                self.assertIndexed(queryset)
+
+    def test_follow_lookup(self):
+        follow = Follow.objects.filter(user=self.user, author=self.author)
+        self.assertIndexed(follow)
+        self.assertIn('(user_id=? AND author_id=?)',
+                      ' '.join(self.plan(follow)))
+
+    def test_follow_is_unique(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=self.author)
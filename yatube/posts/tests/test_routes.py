@@ -13,11 +13,13 @@ class ReverseTests(TestCase):
     urls_names = [
         ['/', 'index', []],
         ['/create/', 'create', []],
+        ['/search/', 'search', []],
         [f'/group/{SLUG}/', 'group', [SLUG]],
         [f'/profile/{USERNAME}/', 'profile', [USERNAME]],
         [f'/posts/{POST_ID}/', 'post_detail', [POST_ID]],
         [f'/posts/{POST_ID}/edit/', 'post_edit', [POST_ID]],
         [f'/posts/{POST_ID}/comment/', 'add_comment', [POST_ID]],
+        [f'/posts/{POST_ID}/comments/', 'comments', [POST_ID]],
         ['/follow/', 'follow_index', []],
         [f'/profile/{USERNAME}/follow/', 'profile_follow', [USERNAME]],
         [f'/profile/{USERNAME}/unfollow/',
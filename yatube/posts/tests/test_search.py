@@ -0,0 +1,134 @@
+from unittest import skipUnless
+
+from django.conf import settings
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+
+from posts import search
+from posts.models import Group, Post, User
+
+SEARCH = reverse('posts:search')
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group',
+                                         description='d')
+
+    def found(self, query, **params):
+        response = self.client.get(SEARCH, {'q': query, **params})
+        return [post.text for post in response.context['page_obj']]
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        post = Post.objects.create(text='Пушистые котики', author=self.user,
+                                   group=self.group)
+        self.assertEqual(self.found('котики'), ['Пушистые котики'])
+        Post.objects.filter(pk=post.pk).update(text='Лохматые собаки')
+        self.assertEqual(self.found('котики'), [])
+        self.assertEqual(self.found('собаки'), ['Лохматые собаки'])
+        post.delete()
+        self.assertEqual(self.found('собаки'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'триггеры FTS5')
+    def test_triggers_restored_after_table_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER posts_post_fts_insert')
+        search.ensure_triggers(connection.alias)
+        Post.objects.create(text='котики', author=self.user,
+                            group=self.group)
+        self.assertEqual(self.found('котики'), ['котики'])
+
+    def test_prefix_and_all_terms_match(self):
+        Post.objects.create(text='Котики спят', author=self.user,
+                            group=self.group)
+        Post.objects.create(text='Котики едят', author=self.user,
+                            group=self.group)
+        self.assertEqual(len(self.found('котик')), 2)
+        self.assertEqual(self.found('котик спят'), ['Котики спят'])
+
+    def test_results_ranked_by_relevance(self):
+        Post.objects.create(text='котики и ещё много других слов про '
+                                 'погоду, город и работу',
+                            author=self.user, group=self.group)
+        Post.objects.create(text='котики котики котики', author=self.user,
+                            group=self.group)
+        self.assertEqual(self.found('котики')[0], 'котики котики котики')
+
+    def test_keyset_pages_cover_all_results(self):
+        total = settings.PAGINATOR_CONST + 3
+        Post.objects.bulk_create([
+            Post(text='котики ' * (i % 4 + 1), author=self.user,
+                 group=self.group)
+            for i in range(total)
+        ])
+        response = self.client.get(SEARCH, {'q': 'котики'})
+        first = response.context['page_obj']
+        self.assertEqual(len(first), settings.PAGINATOR_CONST)
+        self.assertContains(response, 'q=%D0%BA')
+        second = self.client.get(SEARCH, {
+            'q': 'котики', 'cursor': first.next_cursor,
+        }).context['page_obj']
+        self.assertEqual(len(second), 3)
+        self.assertFalse(second.has_next())
+        pks = {post.pk for post in first} | {post.pk for post in second}
+        self.assertEqual(len(pks), total)
+
+    @override_settings(SEARCH_MAX_CANDIDATES=2)
+    def test_only_latest_matches_are_ranked(self):
+        Post.objects.create(text='котики котики котики', author=self.user,
+                            group=self.group)
+        Post.objects.create(text='котики', author=self.user, group=self.group)
+        Post.objects.create(text='и котики', author=self.user,
+                            group=self.group)
+        self.assertEqual(self.found('котики'), ['котики', 'и котики'])
+
+    def test_query_syntax_is_escaped(self):
+        Post.objects.create(text='котики', author=self.user,
+                            group=self.group)
+        self.assertEqual(self.found('"котики*:('), ['котики'])
+        self.assertEqual(self.found('***'), [])
+        response = self.client.get(SEARCH)
+        self.assertIsNone(response.context['page_obj'])
+
+    def test_admin_search_uses_index(self):
+        Post.objects.create(text='Пушистые котики', author=self.user,
+                            group=self.group)
+        Post.objects.create(text='Пушистые собаки', author=self.user,
+                            group=self.group)
+        self.assertEqual(
+            list(search.matching(Post.objects.all(), 'котик').values_list(
+                'text', flat=True)),
+            ['Пушистые котики'])
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        client = Client()
+        client.force_login(admin)
+        response = client.get(reverse('admin:posts_post_changelist'),
+                              {'q': 'котик'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'триггеры FTS5')
+class SearchMigrationTests(TransactionTestCase):
+    def triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = "
+                           "'trigger' AND name LIKE 'posts_post_fts_%'")
+            return len(cursor.fetchall())
+
+    def migrate(self, name):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('posts', name)])
+
+    def test_table_rebuild_keeps_triggers(self):
+        # Без сигнала post_migrate: триггеры - забота самой миграции.
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes('posts')
+        self.addCleanup(self.migrate, latest[0][1])
+        self.migrate('0017_post_search')
+        self.assertEqual(self.triggers(), 3)
+        self.migrate('0018_post_comment_count')
+        self.assertEqual(self.triggers(), 3)
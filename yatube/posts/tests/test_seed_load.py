@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import F
+from django.test import TestCase
+from django.utils.timezone import now
+
+from posts.management.commands.seed_load import generate
+from posts.models import Comment, Follow, Group, Post, TimelineEntry, User
+
+SIZES = {'users': 30, 'groups': 3, 'posts': 120, 'comments': 200}
+
+
+class SeedLoadTests(TestCase):
+    def seed(self, *args):
+        call_command('seed_load', '--workers=0', '--chunk-size=50',
+                     *(f'--{name}={value}' for name, value in SIZES.items()),
+                     *args, stdout=StringIO())
+
+    def test_seeds_consistent_dataset(self):
+        self.seed()
+        self.assertEqual(User.objects.count(), SIZES['users'])
+        self.assertEqual(Group.objects.count(), SIZES['groups'])
+        self.assertEqual(Post.objects.count(), SIZES['posts'])
+        self.assertEqual(Comment.objects.count(), SIZES['comments'])
+        self.assertFalse(Follow.objects.filter(
+            user_id=F('author_id')).exists())
+        # Денормализованные данные восстановлены после bulk_create.
+        post = Post.objects.order_by('-comment_count').first()
+        self.assertEqual(post.comment_count, post.comments.count())
+        user = Follow.objects.first().user
+        self.assertEqual(user.stats.follows_count, user.follower.count())
+        self.assertTrue(TimelineEntry.objects.filter(user=user).exists())
+        # Даты из плана, а не время вставки; auto_now_add не тронут.
+        self.assertLess(Post.objects.earliest('pub_date').pub_date,
+                        now() - timedelta(days=1))
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+        # Комментарии не старше постов.
+        for comment in Comment.objects.select_related('post')[:50]:
+            self.assertGreaterEqual(comment.created, comment.post.pub_date)
+
+    def test_chunks_are_deterministic(self):
+        plan = {'seed': '7', 'users': (1, 100), 'groups': (1, 5),
+                'posts': (1, 1000), 'follows_per_user': 5,
+                'start': datetime(2020, 1, 1, tzinfo=timezone.utc),
+                'span': timedelta(days=365)}
+        for kind in ('users', 'posts', 'comments', 'follows'):
+            task = (kind, 3, 151, 50, plan)
+            self.assertEqual(generate(task), generate(task), kind)
@@ -0,0 +1,191 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.signals import pre_delete
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from posts.generations import generations
+from posts.models import (Comment, Follow, Group, Post, TimelineEntry,
+                          User, UserStats)
+from posts.stats import get_stats
+
+
+class UserStatsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='user')
+        cls.author = User.objects.create(username='author')
+
+    def counters(self, user):
+        stats = UserStats.objects.get(user=user)
+        return (stats.posts_count, stats.comments_count,
+                stats.follows_count, stats.followers_count)
+
+    def test_counters_follow_writes_and_cascades(self):
+        author = User.objects.create(username='temporary')
+        post = Post.objects.create(text='post', author=author)
+        Comment.objects.create(post=post, author=self.user, text='c')
+        Follow.objects.create(user=self.user, author=author)
+        self.assertEqual(self.counters(self.user), (0, 1, 1, 0))
+        self.assertEqual(self.counters(author), (1, 0, 0, 1))
+        Post.objects.filter(pk=post.pk).delete()
+        self.assertEqual(self.counters(self.user), (0, 0, 1, 0))
+        author_id = author.pk
+        author.delete()
+        self.assertEqual(self.counters(self.user), (0, 0, 0, 0))
+        self.assertFalse(UserStats.objects.filter(user_id=author_id).exists())
+
+    def test_author_change_moves_counters(self):
+        reader = User.objects.create(username='reader')
+        Follow.objects.create(user=reader, author=self.author)
+        post = Post.objects.create(text='post', author=self.user)
+        comment = Comment.objects.create(post=post, author=self.user,
+                                         text='c')
+        post.author = comment.author = self.author
+        post.save()
+        comment.save()
+        self.assertEqual(self.counters(self.user), (0, 0, 0, 0))
+        self.assertEqual(self.counters(self.author), (1, 1, 0, 1))
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(post=post).values_list(
+                'user_id', 'author_id')),
+            [(reader.pk, self.author.pk)])
+
+    def test_profile_uses_counters(self):
+        Post.objects.create(text='post', author=self.author)
+        response = self.client.get(
+            reverse('posts:profile', args=[self.author.username]))
+        self.assertEqual(response.context['stats'].posts_count, 1)
+
+    def test_missing_row_is_recounted(self):
+        Post.objects.create(text='post', author=self.author)
+        UserStats.objects.filter(user=self.author).delete()
+        author = User.objects.get(pk=self.author.pk)
+        self.assertEqual(get_stats(author).posts_count, 1)
+
+    def test_reconcile_repairs_drift(self):
+        Post.objects.create(text='post', author=self.author)
+        UserStats.objects.filter(user=self.author).update(posts_count=7)
+        UserStats.objects.filter(user=self.user).delete()
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertEqual(self.counters(self.author), (7, 0, 0, 0))
+        call_command('reconcile_counters', stdout=out)
+        self.assertEqual(self.counters(self.author), (1, 0, 0, 0))
+        self.assertEqual(self.counters(self.user), (0, 0, 0, 0))
+
+
+class PostCommentCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author')
+        cls.reader = User.objects.create(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+
+    def setUp(self):
+        self.post = Post.objects.create(text='post', author=self.author,
+                                        group=self.group)
+
+    def counters(self):
+        post = Post.objects.get(pk=self.post.pk)
+        return post.comment_count, post.last_comment_at
+
+    def test_counters_follow_comments_and_cascades(self):
+        reader = User.objects.create(username='temporary')
+        self.client.force_login(reader)
+        self.client.post(reverse('posts:add_comment', args=[self.post.pk]),
+                         {'text': 'первый'})
+        first = Comment.objects.get(text='первый')
+        second = Comment.objects.create(post=self.post, author=self.author,
+                                        text='второй')
+        self.assertEqual(self.counters(), (2, second.created))
+        second.delete()
+        self.assertEqual(self.counters(), (1, first.created))
+        # Комментарии уходят вместе с автором.
+        reader.delete()
+        self.assertEqual(self.counters(), (0, None))
+
+    def test_rolled_back_post_delete_keeps_counters(self):
+        Comment.objects.create(post=self.post, author=self.reader, text='c')
+        comment = Comment.objects.create(post=self.post, author=self.reader,
+                                         text='c')
+
+        def fail(**kwargs):
+            raise DatabaseError('отказ')
+
+        pre_delete.connect(fail, sender=Post)
+        try:
+            with self.assertRaises(DatabaseError), transaction.atomic():
+                self.post.delete()
+        finally:
+            pre_delete.disconnect(fail, sender=Post)
+        comment.delete()
+        self.assertEqual(self.counters()[0], 1)
+
+    def test_feed_shows_count_without_queries(self):
+        Comment.objects.create(post=self.post, author=self.reader, text='c')
+        url = reverse('posts:group', args=[self.group.slug])
+        response = self.client.get(url)
+        self.assertContains(response, 'комментариев: 1')
+        Comment.objects.create(post=self.post, author=self.reader, text='c')
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, 'комментариев: 2')
+
+    def test_comment_keeps_site_wide_generation(self):
+        scopes = ('posts', 'comments', f'group:{self.group.pk}')
+        before = generations(*scopes).split('.')
+        comment = Comment.objects.create(post=self.post, author=self.reader,
+                                         text='c')
+        comment.delete()
+        after = generations(*scopes).split('.')
+        self.assertEqual(after[0], before[0])
+        self.assertNotEqual(after[1], before[1])
+        self.assertNotEqual(after[2], before[2])
+
+    def test_index_shows_new_comment_count(self):
+        self.client.get(reverse('posts:index'))
+        Comment.objects.create(post=self.post, author=self.reader, text='c')
+        self.assertContains(self.client.get(reverse('posts:index')),
+                            'комментариев: 1')
+
+    def test_reconcile_repairs_post_counters(self):
+        Comment.objects.create(post=self.post, author=self.reader, text='c')
+        Post.objects.filter(pk=self.post.pk).update(comment_count=5,
+                                                    last_comment_at=None)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        comment = Comment.objects.get()
+        self.assertEqual(self.counters(), (1, comment.created))
+        self.assertIn('Проверено постов: 1, исправлено расхождений: 1',
+                      out.getvalue())
+
+
+class FollowDedupeMigrationTests(TransactionTestCase):
+    def migrate(self, name):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('posts', name)])
+        return executor.loader.project_state(('posts', name)).apps
+
+    def test_counters_recounted_after_dedupe(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes(
+            'posts')[0][1]
+        self.addCleanup(self.migrate, latest)
+        apps = self.migrate('0012_timelineentry')
+        user_model = apps.get_model('auth', 'User')
+        reader = user_model.objects.create(username='reader')
+        author = user_model.objects.create(username='author')
+        for _ in range(2):
+            apps.get_model('posts', 'Follow').objects.create(
+                user_id=reader.pk, author_id=author.pk)
+        apps = self.migrate('0014_feed_indexes')
+        self.assertEqual(Follow.objects.count(), 1)
+        stats = apps.get_model('posts', 'UserStats').objects
+        self.assertEqual(
+            [stats.values_list('follows_count', 'followers_count').get(
+                user_id=user.pk) for user in (reader, author)],
+            [(1, 0), (0, 1)])
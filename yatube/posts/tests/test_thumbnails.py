@@ -0,0 +1,188 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from sorl.thumbnail import get_thumbnail
+
+from posts import fragments, thumbnails
+from posts.generations import generations
+from posts.models import Group, Post, User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+NEW_POST = reverse('posts:create')
+GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='author')
+        cls.author = Client()
+        cls.author.force_login(cls.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(thumbnails.pending().clear)
+
+    def test_form_stores_dimensions_and_schedules(self):
+        upload = SimpleUploadedFile('thumb.gif', GIF, content_type='image/gif')
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            self.author.post(NEW_POST, {'text': 'с картинкой',
+                                        'image': upload})
+        post = Post.objects.get(text='с картинкой')
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertEqual(post.image_size, len(GIF))
+        schedule.assert_called_once_with(post)
+
+    def test_post_without_image_is_not_scheduled(self):
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            self.author.post(NEW_POST, {'text': 'без картинки'})
+        schedule.assert_not_called()
+        post = Post.objects.get(text='без картинки')
+        self.assertIsNone(post.image_width)
+
+    def test_generate_builds_every_rendition(self):
+        name = default_storage.save('posts/generate.gif', ContentFile(GIF))
+        thumbnails.generate(name)
+        for variant in settings.THUMBNAIL_VARIANTS.values():
+            for width in thumbnails.widths(variant):
+                thumb = thumbnails.thumbnail(name, variant, width)
+                self.assertTrue(thumb.storage.exists(thumb.name))
+
+    def test_widths_are_limited_by_original(self):
+        variant = {'geometry': '480x339', 'widths': (240, 960)}
+        self.assertEqual(thumbnails.widths(variant), [240, 480, 960])
+        self.assertEqual(thumbnails.widths(variant, 600), [240, 480])
+        self.assertEqual(thumbnails.geometry(variant, 240), '240x170')
+
+    def test_picture_markup(self):
+        name = default_storage.save('posts/picture.gif', ContentFile(GIF))
+        group = Group.objects.create(title='Группа', slug='picture',
+                                     description='d')
+        post = Post.objects.create(text='картинка', author=self.user,
+                                   group=group, image=name, image_width=2)
+        response = self.author.get(reverse('posts:post_detail',
+                                           args=[post.pk]))
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, 'width="960" height="339"')
+        self.assertContains(response, ' 960w')
+
+    def test_modern_formats_get_sources(self):
+        name = default_storage.save('posts/modern.gif', ContentFile(GIF))
+        variant = settings.THUMBNAIL_VARIANTS['post_item']
+        sizes = thumbnails.widths(variant, 2)
+
+        def without_format(name, geometry, format=None, **options):
+            # Сборка Pillow в тестах может не уметь WebP.
+            return get_thumbnail(name, geometry, **options)
+
+        with mock.patch.object(thumbnails, 'modern_formats',
+                               return_value=('WEBP',)), \
+                mock.patch.object(thumbnails, 'get_thumbnail',
+                                  side_effect=without_format) as spy:
+            thumbnails.generate(name, 2)
+            context = thumbnails.picture_context(variant, sizes, {
+                (image_format, width): thumbnails.thumbnail(name, variant,
+                                                            width)
+                for image_format in ('WEBP', None) for width in sizes
+            })
+        self.assertEqual([source['type'] for source in context['sources']],
+                         ['image/webp'])
+        formats = {call[1].get('format') for call in spy.call_args_list}
+        self.assertEqual(formats, {'WEBP', None})
+
+    def test_process_image(self):
+        name = default_storage.save('posts/process.gif', ContentFile(GIF))
+        self.assertEqual(thumbnails.process_image(name),
+                         (name, (2, 1, len(GIF)), None))
+        name, dimensions, error = thumbnails.process_image('posts/none.gif')
+        self.assertIsNone(dimensions)
+        self.assertIsNotNone(error)
+
+    def test_pending_generated_after_response(self):
+        name = default_storage.save('posts/pending.gif', ContentFile(GIF))
+        thumbnails.pending().append((name, 2))
+        with mock.patch.object(thumbnails, 'generate') as generate:
+            self.author.get(reverse('posts:index'))
+        generate.assert_called_once_with(name, 2)
+        self.assertEqual(thumbnails.pending(), [])
+
+    def test_pictures_resolved_in_one_query(self):
+        names = [
+            default_storage.save(f'posts/batch{i}.gif',
+                                 ContentFile(GIF + bytes([i])))
+            for i in range(3)
+        ]
+        for name in names:
+            thumbnails.generate(name, 2)
+        cache.clear()
+        with mock.patch.object(thumbnails, 'get_thumbnail') as fallback, \
+                self.assertNumQueries(1):
+            contexts = thumbnails.pictures([(name, 2) for name in names],
+                                           'post_item')
+        fallback.assert_not_called()
+        self.assertEqual(set(contexts), set(names))
+        expected = thumbnails.thumbnail(names[0], settings.THUMBNAIL_VARIANTS[
+            'post_item'], 480)
+        self.assertEqual(contexts[names[0]]['src'], expected.url)
+        with self.assertNumQueries(0):
+            thumbnails.pictures([(name, 2) for name in names], 'post_item')
+
+    def test_pictures_build_only_base_thumbnail(self):
+        name = default_storage.save('posts/missing.gif', ContentFile(GIF))
+        with mock.patch.object(thumbnails, 'get_thumbnail',
+                               wraps=get_thumbnail) as spy:
+            context = thumbnails.picture(name, 'post_item', 2)
+            thumbnails.picture(name, 'post_item', 2)
+        spy.assert_called_once()
+        self.assertTrue(context['partial'])
+        self.assertEqual(context['sources'], [])
+        self.assertEqual((context['width'], context['height']), (480, 339))
+        self.assertTrue(default_storage.exists(
+            context['src'].replace(settings.MEDIA_URL, '', 1)))
+        self.assertEqual(thumbnails.pending(), [(name, 2)])
+        thumbnails.flush()
+        context = thumbnails.picture(name, 'post_item', 2)
+        self.assertFalse(context['partial'])
+        self.assertIn(' 240w', context['srcset'])
+
+    def test_partial_fragment_is_not_cached(self):
+        name = default_storage.save('posts/fragment.gif', ContentFile(GIF))
+        post = Post.objects.create(text='неполная', author=self.user,
+                                   image=name, image_width=2)
+        page = generations(thumbnails.SCOPE)
+        fragments.render_post_items([post])
+        self.assertIsNone(cache.get(fragments.fragment_key(post)))
+        thumbnails.flush()
+        self.assertNotEqual(generations(thumbnails.SCOPE), page)
+        fragments.render_post_items([post])
+        self.assertIsNotNone(cache.get(fragments.fragment_key(post)))
+
+    def test_broken_image_does_not_break_batch(self):
+        name = default_storage.save('posts/ok.gif', ContentFile(GIF))
+        contexts = thumbnails.pictures([(name, 2), ('posts/gone.gif', None)],
+                                       'post_item')
+        self.assertIsNotNone(contexts[name])
+        self.assertIsNone(contexts['posts/gone.gif'])
@@ -0,0 +1,164 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from core import metrics
+from posts import timeline
+from posts.models import Follow, Post, TimelineEntry, User
+
+FOLLOW_INDEX = reverse('posts:follow_index')
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username='reader')
+        cls.author = User.objects.create(username='author')
+        cls.other = User.objects.create(username='other')
+        cls.old_post = Post.objects.create(text='old', author=cls.author)
+
+    def entries(self):
+        return list(self.reader.timeline.values_list('post_id', flat=True))
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.entries(), [self.old_post.pk])
+        follow.delete()
+        self.assertEqual(self.entries(), [])
+
+    def test_new_post_fans_out_to_followers_only(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='new', author=self.author)
+        Post.objects.create(text='foreign', author=self.other)
+        self.assertEqual(self.entries(), [post.pk, self.old_post.pk])
+        post.delete()
+        self.assertEqual(self.entries(), [self.old_post.pk])
+
+    @override_settings(TIMELINE_DEPTH=2)
+    def test_timeline_is_trimmed(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        posts = [Post.objects.create(text=str(i), author=self.author)
+                 for i in range(3)]
+        self.assertEqual(self.entries(), [posts[2].pk, posts[1].pk])
+
+    def test_rebuild(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        TimelineEntry.objects.all().delete()
+        timeline.rebuild()
+        self.assertEqual(self.entries(), [self.old_post.pk])
+
+
+@override_settings(FEED_PULL_THRESHOLD=2, FEED_PUSH_THRESHOLD=1,
+                   PAGINATOR_CONST=3)
+class HybridFeedTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create(username='reader')
+        cls.fan = User.objects.create(username='fan')
+        cls.star = User.objects.create(username='star')
+        cls.author = User.objects.create(username='author')
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.create(user=self.fan, author=self.star)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(timeline.update_pull_authors(), ([self.star.pk], []))
+        self.client.force_login(self.reader)
+
+    def feed_requests(self, path):
+        return metrics.registry.snapshot().get(
+            ('yatube_feed_requests_total', (('path', path),)), 0)
+
+    def test_pull_author_is_merged_at_read_time(self):
+        posts = [
+            Post.objects.create(text=str(i),
+                                author=(self.star, self.author)[i % 2])
+            for i in range(7)
+        ]
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.star).exists())
+        page = self.client.get(FOLLOW_INDEX).context['page_obj']
+        seen = []
+        while True:
+            seen += [post.pk for post in page]
+            if not page.has_next():
+                break
+            page = self.client.get(
+                FOLLOW_INDEX, {'cursor': page.next_cursor}
+            ).context['page_obj']
+        self.assertEqual(seen, [post.pk for post in reversed(posts)])
+        self.assertEqual(self.feed_requests('hybrid'), 3)
+        legacy = self.client.get(FOLLOW_INDEX, {'page': 3})
+        self.assertEqual(len(legacy.context['page_obj']), 1)
+        self.assertEqual(self.feed_requests('legacy'), 1)
+
+    @override_settings(FEED_MERGE_DEPTH=2)
+    def test_merge_depth(self):
+        posts = [Post.objects.create(text=str(i), author=self.star)
+                 for i in range(3)]
+        page = self.client.get(FOLLOW_INDEX).context['page_obj']
+        self.assertEqual(list(page), posts[:0:-1])
+
+    def test_hysteresis_and_demotion_backfill(self):
+        # Пост и подписка, сделанные в pull, минуют ленту.
+        post = Post.objects.create(text='pull', author=self.star)
+        Follow.objects.filter(user=self.reader, author=self.star).delete()
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.filter(user=self.fan).delete()
+        self.assertFalse(
+            TimelineEntry.objects.filter(author=self.star).exists())
+        # Ниже FEED_PULL_THRESHOLD, но не ниже FEED_PUSH_THRESHOLD.
+        self.assertEqual(timeline.update_pull_authors(), ([], []))
+        with override_settings(FEED_PUSH_THRESHOLD=2):
+            out = StringIO()
+            call_command('update_pull_authors', stdout=out)
+        self.assertIn('обратно в push: 1', out.getvalue())
+        self.assertNotIn(self.star.pk, timeline.pull_authors())
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(
+                author=self.star).values_list('user', 'post')),
+            [(self.reader.pk, post.pk)])
+        page = self.client.get(FOLLOW_INDEX).context['page_obj']
+        self.assertEqual(list(page), [post])
+        self.assertEqual(self.feed_requests('push'), 1)
+
+
+class FillTimelinesMigrationTests(TransactionTestCase):
+    def migrate(self, name):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('posts', name)])
+        return executor.loader.project_state(('posts', name)).apps
+
+    @override_settings(TIMELINE_DEPTH=2)
+    def test_fills_trimmed_timelines(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes(
+            'posts')[0][1]
+        self.addCleanup(self.migrate, latest)
+        apps = self.migrate('0011_auto_20220304_2314')
+        user_model = apps.get_model('auth', 'User')
+        reader = user_model.objects.create(username='reader')
+        authors = [user_model.objects.create(username=f'author{i}')
+                   for i in range(2)]
+        posts = [
+            apps.get_model('posts', 'Post').objects.create(
+                text=f'пост {i}', author_id=authors[i % 2].pk)
+            for i in range(4)
+        ]
+        for author in authors + authors[:1]:
+            apps.get_model('posts', 'Follow').objects.create(
+                user_id=reader.pk, author_id=author.pk)
+        apps = self.migrate('0012_timelineentry')
+        entries = apps.get_model('posts', 'TimelineEntry').objects
+        self.assertEqual(
+            list(entries.filter(user_id=reader.pk).order_by(
+                '-post_id').values_list('post_id', flat=True)),
+            [posts[3].pk, posts[2].pk])
@@ -4,6 +4,7 @@ from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from yatube.settings import PAGINATOR_CONST
+from .. import thumbnails
 from ..models import Post, Group, User, Comment, Follow
 
 INDEX = reverse('posts:index')
@@ -111,6 +112,13 @@ class PostPagesTests(TestCase):
         self.assertEqual(len(comments), 1)
         self.assertEqual(self.comment, comments[0])
 
+    def test_post_detail_without_group(self):
+        post = Post.objects.create(text='Без группы', author=self.user)
+        response = self.authorized_client.get(
+            reverse('posts:post_detail', args=[post.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Группа:')
+
     def test_unfollow_index_page_null_or_post_not_in_group2(self):
         urls = [
             GROUP2,
@@ -126,16 +134,32 @@ class PostPagesTests(TestCase):
         self.assertEqual(self.user, response.context.get('author'))
 
     def test_cache_index_page(self):
+        # Страница с неполным набором миниатюр в кэше не задерживается.
+        thumbnails.generate(self.post.image.name)
         page = self.authorized_client.get(INDEX).content
+        Post.objects.filter(pk=self.post.pk).update(text='без сигналов')
+        self.assertEqual(
+            page, self.authorized_client.get(INDEX).content)
         Post.objects.create(
             text='text', author=self.user, group=self.group
         )
-        self.assertEqual(
-            page, self.authorized_client.get(INDEX).content)
-        cache.clear()
         self.assertNotEqual(
             page, self.authorized_client.get(INDEX).content)
 
+    def test_cache_invalidated_by_signals(self):
+        urls = [INDEX, GROUP, PROFILE]
+        pages = [self.guest_client.get(url).content for url in urls]
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое название'
+        group.save()
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Новое имя'
+        user.save()
+        for url, page in zip(urls, pages):
+            with self.subTest(url=url):
+                self.assertNotEqual(
+                    page, self.guest_client.get(url).content)
+
     def test_follow_user(self):
         self.authorized_client2.get(FOLLOW)
         self.assertTrue(Follow.objects.filter(user=self.user2,
@@ -164,3 +188,57 @@ class PaginatorViewsTest(TestCase):
         self.assertEqual(
             len(response.context['page_obj']), PAGINATOR_CONST
         )
+
+
+class KeysetPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='user')
+        Post.objects.bulk_create([Post(author=cls.user,
+                                       text=str(i))
+                                  for i in range(PAGINATOR_CONST * 2 + 3)])
+        cls.expected = list(
+            Post.objects.order_by('-pub_date', '-pk').values_list(
+                'pk', flat=True)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, page, attr):
+        pks = []
+        while True:
+            pks += [post.pk for post in page]
+            cursor = getattr(page, attr)
+            if cursor is None:
+                return pks, page
+            page = self.client.get(
+                INDEX, {'cursor': cursor}).context['page_obj']
+
+    def test_keyset_pages_cover_feed(self):
+        first = self.client.get(
+            INDEX, {'cursor': 'garbage'}).context['page_obj']
+        self.assertIsNone(first.number)
+        self.assertFalse(first.has_previous())
+        forward, last = self.walk(first, 'next_cursor')
+        self.assertEqual(forward, self.expected)
+        self.assertEqual(len(last), 3)
+        backward, first_again = self.walk(last, 'previous_cursor')
+        self.assertEqual(
+            [post.pk for post in first_again],
+            self.expected[:PAGINATOR_CONST]
+        )
+        self.assertEqual(sorted(backward), sorted(self.expected))
+
+    def test_keyset_mode_by_default(self):
+        with self.settings(PAGINATOR_KEYSET=True):
+            page = self.client.get(INDEX).context['page_obj']
+            self.assertIsNone(page.number)
+            self.assertTrue(page.has_next())
+            legacy = self.client.get(INDEX, {'page': 2}).context['page_obj']
+            self.assertEqual(legacy.number, 2)
+            self.assertEqual(
+                [post.pk for post in legacy],
+                self.expected[PAGINATOR_CONST:PAGINATOR_CONST * 2]
+            )
@@ -0,0 +1,290 @@
+"""
+Миниатюры постов.
+
+Каждый вариант из THUMBNAIL_VARIANTS существует в нескольких ширинах
+(srcset) и форматах: современные из THUMBNAIL_MODERN_FORMATS, если их
+умеет Pillow, плюс формат sorl по умолчанию как запасной.
+
+Все миниатюры строятся сразу после сохранения картинки, но уже после
+отправки ответа (request_finished), а не при первом показе поста.
+Если миниатюр всё же не хватает, показ строит только основную, а
+остальные откладывает так же.
+С THUMBNAIL_WORKERS > 0 работа уходит в пул потоков и не занимает даже
+обработчик запроса.
+"""
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from .generations import bump
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_executor = None
+# Поколение кэша страниц, собранных с неполным набором миниатюр.
+SCOPE = 'thumbnails'
+
+
+MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp'}
+
+
+@functools.lru_cache(maxsize=None)
+def modern_formats():
+    """Форматы из THUMBNAIL_MODERN_FORMATS, доступные для записи."""
+    Image.init()
+    return tuple(image_format
+                 for image_format in settings.THUMBNAIL_MODERN_FORMATS
+                 if image_format in Image.SAVE and image_format in MIME_TYPES)
+
+
+def base_size(variant):
+    width, height = variant['geometry'].split('x')
+    return int(width), int(height)
+
+
+def widths(variant, image_width=None):
+    """Ширины для srcset; больше оригинала растягивать незачем."""
+    base_width, _ = base_size(variant)
+    result = sorted(set(variant['widths']) | {base_width})
+    if image_width:
+        limit = max(image_width, base_width)
+        result = [width for width in result if width <= limit]
+    return result
+
+
+def geometry(variant, width):
+    base_width, base_height = base_size(variant)
+    return f'{width}x{round(width * base_height / base_width)}'
+
+
+def rendition_options(variant, image_format=None):
+    options = dict(variant['options'])
+    if image_format:
+        options['format'] = image_format
+    return options
+
+
+def thumbnail(name, variant, width, image_format=None):
+    """Миниатюра через sorl: из KV-хранилища или построенная сейчас."""
+    return get_thumbnail(name, geometry(variant, width),
+                         **rendition_options(variant, image_format))
+
+
+def thumbnail_file(name, geometry_string, options):
+    """Миниатюра под тем же именем, что даст sorl, без обращения к KV."""
+    backend = default.backend
+    source = ImageFile(name)
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, setting in backend.extra_options:
+        value = getattr(thumbnail_settings, setting)
+        if value != getattr(default_settings, setting):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, geometry_string, options),
+        default.storage)
+
+
+def lookup(files):
+    """
+    Записи KV sorl для набора миниатюр: один get_many к кэшу и один
+    IN-запрос за промахами. Возвращает имя миниатюры -> ImageFile.
+    """
+    keys = {add_prefix(file.key): file.name for file in files}
+    if not keys:
+        return {}
+    kv_cache = default.kvstore.cache
+    # Отсутствие записи sorl кэширует маркером, а не строкой.
+    values = {key: value
+              for key, value in kv_cache.get_many(list(keys)).items()
+              if isinstance(value, str)}
+    missing = [key for key in keys if key not in values]
+    if missing:
+        rows = dict(KVStore.objects.filter(key__in=missing).values_list(
+            'key', 'value'))
+        if rows:
+            kv_cache.set_many(rows, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(rows)
+    return {keys[key]: deserialize_image_file(value)
+            for key, value in values.items()}
+
+
+def srcset(renditions, sizes, image_format=None):
+    return ', '.join(
+        f'{renditions[image_format, width].url} {width}w' for width in sizes
+    )
+
+
+def picture_context(variant, sizes, renditions, image_formats=None):
+    base = renditions[None, base_size(variant)[0]]
+    if image_formats is None:
+        image_formats = modern_formats()
+    return {
+        'sources': [
+            {
+                'type': MIME_TYPES[image_format],
+                'srcset': srcset(renditions, sizes, image_format),
+            }
+            for image_format in image_formats
+        ],
+        'src': base.url,
+        'srcset': srcset(renditions, sizes),
+        'sizes': variant['sizes'],
+        'width': base.width,
+        'height': base.height,
+        'partial': False,
+    }
+
+
+def base_picture(name, variant, found, base_file, image_width):
+    """
+    Неполный набор миниатюр: в ответ идёт только основная, остальные
+    достроит flush после ответа.
+    """
+    base_width = base_size(variant)[0]
+    base = found.get(base_file.name) or thumbnail(name, variant, base_width)
+    if (name, image_width) not in pending():
+        pending().append((name, image_width))
+    _local.partial = True
+    context = picture_context(variant, [base_width],
+                              {(None, base_width): base}, ())
+    context['partial'] = True
+    return context
+
+
+def pictures(images, variant_name):
+    """
+    Контексты разметки <picture> для пачки картинок (имя, ширина
+    оригинала) - например, для страницы ленты. Готовые миниатюры
+    читаются одним пакетом. Если какой-то не хватает, в запросе строится
+    только основная (partial=True), остальные уходят в pending(); для
+    битых картинок контекст None.
+    """
+    variant = settings.THUMBNAIL_VARIANTS[variant_name]
+    formats = modern_formats() + (None,)
+    plan = {}
+    for name, image_width in images:
+        sizes = widths(variant, image_width)
+        plan[name] = image_width, sizes, {
+            (image_format, width): thumbnail_file(
+                name, geometry(variant, width),
+                rendition_options(variant, image_format))
+            for image_format in formats for width in sizes
+        }
+    found = lookup([file for _, _, files in plan.values()
+                    for file in files.values()])
+    base_spec = None, base_size(variant)[0]
+    result = {}
+    for name, (image_width, sizes, files) in plan.items():
+        try:
+            if all(file.name in found for file in files.values()):
+                result[name] = picture_context(variant, sizes, {
+                    spec: found[file.name] for spec, file in files.items()
+                })
+            else:
+                result[name] = base_picture(name, variant, found,
+                                            files[base_spec], image_width)
+        except Exception:
+            # Как и тег thumbnail, битая картинка не должна ронять страницу.
+            logger.exception('thumbnails failed for %s', name)
+            result[name] = None
+    return result
+
+
+def picture(name, variant_name, image_width=None):
+    """Контекст разметки <picture> для одной картинки."""
+    return pictures([(name, image_width)], variant_name).get(name)
+
+
+def generate(name, image_width=None):
+    """Строит все миниатюры картинки, уже готовые берутся из хранилища."""
+    for variant in settings.THUMBNAIL_VARIANTS.values():
+        for image_format in modern_formats() + (None,):
+            for width in widths(variant, image_width):
+                thumbnail(name, variant, width, image_format)
+
+
+def generate_safely(name, image_width=None):
+    try:
+        generate(name, image_width)
+    except Exception:
+        logger.exception('thumbnail generation failed for %s', name)
+
+
+def generate_in_background(name, image_width=None, refresh=False):
+    try:
+        generate_safely(name, image_width)
+        if refresh:
+            bump(SCOPE)
+    finally:
+        # Поток пула живёт долго, соединение ему больше не нужно.
+        connection.close()
+
+
+def pending():
+    if not hasattr(_local, 'names'):
+        _local.names = []
+    return _local.names
+
+
+def schedule(post):
+    """После коммита откладывает генерацию миниатюр поста до конца запроса."""
+    name, width = post.image.name, post.image_width
+    if name:
+        transaction.on_commit(lambda: pending().append((name, width)))
+
+
+def flush():
+    """Генерирует отложенные миниатюры; вызывается по request_finished."""
+    global _executor
+    names = pending()
+    if not names:
+        return
+    # Страницы с неполными <picture> после генерации надо пересобрать.
+    refresh = getattr(_local, 'partial', False)
+    _local.names, _local.partial = [], False
+    if not settings.THUMBNAIL_WORKERS:
+        for name, width in names:
+            generate_safely(name, width)
+        if refresh:
+            bump(SCOPE)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.THUMBNAIL_WORKERS,
+                                       thread_name_prefix='thumbnails')
+    for name, width in names:
+        _executor.submit(generate_in_background, name, width, refresh)
+
+
+def dimensions(name):
+    """Ширина, высота и размер файла в байтах; читается только заголовок."""
+    with default_storage.open(name) as file:
+        with Image.open(file) as image:
+            width, height = image.size
+    return width, height, default_storage.size(name)
+
+
+def process_image(name):
+    """Задача для пула процессов: миниатюры и размеры одной картинки."""
+    try:
+        size = dimensions(name)
+        generate(name, size[0])
+        return name, size, None
+    except Exception as error:
+        return name, None, f'{type(error).__name__}: {error}'
@@ -0,0 +1,215 @@
+"""Материализованная лента подписок (fan-out-on-write)."""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Follow, Post, TimelineEntry, UserStats
+
+BATCH_SIZE = 500
+PULL_AUTHORS_KEY = 'timeline:pull_authors'
+
+TRIM_SQL = (
+    'DELETE FROM {table} WHERE id IN ('
+    ' SELECT id FROM ('
+    '  SELECT id, ROW_NUMBER() OVER ('
+    '   PARTITION BY user_id ORDER BY pub_date DESC, post_id DESC'
+    '  ) AS position FROM {table} WHERE user_id IN ({users})'
+    ' ) ranked WHERE position > %s'
+    ')'
+)
+# Ленты читателей целиком: последние TIMELINE_DEPTH постов авторов,
+# на которых они подписаны, кроме pull-авторов (см. feeds). Посты
+# автора ограничены глубиной ленты до сортировки по читателю.
+REBUILD_SQL = (
+    'INSERT INTO {table} (user_id, post_id, author_id, pub_date)'
+    ' SELECT user_id, post_id, author_id, pub_date FROM ('
+    '  SELECT f.user_id, p.id AS post_id, p.author_id, p.pub_date,'
+    '  ROW_NUMBER() OVER ('
+    '   PARTITION BY f.user_id ORDER BY p.pub_date DESC, p.id DESC'
+    '  ) AS position'
+    '  FROM {follows} f JOIN {posts} p ON p.id IN ('
+    '   SELECT id FROM {posts} WHERE author_id = f.author_id'
+    '   ORDER BY pub_date DESC, id DESC LIMIT %s)'
+    '  WHERE f.user_id IN ({users}) AND f.author_id NOT IN ('
+    '   SELECT user_id FROM {stats} WHERE pull_feed = %s)'
+    ' ) ranked WHERE position <= %s'
+)
+# Последние TIMELINE_DEPTH постов автора в ленты всех его подписчиков.
+BACKFILL_AUTHOR_SQL = (
+    '{insert} {table} (user_id, post_id, author_id, pub_date)'
+    ' SELECT f.user_id, p.id, p.author_id, p.pub_date'
+    ' FROM {follows} f JOIN {posts} p ON p.id IN ('
+    '  SELECT id FROM {posts} WHERE author_id = %s'
+    '  ORDER BY pub_date DESC, id DESC LIMIT %s)'
+    ' WHERE f.author_id = %s {suffix}'
+)
+
+
+def merge_cutoff(author_id):
+    """Дата самого старого из FEED_MERGE_DEPTH последних постов автора."""
+    dates = list(Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk').values_list('pub_date', flat=True)[
+        settings.FEED_MERGE_DEPTH - 1:settings.FEED_MERGE_DEPTH])
+    return dates[0] if dates else None
+
+
+def pull_authors():
+    """
+    Авторы, посты которых читаются при запросе ленты (см. feeds): id ->
+    дата, с которой их посты подмешиваются (None - все посты).
+    """
+    authors = cache.get(PULL_AUTHORS_KEY)
+    if authors is None:
+        authors = {
+            author_id: merge_cutoff(author_id)
+            for author_id in UserStats.objects.filter(
+                pull_feed=True).values_list('user_id', flat=True)
+        }
+        cache.set(PULL_AUTHORS_KEY, authors, settings.FEED_PULL_REFRESH)
+    return authors
+
+
+def is_pull_author(author_id):
+    # Запись в ленты сверяется с базой, а не с кэшем: после смены режима
+    # автора ни один пост не проскочит мимо и ленты, и слияния.
+    return UserStats.objects.filter(user_id=author_id,
+                                    pull_feed=True).exists()
+
+
+def update_pull_authors():
+    """
+    Переключает режим авторов: в pull - от FEED_PULL_THRESHOLD
+    подписчиков, обратно в push - ниже FEED_PUSH_THRESHOLD. Вернувшимся
+    в push ленты подписчиков дополняются их постами. Возвращает списки
+    (переведённые в pull, вернувшиеся в push).
+    """
+    stats = UserStats.objects.order_by('user_id')
+    promoted = list(stats.filter(
+        pull_feed=False, followers_count__gte=settings.FEED_PULL_THRESHOLD
+    ).values_list('user_id', flat=True))
+    demoted = list(stats.filter(
+        pull_feed=True, followers_count__lt=settings.FEED_PUSH_THRESHOLD
+    ).values_list('user_id', flat=True))
+    stats.filter(user_id__in=promoted).update(pull_feed=True)
+    stats.filter(user_id__in=demoted).update(pull_feed=False)
+    cache.delete(PULL_AUTHORS_KEY)
+    # Новые посты уже раскладываются по лентам; пока кэш списка не
+    # обновился, чтение ещё подмешивает их и дубликаты отбрасывает.
+    for author_id in demoted:
+        backfill_author(author_id)
+    return promoted, demoted
+
+
+def chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def trim(user_ids):
+    """Обрезает ленты читателей до TIMELINE_DEPTH записей."""
+    table = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        for batch in chunks(user_ids):
+            cursor.execute(
+                TRIM_SQL.format(table=table,
+                                users=', '.join(['%s'] * len(batch))),
+                batch + [settings.TIMELINE_DEPTH],
+            )
+
+
+def add_entries(user_ids, posts):
+    """Раскладывает посты по лентам читателей."""
+    entries = [
+        TimelineEntry(user_id=user_id, post_id=post.pk,
+                      author_id=post.author_id, pub_date=post.pub_date)
+        for user_id in user_ids for post in posts
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE,
+                                      ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Новый пост попадает в ленты всех подписчиков автора."""
+    if is_pull_author(post.author_id):
+        return
+    user_ids = list(Follow.objects.filter(
+        author_id=post.author_id).values_list('user_id', flat=True))
+    if not user_ids:
+        return
+    add_entries(user_ids, [post])
+    trim(user_ids)
+
+
+def backfill(user_id, author_id):
+    """При подписке в ленту попадают последние посты автора."""
+    if is_pull_author(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk').only('pk', 'author_id', 'pub_date')
+    add_entries([user_id], posts[:settings.TIMELINE_DEPTH])
+    trim([user_id])
+
+
+def backfill_author(author_id):
+    """Посты автора, вернувшегося в push, попадают в ленты подписчиков."""
+    sql = BACKFILL_AUTHOR_SQL.format(
+        insert=connection.ops.insert_statement(ignore_conflicts=True),
+        table=TimelineEntry._meta.db_table,
+        follows=Follow._meta.db_table,
+        posts=Post._meta.db_table,
+        suffix=connection.ops.ignore_conflicts_suffix_sql(
+            ignore_conflicts=True),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [author_id, settings.TIMELINE_DEPTH, author_id])
+    trim(list(Follow.objects.filter(author_id=author_id).values_list(
+        'user_id', flat=True)))
+
+
+def reassign(post):
+    """Пост сменил автора: записи переходят к подписчикам нового."""
+    TimelineEntry.objects.filter(post_id=post.pk).delete()
+    fan_out(post)
+
+
+def prune(user_id, author_id):
+    """При отписке посты автора удаляются из ленты."""
+    TimelineEntry.objects.filter(user_id=user_id,
+                                 author_id=author_id).delete()
+
+
+def rebuild(user_ids=None):
+    """
+    Пересобирает ленты с нуля по текущим подпискам: одним
+    INSERT ... SELECT на порцию читателей, а не backfill на подписку.
+    """
+    entries = TimelineEntry.objects.all()
+    if user_ids is None:
+        user_ids = Follow.objects.order_by('user_id').values_list(
+            'user_id', flat=True).distinct()
+    else:
+        entries = entries.filter(user_id__in=user_ids)
+    entries.delete()
+    sql = REBUILD_SQL.format(
+        table=TimelineEntry._meta.db_table,
+        follows=Follow._meta.db_table,
+        posts=Post._meta.db_table,
+        stats=UserStats._meta.db_table,
+        users='{users}',
+    )
+    with connection.cursor() as cursor:
+        for batch in chunks(user_ids):
+            cursor.execute(
+                sql.format(users=', '.join(['%s'] * len(batch))),
+                [settings.TIMELINE_DEPTH] + batch
+                + [True, settings.TIMELINE_DEPTH],
+            )
+
+
+def timeline_posts(entries):
+    """Посты для страницы записей ленты в том же порядке."""
+    posts = Post.objects.select_related('author', 'group').in_bulk(
+        [entry.post_id for entry in entries])
+    return [posts[entry.post_id] for entry in entries
+            if entry.post_id in posts]
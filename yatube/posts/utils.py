@@ -1,9 +1,209 @@
-from django.core.paginator import Paginator
 from django.conf import settings
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_datetime
+
+CURSOR_PARAM = 'cursor'
+CURSOR_SALT = 'posts.cursor'
+
+
+def encode_cursor(values, reverse=False):
+    """Непрозрачный токен позиции в ленте."""
+    return signing.dumps(
+        [value.isoformat() if hasattr(value, 'isoformat') else value
+         for value in values] + [int(reverse)],
+        salt=CURSOR_SALT,
+        compress=True,
+    )
+
+
+def decode_cursor(token):
+    """Позиция и направление из токена или None, если токен испорчен."""
+    try:
+        *values, reverse = signing.loads(token, salt=CURSOR_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    values = [parse_datetime(value) or value if isinstance(value, str)
+              else value for value in values]
+    return values, bool(reverse)
+
+
+class KeysetPage:
+    """Страница ленты без номера: только соседние курсоры."""
+
+    number = None
+
+    def __init__(self, object_list, paginator, cursor=None,
+                 next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<KeysetPage {self.cursor or "first"}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Пагинация по ключу (pub_date, pk) вместо LIMIT/OFFSET.
+
+    Не выполняет COUNT(*): наличие следующей страницы определяется
+    запросом одной лишней записи (probe). Без probe следующая страница
+    считается существующей, если текущая заполнена целиком.
+    """
+
+    def __init__(self, object_list, per_page, keys=('pub_date', 'pk'),
+                 probe=True, resolve=None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.keys = keys
+        self.probe = probe
+        self.resolve = resolve
+
+    def row_key(self, row):
+        return tuple(getattr(row, key) for key in self.keys)
+
+    def filter_after(self, queryset, position, reverse=False):
+        """Записи строго после позиции (или до неё при reverse)."""
+        lookup = 'gt' if reverse else 'lt'
+        first, second = self.keys
+        return queryset.filter(
+            Q(**{f'{first}__{lookup}': position[0]})
+            | Q(**{first: position[0], f'{second}__{lookup}': position[1]})
+        )
+
+    def order(self, queryset, reverse=False):
+        prefix = '' if reverse else '-'
+        return queryset.order_by(*(prefix + key for key in self.keys))
+
+    def fetch_rows(self, position, reverse, limit):
+        queryset = self.object_list
+        if position is not None:
+            queryset = self.filter_after(queryset, position, reverse)
+        return list(self.order(queryset, reverse)[:limit])
+
+    def get_page(self, cursor=None):
+        decoded = decode_cursor(cursor) if cursor else None
+        if decoded and len(decoded[0]) != len(self.keys):
+            decoded = None
+        position, reverse = decoded if decoded else (None, False)
+        limit = self.per_page + 1 if self.probe else self.per_page
+        rows = self.fetch_rows(position, reverse, limit)
+        has_more = (len(rows) > self.per_page if self.probe
+                    else len(rows) == self.per_page)
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+        has_next, has_previous = (
+            (position is not None, has_more) if reverse
+            else (has_more, position is not None)
+        )
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(self.row_key(rows[-1]))
+        if rows and has_previous:
+            previous_cursor = encode_cursor(self.row_key(rows[0]),
+                                            reverse=True)
+        object_list = self.resolve(rows) if self.resolve else rows
+        return KeysetPage(object_list, self, cursor if decoded else None,
+                          next_cursor, previous_cursor)
+
+
+def estimate_count(queryset):
+    """
+    Оценка числа строк таблицы без COUNT(*): reltuples из статистики
+    PostgreSQL, на остальных базах - наибольший первичный ключ (с учётом
+    удалённых строк это оценка сверху). None, если оценки нет.
+    """
+    model = queryset.model
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class'
+                           ' WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row and row[0] >= 0 else None
+    return model._default_manager.using(queryset.db).aggregate(
+        estimate=Max('pk'))['estimate']
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator для списков админки на больших таблицах.
+
+    Число записей без фильтров берётся из estimate_count, с фильтрами
+    считается не дальше ADMIN_EXACT_COUNT_LIMIT строк: COUNT(*) по
+    миллионам постов стоит дороже всей остальной страницы. Если предел
+    достигнут, число берётся из оценки всей таблицы - она не меньше
+    отфильтрованного, и страницы дальше предела остаются доступны.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_count(queryset)
+            if estimate is not None and estimate > limit:
+                return estimate
+        count = queryset.order_by()[:limit].count()
+        if count < limit:
+            return count
+        return max(estimate_count(queryset) or 0, limit)
+
 
+def get_page_context(queryset, request, keys=('pub_date', 'pk'),
+                     resolve=None, keyset=None):
+    """
+    Страница ленты.
 
-def get_page_context(queryset, request):
-    paginator = Paginator(queryset, settings.PAGINATOR_CONST)
+    Запрос с ?cursor= (или любой запрос без ?page= при
+    PAGINATOR_KEYSET) обслуживается курсорной пагинацией, старые
+    ссылки вида ?page=N продолжают работать через Paginator.
+    resolve превращает строки страницы в посты, если лента строится
+    не по Post. Явно переданный keyset-пагинатор используется и для
+    первой страницы.
+    """
+    cursor = request.GET.get(CURSOR_PARAM)
     page_number = request.GET.get('page')
+    prefer_keyset = settings.PAGINATOR_KEYSET or keyset is not None
+    if cursor or (prefer_keyset and page_number is None):
+        paginator = keyset or KeysetPaginator(
+            queryset,
+            settings.PAGINATOR_CONST,
+            keys=keys,
+            probe=settings.PAGINATOR_KEYSET_PROBE,
+            resolve=resolve,
+        )
+        return paginator.get_page(cursor)
+    paginator = Paginator(
+        queryset.order_by(*('-' + key for key in keys)),
+        settings.PAGINATOR_CONST
+    )
     page_obj = paginator.get_page(page_number)
+    if resolve:
+        page_obj.object_list = resolve(page_obj.object_list)
     return page_obj
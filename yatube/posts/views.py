@@ -1,52 +1,121 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 
-from .utils import get_page_context
+from . import search, thumbnails
+from .feeds import follow_page
+from .utils import CURSOR_PARAM, KeysetPaginator, get_page_context
 from .forms import PostForm, CommentForm
-from .models import Post, User, Group, Follow
+from .generations import generations
+from .models import Comment, Post, User, Group, Follow
+from .stats import get_stats
+
+
+def fragment_cache(*scopes):
+    """Время жизни и версия кэша фрагментов страницы."""
+    return {
+        'cache_ttl': settings.CACHE_S,
+        'cache_version': generations(*scopes),
+    }
 
 
 def index(request):
     return render(request, 'posts/index.html', {
-        'page_obj': get_page_context(Post.objects.all(), request),
+        **fragment_cache('posts', 'comments', thumbnails.SCOPE),
+        'page_obj': get_page_context(
+            Post.objects.select_related('author', 'group'), request),
     })
 
 
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
     return render(request, 'posts/group_list.html', {
+        **fragment_cache(f'group:{group.pk}', 'users',
+                         thumbnails.SCOPE),
         'group': group,
-        'page_obj': get_page_context(group.posts.all(), request),
+        'page_obj': get_page_context(
+            group.posts.select_related('author'), request),
     })
 
 
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
     following = (request.user != author
                  and request.user.is_authenticated
                  and Follow.objects.filter(user=request.user,
                                            author=author).exists())
     return render(request, 'posts/profile.html', {
+        **fragment_cache(f'author:{author.pk}', 'users', 'groups',
+                         thumbnails.SCOPE),
         'author': author,
-        'page_obj': get_page_context(author.posts.all(), request),
+        'stats': get_stats(author),
+        'page_obj': get_page_context(
+            author.posts.select_related('group'), request),
         'following': following,
     })
 
 
+def comments_page(post_id, cursor=None):
+    """Последние комментарии поста, более старые - по курсору."""
+    return KeysetPaginator(
+        Comment.objects.filter(post_id=post_id).select_related('author'),
+        settings.COMMENTS_PER_PAGE,
+        keys=('created', 'pk'),
+        probe=settings.PAGINATOR_KEYSET_PROBE,
+    ).get_page(cursor)
+
+
 def post_detail(request, post_id):
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), pk=post_id)
+    # Комментарии видны только вошедшим пользователям.
+    comments = (comments_page(post.pk, request.GET.get(CURSOR_PARAM))
+                if request.user.is_authenticated else None)
     return render(request, 'posts/post_detail.html', {
-        'post': get_object_or_404(Post, pk=post_id),
+        'post': post,
+        'author_stats': get_stats(post.author),
+        'comments': comments,
         'form': CommentForm(),
     })
 
 
 @login_required
+def post_comments(request, post_id):
+    """Следующая порция комментариев: HTML-фрагмент или JSON."""
+    comments = comments_page(post_id, request.GET.get(CURSOR_PARAM))
+    # Пост проверяется, только когда комментариев нет: лишний запрос
+    # нужен лишь пустой странице.
+    if not comments and not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'comments': [{
+                'id': comment.pk,
+                'author': comment.author.username,
+                'text': comment.text,
+                'created': comment.created.isoformat(),
+            } for comment in comments],
+            'next_cursor': comments.next_cursor,
+        })
+    return render(request, 'posts/includes/comment_list.html', {
+        'post_id': post_id,
+        'comments': comments,
+    })
+
+
+@login_required
+@transaction.atomic
 def post_create(request):
     form = PostForm(request.POST or None, request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        if 'image' in form.changed_data:
+            thumbnails.schedule(post)
         return redirect('posts:profile', username=request.user)
     return render(request, 'posts/create_post.html', {'form': form})
 
@@ -63,6 +132,8 @@ def post_edit(request, post_id):
     )
     if form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            thumbnails.schedule(post)
         return redirect('posts:post_detail', post.pk)
     context = {
         'form': form,
@@ -73,6 +144,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -84,15 +156,23 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    return render(request, 'posts/search.html', {
+        'query': query,
+        'page_obj': search.search_page(request, query) if query else None,
+    })
+
+
 @login_required
 def follow_index(request):
     return render(request, 'posts/follow.html', {
-        'page_obj': get_page_context(Post.objects.filter(
-            author__following__user=request.user), request)
+        'page_obj': follow_page(request),
     })
 
 
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author != request.user:
@@ -101,6 +181,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     get_object_or_404(
         Follow,
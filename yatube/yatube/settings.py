@@ -43,10 +43,12 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'sorl.thumbnail',
-    'debug_toolbar',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,9 +56,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
 ]
 
+# debug toolbar только для разработки: в production запросы
+# профилируются по требованию (PROFILING_*)
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    # Перед QueryBudgetMiddleware, как раньше
+    MIDDLEWARE.insert(-1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ] 
@@ -88,11 +97,36 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django.db.backends.sqlite3 с PRAGMA и BEGIN IMMEDIATE
+        'ENGINE': 'core.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Соединение переживает запрос: файл не открывается и PRAGMA не
+        # выполняются заново на каждый запрос
+        'CONN_MAX_AGE': 60,
     }
 }
 
+# PRAGMA каждого нового соединения SQLite (core.sqlite), по порядку:
+# ждать чужую запись до 5 с вместо «database is locked»; WAL - читатели
+# не ждут писателя; synchronous=NORMAL достаточно для целостности в WAL;
+# файл базы отображается в память, кэш страниц 64 МиБ (отрицательное
+# значение - в КиБ), временные таблицы сортировок - в памяти
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 2**20,
+    'cache_size': -64 * 2**10,
+    'temp_store': 'memory',
+}
+# Периоды задач manage.py sqlite_maintenance --loop, секунд
+SQLITE_MAINTENANCE = {
+    'checkpoint': 5 * 60,
+    'optimize': 60 * 60,
+    'analyze': 24 * 60 * 60,
+    'incremental_vacuum': 24 * 60 * 60,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -140,18 +174,140 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 PAGINATOR_CONST = 10
-
-CACHE_S = 20
+# Курсорная пагинация лент по умолчанию (без ?page=N и COUNT(*))
+PAGINATOR_KEYSET = False
+# Проверять наличие следующей страницы запросом одной лишней записи
+PAGINATOR_KEYSET_PROBE = True
+# Комментариев под постом сразу и в каждой догрузке
+COMMENTS_PER_PAGE = 20
+# Сколько строк админка считает точно, дальше - оценка
+# (posts.utils.EstimatedCountPaginator)
+ADMIN_EXACT_COUNT_LIMIT = 10000
+# Поиск ранжирует только столько самых свежих совпадений: bm25 по
+# слову, которое есть в половине постов, стоил бы секунды
+SEARCH_MAX_CANDIDATES = 10000
+
+# Время жизни фрагментов страниц: они сбрасываются сигналами моделей
+# (posts.generations), поэтому могут жить долго
+CACHE_S = 60 * 60 * 6
+
+# Время жизни HTML-фрагментов отдельных постов (ключ включает версию
+# содержимого, так что устаревшие фрагменты не читаются)
+POST_FRAGMENT_TTL = 60 * 60 * 24
+
+# Сколько последних постов хранится в ленте подписок каждого читателя
+TIMELINE_DEPTH = 500
+# Посты авторов с таким числом подписчиков не раскладываются по лентам,
+# а подмешиваются при чтении. Режим переключает периодическая команда
+# update_pull_authors; обратно в push автор уходит, только когда
+# подписчиков меньше FEED_PUSH_THRESHOLD, чтобы у порога он не
+# переключался туда и обратно
+FEED_PULL_THRESHOLD = 10000
+FEED_PUSH_THRESHOLD = 8000
+# Как часто процессы перечитывают список таких авторов, секунд
+FEED_PULL_REFRESH = 300
+# Сколько последних постов каждого такого автора подмешивается в ленту
+FEED_MERGE_DEPTH = 500
+
+# Максимум SQL-запросов на один запрос к представлению
+QUERY_BUDGETS = {
+    'posts:index': 5,
+    'posts:group': 5,
+    'posts:profile': 6,
+    'posts:post_detail': 5,
+    'posts:follow_index': 5,
+    'posts:search': 5,
+    'posts:comments': 3,
+}
+# Превышение бюджета - исключение, а не предупреждение в логе
+# (включается в тестах бюджетов)
+QUERY_BUDGET_STRICT = False
+
+# Профилирование отдельных запросов (core.middleware.ProfilingMiddleware):
+# доля случайно выбранных запросов (0 - только по заголовку X-Profile),
+# срок действия подписанного заголовка, каталог и число хранимых профилей
+PROFILING_SAMPLE_RATE = 0
+PROFILING_TOKEN_MAX_AGE = 60 * 60
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILING_KEEP = 200
+
+# Метрики Prometheus (core.metrics, /metrics): читать их может staff или
+# сборщик с заголовком "Authorization: Bearer <METRICS_TOKEN>" (None -
+# только staff). В METRICS_DIR процессы сервера оставляют свои снимки
+# для суммирования (None - только текущий процесс); каталог общий для
+# воркеров одного сервера. Снимки завершившихся процессов сбор
+# складывает в один base.json. Сервер разработки работает одним процессом.
+METRICS_TOKEN = None
+METRICS_DIR = None if DEBUG else os.path.join(BASE_DIR, 'metrics')
+# Как часто процесс обновляет свой снимок, секунд
+METRICS_FLUSH_INTERVAL = 5
+# Метки префиксов ключей кэша в метриках; остальные ключи - 'other'
+METRICS_CACHE_PREFIXES = (
+    ('template.cache.index_page.', 'index_page'),
+    ('template.cache.group_page.', 'group_page'),
+    ('template.cache.profile_page.', 'profile_page'),
+    ('post_item:', 'post_item'),
+    ('sorl-thumbnail', 'thumbnails'),
+    ('generation:', 'generation'),
+    ('timeline:', 'timeline'),
+)
+
+# Журнал медленных SQL (core.slow_queries): порог в мс (None - журнал
+# выключен), файл и его ротация
+SLOW_QUERY_THRESHOLD_MS = 200
+SLOW_QUERY_LOG = os.path.join(BASE_DIR, 'logs', 'slow_queries.log')
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 2**20
+SLOW_QUERY_LOG_BACKUPS = 5
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
-
+# Картинки моложе стольких секунд не удаляются: пост, загрузивший
+# такую же, мог ещё не попасть в базу
+MEDIA_MIN_AGE = 60 * 60
+
+# Варианты картинки поста: базовая геометрия (она же width/height в
+# разметке), ширины для srcset и атрибут sizes. Все миниатюры строятся
+# сразу после загрузки картинки
+THUMBNAIL_VARIANTS = {
+    'post_item': {
+        'geometry': '480x339',
+        'widths': (240, 480, 960),
+        'sizes': '(max-width: 576px) 100vw, 480px',
+        'options': {'crop': 'center', 'upscale': True},
+    },
+    'post_detail': {
+        'geometry': '960x339',
+        'widths': (480, 960, 1440),
+        'sizes': '(max-width: 768px) 100vw, 75vw',
+        'options': {'crop': 'center', 'upscale': True},
+    },
+}
+# Дополнительные форматы в порядке предпочтения; используются только те,
+# что умеет сохранять установленный Pillow. Запасной вариант - формат
+# миниатюр sorl по умолчанию
+THUMBNAIL_MODERN_FORMATS = ('AVIF', 'WEBP')
+# Потоков генерации на процесс; 0 - генерировать в обработчике запроса
+# после отправки ответа
+THUMBNAIL_WORKERS = 0
+
+# Двухуровневый кэш: LRU в памяти процесса перед общим бэкендом 'shared'.
+# Локально 'shared' живёт в памяти, в production это memcached или redis.
 CACHES = {
     'default': {
+        'BACKEND': 'core.cache.TwoTierCache',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            'LOCK_WAIT': 2,
+        },
+    },
+    'shared': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'LOCATION': 'shared',
+    },
 }
 
 POST_PATH = 'posts'